@@ -10,27 +10,74 @@ def create_app():
     app.config.update(CONFIG)
     
     # 初始化服务
+    from .services.http_client import HttpClient
+    from .services.upstream_governor import UpstreamGovernor
+    from .services.cdn_fetcher import CdnFetcher
     from .services.credential_manager import CredentialManager
     from .services.cover_manager import CoverManager
     from .services.file_manager import FileManager
     from .services.metadata_manager import MetadataManager
     from .services.music_downloader import MusicDownloader
+    from .services.search_cache import SearchCache
+    from .services.request_coalescer import RequestCoalescer
+    from .services.url_batcher import SongUrlBatcher
+    from .services.url_cache import PlayUrlCache
+    from .services.url_resolver import UrlResolver
+    from .services.cover_cache import CoverCache
+    from .services.lyric_store import LyricStore
+    from .services.library_index import LibraryIndex
+    from .services.library_evictor import LibraryEvictor
+    from .services.stream_proxy import StreamProxy
+    from .services.library_exporter import LibraryExporter
+    from .services.download_queue import DownloadQueue
     
     # 创建服务实例
+    http_client = HttpClient(app.config)
+    upstream_governor = UpstreamGovernor(app.config)
+    cdn_fetcher = CdnFetcher(app.config, http_client, upstream_governor)
     credential_manager = CredentialManager(app.config)
-    cover_manager = CoverManager(app.config)
-    file_manager = FileManager(app.config)
+    url_batcher = SongUrlBatcher(app.config, upstream_governor)
+    request_coalescer = RequestCoalescer(app.config, url_batcher, upstream_governor)
+    play_url_cache = PlayUrlCache(app.config, request_coalescer)
+    url_resolver = UrlResolver(app.config, play_url_cache)
+    lyric_store = LyricStore(app.config, request_coalescer)
+    library_index = LibraryIndex(app.config)
+    library_evictor = LibraryEvictor(app.config, library_index)
+    library_exporter = LibraryExporter(app.config, library_index)
+    cover_cache = CoverCache(app.config)
+    cover_manager = CoverManager(app.config, cdn_fetcher, cover_cache)
+    file_manager = FileManager(app.config, cdn_fetcher, library_index)
+    stream_proxy = StreamProxy(app.config, file_manager, library_index)
     metadata_manager = MetadataManager(app.config, cover_manager)
     music_downloader = MusicDownloader(
-        app.config, credential_manager, file_manager, metadata_manager
+        app.config, credential_manager, file_manager, metadata_manager,
+        request_coalescer, play_url_cache, url_resolver, lyric_store, library_index,
+        stream_proxy
     )
+    search_cache = SearchCache(app.config)
+    download_queue = DownloadQueue(app.config, music_downloader)
     
     # 将服务实例保存到app配置中以便访问
+    app.config['http_client'] = http_client
+    app.config['upstream_governor'] = upstream_governor
+    app.config['cdn_fetcher'] = cdn_fetcher
     app.config['credential_manager'] = credential_manager
     app.config['music_downloader'] = music_downloader
     app.config['cover_manager'] = cover_manager
+    app.config['cover_cache'] = cover_cache
     app.config['file_manager'] = file_manager
     app.config['metadata_manager'] = metadata_manager
+    app.config['search_cache'] = search_cache
+    app.config['request_coalescer'] = request_coalescer
+    app.config['url_batcher'] = url_batcher
+    app.config['play_url_cache'] = play_url_cache
+    app.config['url_resolver'] = url_resolver
+    app.config['lyric_store'] = lyric_store
+    app.config['library_index'] = library_index
+    app.config['library_evictor'] = library_evictor
+    app.config['library_exporter'] = library_exporter
+    app.config['stream_proxy'] = stream_proxy
+    app.config['download_queue'] = download_queue
     
     # 注册蓝图
     from .routes.web_routes import bp as web_bp
@@ -45,6 +92,17 @@ def create_app():
 
 def init_app(app):
     """初始化应用"""
+    # 创建共享的 qqmusic_api 会话，后续所有上游请求复用同一连接池
+    app.config['http_client'].init_api_session()
+
+    # 清理过期的未完成下载文件（未过期的保留用于续传）
+    app.config['file_manager'].cleanup_partial_files()
+
+    # 音乐库索引与音乐目录对账（处理手动添加或删除的文件）
+    app.config['library_index'].reconcile()
+    # 启动音乐目录容量控制（超出容量上限时在后台按LRU清理）
+    app.config['library_evictor'].start()
+
     credential_manager = app.config['credential_manager']
     credential_manager.load_and_refresh_sync()
     logger = logging.getLogger("qqmusic_web")
@@ -54,5 +112,6 @@ def init_app(app):
 
 def stop_all_threads():
     """停止所有后台线程"""
-    from .utils.thread_utils import thread_pool
-    thread_pool.shutdown(wait=False)
\ No newline at end of file
+    from .utils.thread_utils import thread_pool, background_loop
+    background_loop.stop()
+    thread_pool.shutdown(wait=False)
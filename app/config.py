@@ -25,15 +25,18 @@ def get_config():
         base_dir = Path("/app")
         credential_dir = base_dir / "credential"
         music_dir = base_dir / "music"
+        cache_dir = base_dir / "cache"
     else:
         # 非容器环境 - 使用项目根目录
         base_dir = get_project_root()
         credential_dir = base_dir / "credential"
         music_dir = base_dir / "music"
+        cache_dir = base_dir / "cache"
 
     # 确保目录存在
     credential_dir.mkdir(exist_ok=True)
     music_dir.mkdir(exist_ok=True)
+    cache_dir.mkdir(exist_ok=True)
     
     # 凭证文件路径
     credential_file = credential_dir / "qqmusic_cred.pkl"
@@ -41,10 +44,88 @@ def get_config():
     return {
         "CREDENTIAL_FILE": str(credential_file),
         "MUSIC_DIR": str(music_dir),
+        "CACHE_DIR": str(cache_dir),  # 封面等缓存数据目录
         "MAX_FILENAME_LENGTH": 100,
         "COVER_SIZE": 800,  # 封面尺寸[150, 300, 500, 800]
+        "COVER_MEMORY_CACHE_SIZE": 64,  # 内存中缓存的封面图片数（其余保存在磁盘缓存中）
+        "COVER_DISK_CACHE_MAX_BYTES": 200 * 1024 * 1024,  # 磁盘封面缓存容量上限（字节），超出后清理最久未使用的，0 表示不限制
+        "COVER_NEGATIVE_TTL": 3600,  # 无效候选封面的记录有效期（秒）
+        "COVER_PROBE_TIMEOUT": 10,  # 探测单个候选封面的超时时间（秒）
+        "COVER_HTTP_MAX_AGE": 7 * 24 * 3600,  # 封面接口的浏览器缓存时间（秒）
         "DOWNLOAD_TIMEOUT": 60,
+        "DOWNLOAD_CHUNK_SIZE": 256 * 1024,  # 流式下载写盘块大小（字节）
+        "CDN_CONNECT_TIMEOUT": 5,  # CDN请求的连接超时（秒）
+        "CDN_READ_TIMEOUT": 15,  # CDN请求每次读取数据的超时（秒），不限制整个下载的总时间
+        "CDN_RETRY_ATTEMPTS": 3,  # CDN请求最多尝试次数（连接失败、超时、服务器错误或传输过慢时重试）
+        "CDN_RETRY_BACKOFF": 0.5,  # 首次重试前的等待时间（秒），之后每次翻倍
+        "CDN_RETRY_BACKOFF_MAX": 8,  # 重试等待时间上限（秒）
+        "CDN_HEDGE_ENABLED": True,  # 首字节过慢时是否发出相同的对冲请求，取先响应的
+        "CDN_HEDGE_PERCENTILE": 0.95,  # 首字节时间超过该主机历史的该分位数时发出对冲请求
+        "CDN_HEDGE_DEFAULT_DELAY": 1.0,  # 历史样本不足时发出对冲请求的等待时间（秒）
+        "CDN_HEDGE_MIN_DELAY": 0.2,  # 发出对冲请求前的最短等待时间（秒）
+        "CDN_STATS_WINDOW": 100,  # 每个CDN主机保留的最近首字节时间和传输速度样本数
+        "CDN_STATS_MIN_SAMPLES": 10,  # 按历史样本判断慢请求前至少需要的样本数
+        "CDN_SLOW_PERCENTILE": 0.05,  # 分段传输速度低于该主机历史的该分位数时重新请求剩余部分
+        "CDN_SLOW_GRACE": 3.0,  # 开始传输后多久才检查传输速度（秒）
+        "SEGMENTED_DOWNLOAD_ENABLED": True,  # 大文件是否启用多连接分段下载
+        "DOWNLOAD_SEGMENTS": 4,  # 分段下载的并发连接数
+        "SEGMENT_THRESHOLD": 8 * 1024 * 1024,  # 启用分段下载的最小文件大小（字节）
+        "PARTIAL_META_INTERVAL": 1.0,  # 未完成下载进度记录的保存间隔（秒）
+        "PARTIAL_DOWNLOAD_MAX_AGE": 7 * 24 * 3600,  # 未完成下载文件的保留时间（秒）
+        "LIBRARY_SENDFILE_MODE": "",  # 音乐文件发送方式: 空（应用直接发送）/ x-accel（nginx）/ x-sendfile（Apache等）
+        "LIBRARY_ACCEL_PREFIX": "/music-internal/",  # x-accel 模式下 nginx 中映射到音乐目录的 internal location
+        "PLAYBACK_PROXY_ENABLED": False,  # 播放时是否经由本服务代理CDN音频（同时保存到音乐目录）
+        "PLAYBACK_PROXY_READ_TIMEOUT": 30,  # 代理播放等待下载数据的超时时间（秒）
+        "PLAYBACK_PROXY_SESSION_TTL": 3600,  # 已结束的代理播放会话保留时间（秒）
+        "EXPORT_MAX_FILES": 1000,  # 单次导出ZIP最多包含的文件数
+        "EXPORT_CHUNK_SIZE": 256 * 1024,  # 导出ZIP时读取文件的块大小（字节）
+        "MUSIC_DIR_MAX_BYTES": 0,  # 音乐目录容量上限（字节），超出后按LRU清理，0 表示不限制
+        "MUSIC_EVICTION_TARGET_RATIO": 0.9,  # 清理时降到容量上限的比例
+        "MUSIC_EVICTION_INTERVAL": 10,  # 检查音乐目录容量的间隔（秒）
+        "MUSIC_EVICTION_BATCH": 50,  # 每批最多清理的文件数
+        "MUSIC_EVICTION_MIN_IDLE": 300,  # 最近访问过的文件在此时间内不会被清理（秒）
+        "HTTP_POOL_LIMIT": 100,  # 共享连接池最大连接数
+        "HTTP_POOL_LIMIT_PER_HOST": 16,  # 单个主机最大连接数
+        "HTTP_DNS_CACHE_TTL": 300,  # DNS缓存有效期（秒）
+        "HTTP_KEEPALIVE_TIMEOUT": 30,  # 空闲连接保持时间（秒）
+        "DOWNLOAD_JOB_WORKERS": 3,  # 异步下载任务并发数
+        "DOWNLOAD_JOB_RESERVED_WORKERS": 1,  # 其中只执行交互式（单曲）任务的数量，批量任务不会占用
+        "DOWNLOAD_JOB_HISTORY": 200,  # 保留的已结束下载任务数
+        "BATCH_DOWNLOAD_CONCURRENCY": 4,  # 批量下载默认并发数
+        "BATCH_DOWNLOAD_MAX_CONCURRENCY": 8,  # 批量下载并发数上限
+        "BATCH_DOWNLOAD_MAX_SONGS": 500,  # 单次批量下载最多歌曲数
+        "URL_BATCH_WINDOW_MS": 5,  # 歌曲URL微批处理的收集窗口（毫秒）
+        "URL_BATCH_MAX_SIZE": 50,  # 歌曲URL微批处理单批最多歌曲数
+        # 各类上游请求的限流参数：每秒请求数、突发请求数、最大并发数、目标延迟（秒，超出时降低并发）；cdn 和 cover 按主机分别计算
+        "UPSTREAM_LIMITS": {
+            "search": {"rate": 5, "burst": 10, "concurrency": 8, "latency_target": 2.0},
+            "song_urls": {"rate": 10, "burst": 20, "concurrency": 8, "latency_target": 2.0},
+            "lyric": {"rate": 10, "burst": 20, "concurrency": 8, "latency_target": 2.0},
+            "album_songs": {"rate": 5, "burst": 10, "concurrency": 4, "latency_target": 2.0},
+            "cdn": {"rate": 50, "burst": 100, "concurrency": 64, "latency_target": 3.0},  # 延迟按首字节时间计算
+            "cover": {"rate": 20, "burst": 40, "concurrency": 16, "latency_target": 2.0}
+        },
+        "UPSTREAM_QUEUE_TIMEOUT": 10,  # 等待限流或并发名额的最长时间（秒），超出时直接失败
+        "UPSTREAM_BREAKER_WINDOW": 20,  # 熔断器统计的最近请求数
+        "UPSTREAM_BREAKER_MIN_CALLS": 10,  # 熔断器判断前至少需要的请求数
+        "UPSTREAM_BREAKER_ERROR_RATE": 0.5,  # 最近请求错误率达到该值时熔断
+        "UPSTREAM_BREAKER_COOLDOWN": 30,  # 熔断后暂停请求的时间（秒），之后放行一个探测请求
+        "PLAY_URL_CACHE_TTL": 1800,  # 播放URL缓存有效期（秒），URL自带过期时间时取较小值
+        "PLAY_URL_NEGATIVE_TTL": 300,  # "该音质无URL"结果的缓存有效期（秒）
+        "PLAY_URL_EXPIRY_MARGIN": 60,  # 距URL过期时间的安全余量（秒）
+        "PLAY_URL_CACHE_SIZE": 4096,  # 播放URL缓存最大条目数
+        "URL_RESOLVE_BATCH_SIZE": 100,  # 批量获取URL时每次请求的歌曲数（上游单次上限100）
+        "STREAM_TAGGING_ENABLED": True,  # 是否在下载过程中直接写入标签（失败时下载后再写入）
+        "STREAM_TAG_RESERVE": 256 * 1024,  # 下载开始时标签数据未就绪时为标签预留的字节数
+        "STREAM_TAG_PADDING": 4096,  # 标签数据已就绪时额外预留的填充字节数
+        "TAG_WRITE_EXECUTOR": "thread",  # 标签写入工作池类型: thread / process
+        "TAG_WRITE_WORKERS": 2,  # 标签写入工作池大小
+        "LYRIC_CACHE_TTL": 7 * 24 * 3600,  # 歌词缓存有效期（秒）
+        "LYRIC_MEMORY_CACHE_SIZE": 512,  # 内存中缓存的歌词数
+        "LYRIC_CACHE_MAX_ENTRIES": 20000,  # 磁盘（SQLite）中最多缓存的歌词数
         "SEARCH_LIMIT": 10,
+        "SEARCH_CACHE_TTL": 300,  # 搜索结果缓存有效期（秒）
+        "SEARCH_CACHE_SIZE": 256,  # 搜索结果缓存最大条目数
         "SERVER_HOST": "0.0.0.0",
         "SERVER_PORT": 6022,
         "IS_CONTAINER": is_container  # 环境标识
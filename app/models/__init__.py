@@ -1,4 +1,14 @@
 from .song_info import SongInfo
 from .download_result import DownloadResult
+from .transfer_result import TransferResult, SegmentStats
+from .batch_result import BatchItemResult, BatchDownloadResult
+from .download_job import DownloadJob
+from .tag_data import TagData
+from .library_entry import LibraryEntry
+from .stream_session import StreamSession
+from .zip_member import ZipMember
+from .host_stats import HostStats
 
-__all__ = ['SongInfo', 'DownloadResult']
\ No newline at end of file
+__all__ = ['SongInfo', 'DownloadResult', 'TransferResult', 'SegmentStats', 'BatchItemResult',
+           'BatchDownloadResult', 'DownloadJob', 'TagData', 'LibraryEntry',
+           'StreamSession', 'ZipMember', 'HostStats']
\ No newline at end of file
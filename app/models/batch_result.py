@@ -0,0 +1,24 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+from .download_result import DownloadResult
+
+@dataclass
+class BatchItemResult:
+    """批量下载中单首歌曲的结果"""
+    mid: str
+    name: str
+    singers: str
+    status: str  # completed / failed
+    result: Optional[DownloadResult] = None
+    error: Optional[str] = None
+
+@dataclass
+class BatchDownloadResult:
+    """批量下载结果数据类"""
+    items: List[BatchItemResult] = field(default_factory=list)
+    succeeded: int = 0
+    failed: int = 0
+    cached: int = 0
+    bytes_fetched: int = 0
+    elapsed: float = 0.0
+    throughput: float = 0.0  # 字节/秒
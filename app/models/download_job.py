@@ -0,0 +1,27 @@
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Union
+from .song_info import SongInfo
+from .download_result import DownloadResult
+from .batch_result import BatchDownloadResult
+
+@dataclass
+class DownloadJob:
+    """下载任务数据类"""
+    job_id: str
+    kind: str = "song"  # song / batch
+    song_info: Optional[SongInfo] = None
+    songs: List[SongInfo] = field(default_factory=list)  # 批量任务的歌曲列表
+    concurrency: int = 1  # 批量任务的并发下载数
+    prefer_flac: bool = False
+    add_metadata: bool = True
+    priority: str = "interactive"
+    state: str = "queued"  # queued / running / completed / failed
+    bytes_done: int = 0
+    bytes_total: Optional[int] = None
+    items_done: int = 0  # 批量任务已完成的歌曲数
+    stage_timings: Dict[str, float] = field(default_factory=dict)  # 各阶段耗时（秒）
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Union[DownloadResult, BatchDownloadResult]] = None
+    error: Optional[str] = None
@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional, Dict
+from .transfer_result import TransferResult
 
 @dataclass
 class DownloadResult:
@@ -7,4 +9,6 @@ class DownloadResult:
     quality: str
     filepath: str
     cached: bool = False
-    metadata_added: bool = False
\ No newline at end of file
+    metadata_added: bool = False
+    transfer: Optional[TransferResult] = None
+    stage_timings: Dict[str, float] = field(default_factory=dict)  # 各阶段耗时（秒）
@@ -0,0 +1,16 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque
+
+@dataclass
+class HostStats:
+    """单个CDN主机的请求统计（最近若干次的首字节时间和传输速度用于判断慢请求）"""
+    host: str
+    ttfb: Deque[float] = field(default_factory=deque, repr=False)  # 首字节时间（秒）
+    throughput: Deque[float] = field(default_factory=deque, repr=False)  # 单连接传输速度（字节/秒）
+    requests: int = 0
+    hedges: int = 0  # 首字节超时后发出的对冲请求数
+    hedge_wins: int = 0  # 对冲请求先于原请求响应的次数
+    retries: int = 0
+    failures: int = 0  # 连接失败、超时或服务器错误的请求数
+    slow_restarts: int = 0  # 因传输过慢而重新请求的次数
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class LibraryEntry:
+    """音乐库中的一个文件"""
+    filename: str
+    size: int
+    mid: Optional[str] = None  # 启动对账时发现的未登记文件没有mid
+    file_type: Optional[str] = None  # SongFileType 名称
+    quality: Optional[str] = None
+    checksum: Optional[str] = None  # SHA-1
+    metadata_added: bool = False
+    created_at: float = 0.0
+    last_access: float = 0.0  # 最近一次下载或提供文件的时间，用于LRU清理
+    pinned: bool = False  # 固定的文件不会被自动清理
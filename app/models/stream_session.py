@@ -0,0 +1,23 @@
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, List
+from .transfer_result import SegmentStats
+
+@dataclass
+class StreamSession:
+    """代理播放会话：从CDN下载到音乐目录的同时向播放器提供已下载的部分"""
+    token: str
+    mid: str
+    file_type: str  # SongFileType 名称
+    quality: str
+    filepath: Path
+    part_path: Optional[Path] = None
+    total: Optional[int] = None  # 总字节数，开始下载前或服务器未提供时为None
+    segments: List[SegmentStats] = field(default_factory=list)  # 下载中各分段的进度
+    state: str = "pending"  # pending / streaming / completed / failed
+    readers: int = 0  # 正在读取的播放请求数
+    created_at: float = 0.0
+    last_access: float = 0.0
+    condition: threading.Condition = field(default_factory=threading.Condition, repr=False)
+
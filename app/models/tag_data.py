@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class TagData:
+    """写入音频文件的标签数据"""
+    title: str
+    artist: str
+    album: str
+    cover_data: Optional[bytes] = None
+    lyric: str = ''
+    trans: str = ''
@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field
+from typing import List
+
+@dataclass
+class SegmentStats:
+    """单个下载分段的统计数据"""
+    index: int
+    start: int
+    end: int
+    bytes: int = 0  # 本次下载的字节数
+    resumed: int = 0  # 续传前已有的字节数
+    elapsed: float = 0.0
+    throughput: float = 0.0  # 字节/秒
+
+@dataclass
+class TransferResult:
+    """文件传输结果数据类"""
+    size: int
+    elapsed: float
+    segmented: bool = False
+    bytes_fetched: int = 0  # 本次从网络获取的字节数
+    bytes_resumed: int = 0  # 从未完成下载中复用的字节数
+    segments: List[SegmentStats] = field(default_factory=list)
+    tags_embedded: bool = False  # 是否已在下载过程中写入标签
+    reused: bool = False  # 等待同一文件的其他下载时对方已完成，本次未下载
@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+@dataclass
+class ZipMember:
+    """导出的ZIP中的一个文件（写入前已知大小和在归档中的偏移）"""
+    name: bytes  # UTF-8 编码的文件名
+    path: Path
+    size: int
+    mtime: float
+    offset: int = 0  # 本地文件头在归档中的偏移
+    crc: int = 0  # 写出文件数据后得到
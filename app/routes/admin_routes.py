@@ -223,6 +223,10 @@ def clear_music_folder():
                     deleted_count += 1
             except Exception as e:
                 logger.error(f"删除文件失败 {file_path}: {e}")
+
+        # 同步音乐库索引
+        from flask import current_app
+        current_app.config['library_index'].reconcile()
         
         return jsonify({
             'success': True, 
@@ -234,6 +238,179 @@ def clear_music_folder():
         logger.error(f"清空音乐文件夹失败: {e}", exc_info=True)
         return jsonify({'error': f'清空音乐文件夹失败: {str(e)}'}), 500
 
+@bp.route('/api/search_cache/stats')
+def search_cache_stats():
+    """获取搜索缓存统计"""
+    from flask import current_app
+    return jsonify(current_app.config['search_cache'].stats)
+
+@bp.route('/api/search_cache/clear', methods=['POST'])
+def clear_search_cache():
+    """清空搜索缓存"""
+    try:
+        from flask import current_app
+        cleared = current_app.config['search_cache'].clear()
+        return jsonify({
+            'success': True,
+            'message': f'已清空搜索缓存，清除了 {cleared} 条记录',
+            'cleared_count': cleared
+        })
+    except Exception as e:
+        logger.error(f"清空搜索缓存失败: {e}", exc_info=True)
+        return jsonify({'error': f'清空搜索缓存失败: {str(e)}'}), 500
+
+@bp.route('/api/coalescer/stats')
+def coalescer_stats():
+    """获取上游请求合并统计"""
+    from flask import current_app
+    return jsonify(current_app.config['request_coalescer'].stats)
+
+@bp.route('/api/play_url_cache/stats')
+def play_url_cache_stats():
+    """获取播放URL缓存统计"""
+    from flask import current_app
+    return jsonify(current_app.config['play_url_cache'].stats)
+
+@bp.route('/api/play_url_cache/clear', methods=['POST'])
+def clear_play_url_cache():
+    """清空播放URL缓存"""
+    try:
+        from flask import current_app
+        cleared = current_app.config['play_url_cache'].clear()
+        return jsonify({
+            'success': True,
+            'message': f'已清空播放URL缓存，清除了 {cleared} 条记录',
+            'cleared_count': cleared
+        })
+    except Exception as e:
+        logger.error(f"清空播放URL缓存失败: {e}", exc_info=True)
+        return jsonify({'error': f'清空播放URL缓存失败: {str(e)}'}), 500
+
+@bp.route('/api/url_resolver/stats')
+def url_resolver_stats():
+    """获取各音质URL探测统计"""
+    from flask import current_app
+    return jsonify(current_app.config['url_resolver'].stats)
+
+@bp.route('/api/cover_cache/stats')
+def cover_cache_stats():
+    """获取封面缓存统计"""
+    from flask import current_app
+    return jsonify(current_app.config['cover_cache'].stats)
+
+@bp.route('/api/cover_cache/clear', methods=['POST'])
+def clear_cover_cache():
+    """清空封面缓存"""
+    try:
+        from flask import current_app
+        cleared = current_app.config['cover_cache'].clear()
+        return jsonify({
+            'success': True,
+            'message': f'已清空封面缓存，删除了 {cleared} 个文件',
+            'cleared_count': cleared
+        })
+    except Exception as e:
+        logger.error(f"清空封面缓存失败: {e}", exc_info=True)
+        return jsonify({'error': f'清空封面缓存失败: {str(e)}'}), 500
+
+@bp.route('/api/lyric_store/stats')
+def lyric_store_stats():
+    """获取歌词缓存统计"""
+    from flask import current_app
+    return jsonify(current_app.config['lyric_store'].stats)
+
+@bp.route('/api/lyric_store/clear', methods=['POST'])
+def clear_lyric_store():
+    """清空歌词缓存"""
+    try:
+        from flask import current_app
+        cleared = current_app.config['lyric_store'].clear()
+        return jsonify({
+            'success': True,
+            'message': f'已清空歌词缓存，删除了 {cleared} 条记录',
+            'cleared_count': cleared
+        })
+    except Exception as e:
+        logger.error(f"清空歌词缓存失败: {e}", exc_info=True)
+        return jsonify({'error': f'清空歌词缓存失败: {str(e)}'}), 500
+
+@bp.route('/api/library/stats')
+def library_stats():
+    """获取音乐库索引统计"""
+    from flask import current_app
+    return jsonify(current_app.config['library_index'].stats)
+
+@bp.route('/api/library/reconcile', methods=['POST'])
+def reconcile_library():
+    """音乐库索引与音乐目录对账"""
+    try:
+        from flask import current_app
+        result = current_app.config['library_index'].reconcile()
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.error(f"音乐库索引对账失败: {e}", exc_info=True)
+        return jsonify({'error': f'音乐库索引对账失败: {str(e)}'}), 500
+
+@bp.route('/api/library/usage')
+def library_usage():
+    """获取音乐目录容量使用、命中率和清理统计"""
+    from flask import current_app
+    return jsonify(current_app.config['library_evictor'].stats)
+
+@bp.route('/api/library/pin', methods=['POST'])
+def pin_library_file():
+    """固定或取消固定音乐文件（固定的文件不会被自动清理）"""
+    try:
+        from flask import current_app
+        data = request.get_json() or {}
+        filename = data.get('filename', '')
+        pinned = bool(data.get('pinned', True))
+        if not filename:
+            return jsonify({'error': '缺少文件名'}), 400
+        if not current_app.config['library_index'].set_pinned(filename, pinned):
+            return jsonify({'error': '文件不在音乐库中'}), 404
+        return jsonify({'success': True, 'filename': filename, 'pinned': pinned})
+    except Exception as e:
+        logger.error(f"设置文件固定状态失败: {e}", exc_info=True)
+        return jsonify({'error': f'设置文件固定状态失败: {str(e)}'}), 500
+
+@bp.route('/api/library/evict', methods=['POST'])
+def evict_library():
+    """立即按LRU清理音乐目录，直到低于目标大小"""
+    try:
+        from flask import current_app
+        evictor = current_app.config['library_evictor']
+        if not evictor.enabled:
+            return jsonify({'success': False, 'message': '未设置音乐目录容量上限'})
+        evicted = 0
+        while True:
+            count = evictor.evict_batch(force=True)
+            if not count:
+                break
+            evicted += count
+        return jsonify({'success': True, 'message': f'已清理 {evicted} 个文件', 'evicted_count': evicted})
+    except Exception as e:
+        logger.error(f"清理音乐目录失败: {e}", exc_info=True)
+        return jsonify({'error': f'清理音乐目录失败: {str(e)}'}), 500
+
+@bp.route('/api/stream_proxy/stats')
+def stream_proxy_stats():
+    """获取代理播放统计"""
+    from flask import current_app
+    return jsonify(current_app.config['stream_proxy'].stats)
+
+@bp.route('/api/upstream/stats')
+def upstream_stats():
+    """获取各类上游请求的限流、并发和熔断状态"""
+    from flask import current_app
+    return jsonify(current_app.config['upstream_governor'].stats)
+
+@bp.route('/api/cdn/stats')
+def cdn_stats():
+    """获取各CDN主机的首字节时间、传输速度和对冲、重试统计"""
+    from flask import current_app
+    return jsonify(current_app.config['cdn_fetcher'].stats)
+
 class CredentialManager:
     """凭证管理器"""
 
@@ -1,11 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response, url_for
+import hashlib
+from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
 from qqmusic_api import search
-from qqmusic_api.song import get_song_urls, SongFileType
-from qqmusic_api.lyric import get_lyric
+from qqmusic_api.song import SongFileType
 import logging
 from ..utils.thread_utils import run_async  # 修复这里：run_utils -> run_async
+from ..services.lyric_store import parse_lrc
+from ..services.upstream_governor import UpstreamUnavailableError
 
 bp = Blueprint('api', __name__)
 logger = logging.getLogger("qqmusic_web")
@@ -23,6 +26,64 @@ def get_music_downloader():
     return current_app.config['music_downloader']
 
 
+def get_download_queue():
+    """获取下载任务队列实例"""
+    from flask import current_app
+    return current_app.config['download_queue']
+
+
+def get_url_resolver():
+    """获取音质URL探测器实例"""
+    from flask import current_app
+    return current_app.config['url_resolver']
+
+
+def get_search_cache():
+    """获取搜索缓存实例"""
+    from flask import current_app
+    return current_app.config['search_cache']
+
+
+def get_request_coalescer():
+    """获取请求合并器实例"""
+    from flask import current_app
+    return current_app.config['request_coalescer']
+
+
+def get_lyric_store():
+    """获取歌词缓存实例"""
+    from flask import current_app
+    return current_app.config['lyric_store']
+
+
+def get_cover_manager():
+    """获取封面管理器实例"""
+    from flask import current_app
+    return current_app.config['cover_manager']
+
+
+def get_library_index():
+    """获取音乐库索引实例"""
+    from flask import current_app
+    return current_app.config['library_index']
+
+
+def get_stream_proxy():
+    """获取代理播放实例"""
+    from flask import current_app
+    return current_app.config['stream_proxy']
+
+
+def upstream_unavailable_response(e):
+    """上游熔断或限流排队超时时返回503，提示客户端稍后重试"""
+    logger.warning(str(e))
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 503
+    if e.retry_after:
+        response.headers['Retry-After'] = str(int(e.retry_after + 0.999))
+    return response
+
+
 @bp.route('/search', methods=['POST'])
 def api_search():
     """搜索歌曲API"""
@@ -34,9 +95,16 @@ def api_search():
         return jsonify({'error': '歌曲名不能为空'}), 400
 
     try:
-        # 一次性获取60条结果
+        # 一次性获取60条结果，翻页时直接从缓存读取
         search_limit = 60
-        results = run_async(search.search_by_type(keyword, num=search_limit))
+        search_cache = get_search_cache()
+        results = search_cache.get(keyword, search.SearchType.SONG)
+        if results is None:
+            results = run_async(get_request_coalescer().search_by_type(
+                keyword, search_type=search.SearchType.SONG, num=search_limit
+            ))
+            if results:
+                search_cache.set(keyword, search.SearchType.SONG, results)
         if not results:
             return jsonify({'error': '未找到歌曲'}), 404
 
@@ -84,6 +152,8 @@ def api_search():
             'all_results': total_results
         })
 
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"搜索失败: {e}")
         return jsonify({'error': f'搜索失败: {str(e)}'}), 500
@@ -108,54 +178,149 @@ def api_play_url():
                 'error': '这首歌是VIP歌曲，需要登录才能播放'
             }), 403
 
-        # 设置音质获取策略
-        if prefer_flac:
-            quality_order = [
-                (SongFileType.FLAC, "FLAC"),
-                (SongFileType.MP3_320, "320kbps"),
-                (SongFileType.MP3_128, "128kbps")
-            ]
-        else:
-            quality_order = [
-                (SongFileType.MP3_320, "320kbps"),
-                (SongFileType.MP3_128, "128kbps")
-            ]
-
-        # 尝试获取URL
-        for file_type, quality_name in quality_order:
-            logger.info(f"尝试获取 {quality_name} 播放URL: {song_data.get('name', '')}")
-
-            # 异步运行获取URL的函数
-            urls = run_async(get_song_urls(
-                [song_data.get('mid', '')],
-                file_type=file_type,
-                credential=credential_manager.credential
-            ))
-            url = urls.get(song_data.get('mid', ''))
+        quality_order = get_music_downloader().get_quality_order(prefer_flac)
+        file_types = [file_type for file_type, _ in quality_order]
+        logger.info(f"获取播放URL: {song_data.get('name', '')}")
+
+        # 音乐库中已有最高音质的文件时直接从本地播放，无需请求上游
+        local = get_library_index().find(song_data.get('mid', ''), file_types)
+        local_rank = file_types.index(SongFileType[local.file_type]) if local else None
+        if local_rank == 0:
+            return local_play_response(local, song_data)
+
+        # 同时探测所有音质，按优先级取最佳可用音质（已缓存的URL和已知无URL的音质无需请求上游）
+        best = run_async(get_url_resolver().resolve_best(
+            song_data.get('mid', ''),
+            quality_order,
+            credential_manager.credential
+        ))
 
-            if not url:
-                continue
+        # 本地文件的音质不低于在线可用的最佳音质时仍从本地播放
+        if local and (not best or local_rank <= file_types.index(best[0])):
+            return local_play_response(local, song_data)
 
-            # API可能返回列表，取第一个
-            if isinstance(url, list):
-                url = url[0]
+        if best:
+            file_type, quality_name, url = best
+            logger.info(f"获取URL成功 ({quality_name}): {song_data.get('name', '')}")
 
-            if url:
-                logger.info(f"获取URL成功 ({quality_name}): {song_data.get('name', '')}")
-                return jsonify({
-                    'url': url,
-                    'quality': quality_name,
-                    'song_mid': song_data.get('mid', '')
-                })
+            # 代理播放：由本服务下载并转发，同时保存到音乐目录
+            stream_proxy = get_stream_proxy()
+            if stream_proxy.enabled:
+                session = stream_proxy.open(build_song_info(song_data), file_type, quality_name, url)
+                url = url_for('web.api_proxy', token=session.token)
+
+            return jsonify({
+                'url': url,
+                'quality': quality_name,
+                'song_mid': song_data.get('mid', ''),
+                'local': False,
+                'proxied': stream_proxy.enabled
+            })
 
         # 如果所有音质都失败
         return jsonify({'error': '所有音质均无法获取播放URL'}), 500
 
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"获取播放URL失败: {e}")
         return jsonify({'error': f'获取播放URL失败: {str(e)}'}), 500
 
 
+def local_play_response(entry, song_data):
+    """返回音乐库中文件的播放地址"""
+    logger.info(f"从音乐库播放 ({entry.quality}): {entry.filename}")
+    return jsonify({
+        'url': url_for('web.api_stream', filename=entry.filename),
+        'quality': entry.quality,
+        'song_mid': song_data.get('mid', ''),
+        'local': True,
+        'proxied': False
+    })
+
+
+def build_song_info(song_data):
+    """根据前端提交的歌曲数据创建SongInfo对象"""
+    from ..models import SongInfo
+    return SongInfo(
+        mid=song_data.get('mid', ''),
+        name=song_data.get('name', ''),
+        singers=song_data.get('singers', ''),
+        vip=song_data.get('vip', False),
+        album=song_data.get('album', ''),
+        album_mid=song_data.get('album_mid', ''),
+        interval=song_data.get('interval', 0),
+        raw_data=song_data.get('raw_data')
+    )
+
+
+def serialize_download_result(result):
+    """将下载结果转换为响应数据"""
+    return {
+        'filename': result.filename,
+        'quality': result.quality,
+        'filepath': result.filepath,
+        'cached': result.cached,
+        'metadata_added': result.metadata_added,
+        'transfer': asdict(result.transfer) if result.transfer else None,
+        'stage_timings': result.stage_timings
+    }
+
+
+def serialize_batch_result(batch_result):
+    """将批量下载结果转换为响应数据"""
+    return {
+        'items': [{
+            'mid': item.mid,
+            'name': item.name,
+            'singers': item.singers,
+            'status': item.status,
+            'result': serialize_download_result(item.result) if item.result else None,
+            'error': item.error
+        } for item in batch_result.items],
+        'succeeded': batch_result.succeeded,
+        'failed': batch_result.failed,
+        'cached': batch_result.cached,
+        'bytes_fetched': batch_result.bytes_fetched,
+        'elapsed': batch_result.elapsed,
+        'throughput': batch_result.throughput
+    }
+
+
+def serialize_job(job):
+    """将下载任务转换为响应数据（job 应为 DownloadQueue.snapshot 返回的副本）"""
+    data = {
+        'job_id': job.job_id,
+        'kind': job.kind,
+        'state': job.state,
+        'priority': job.priority,
+        'bytes_done': job.bytes_done,
+        'bytes_total': job.bytes_total,
+        'stage_timings': job.stage_timings,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'error': job.error
+    }
+    if job.kind == 'batch':
+        data.update({
+            'songs_total': len(job.songs),
+            'songs_done': job.items_done,
+            'concurrency': job.concurrency,
+            'result': serialize_batch_result(job.result) if job.result else None
+        })
+    else:
+        data.update({
+            'song': {
+                'mid': job.song_info.mid,
+                'name': job.song_info.name,
+                'singers': job.song_info.singers
+            },
+            'result': serialize_download_result(job.result) if job.result else None
+        })
+    return data
+
+
 @bp.route('/download', methods=['POST'])
 def api_download():
     """下载歌曲API"""
@@ -178,17 +343,7 @@ def api_download():
             }), 403
 
         # 创建SongInfo对象
-        from ..models import SongInfo
-        song_info = SongInfo(
-            mid=song_data.get('mid', ''),
-            name=song_data.get('name', ''),
-            singers=song_data.get('singers', ''),
-            vip=song_data.get('vip', False),
-            album=song_data.get('album', ''),
-            album_mid=song_data.get('album_mid', ''),
-            interval=song_data.get('interval', 0),
-            raw_data=song_data.get('raw_data')
-        )
+        song_info = build_song_info(song_data)
 
         # 下载歌曲
         result = run_async(music_downloader.download_song(
@@ -196,21 +351,125 @@ def api_download():
         ))
 
         if result:
-            return jsonify({
-                'filename': result.filename,
-                'quality': result.quality,
-                'filepath': result.filepath,
-                'cached': result.cached,
-                'metadata_added': result.metadata_added
-            })
+            return jsonify(serialize_download_result(result))
         else:
             return jsonify({'error': '所有音质下载失败'}), 500
 
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"下载失败: {e}")
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
 
+@bp.route('/jobs', methods=['POST'])
+def api_create_job():
+    """提交异步下载任务API，立即返回任务ID"""
+    data = request.get_json(silent=True) or {}
+    song_data = data.get('song_data')
+    prefer_flac = data.get('prefer_flac', False)
+    add_metadata = data.get('add_metadata', True)
+    priority = data.get('priority', 'interactive')
+
+    if not song_data:
+        return jsonify({'error': '缺少歌曲数据'}), 400
+
+    try:
+        credential_manager = get_credential_manager()
+
+        # 检查VIP歌曲权限
+        if song_data.get('vip', False) and not credential_manager.credential:
+            return jsonify({
+                'error': '这首歌是VIP歌曲，需要登录才能下载高音质版本'
+            }), 403
+
+        download_queue = get_download_queue()
+        job = download_queue.submit(
+            build_song_info(song_data), prefer_flac, add_metadata, priority
+        )
+        return jsonify(serialize_job(download_queue.snapshot([job])[0])), 202
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"提交下载任务失败: {e}")
+        return jsonify({'error': f'提交下载任务失败: {str(e)}'}), 500
+
+
+@bp.route('/batch_download', methods=['POST'])
+def api_batch_download():
+    """批量下载API：接收歌曲列表或专辑MID，作为批量任务提交到下载队列"""
+    data = request.get_json(silent=True) or {}
+    songs_data = data.get('songs') or []
+    album_mid = (data.get('album_mid') or '').strip()
+    prefer_flac = data.get('prefer_flac', False)
+    add_metadata = data.get('add_metadata', True)
+    concurrency = data.get('concurrency')
+    priority = data.get('priority', 'bulk')
+
+    if not songs_data and not album_mid:
+        return jsonify({'error': '缺少歌曲列表或专辑MID'}), 400
+
+    try:
+        from ..config import CONFIG
+        music_downloader = get_music_downloader()
+        max_songs = CONFIG["BATCH_DOWNLOAD_MAX_SONGS"]
+
+        song_infos = [build_song_info(song_data) for song_data in songs_data]
+        if album_mid:
+            # 分页获取专辑中的全部歌曲
+            page_size = 50
+            page = 1
+            while len(song_infos) < max_songs:
+                album_songs = run_async(get_request_coalescer().get_album_songs(
+                    album_mid, num=page_size, page=page
+                ))
+                song_infos.extend(music_downloader.song_info_from_raw(song) for song in album_songs)
+                if len(album_songs) < page_size:
+                    break
+                page += 1
+
+        if not song_infos:
+            return jsonify({'error': '未找到可下载的歌曲'}), 404
+        if len(song_infos) > max_songs:
+            return jsonify({'error': f'单次最多批量下载 {max_songs} 首歌曲'}), 400
+
+        download_queue = get_download_queue()
+        job = download_queue.submit_batch(
+            song_infos, prefer_flac, add_metadata,
+            int(concurrency) if concurrency else None, priority
+        )
+        return jsonify(serialize_job(download_queue.snapshot([job])[0])), 202
+
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"提交批量下载任务失败: {e}")
+        return jsonify({'error': f'提交批量下载任务失败: {str(e)}'}), 500
+
+
+@bp.route('/jobs/<job_id>')
+def api_get_job(job_id):
+    """查询下载任务状态API"""
+    download_queue = get_download_queue()
+    job = download_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(serialize_job(download_queue.snapshot([job])[0]))
+
+
+@bp.route('/jobs')
+def api_list_jobs():
+    """列出下载任务API"""
+    download_queue = get_download_queue()
+    return jsonify({
+        'jobs': [serialize_job(job) for job in download_queue.snapshot(download_queue.list_jobs())],
+        'stats': download_queue.stats
+    })
+
+
 @bp.route('/credential/status')
 def api_credential_status():
     """获取凭证状态"""
@@ -227,17 +486,58 @@ def api_health():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "music_dir_exists": music_dir.exists(),
-        "music_files_count": len(list(music_dir.glob("*"))) if music_dir.exists() else 0,
+        "music_files_count": get_library_index().count,
         "environment": "container" if CONFIG["IS_CONTAINER"] else "native"
     })
 
 
 @bp.route('/lyric/<song_mid>')
 def api_lyric(song_mid):
-    """获取歌词API"""
+    """获取歌词API（parsed=1 时附带解析后的带时间轴歌词）"""
     try:
-        lyrics_data = run_async(get_lyric(song_mid))
+        lyrics_data = run_async(get_lyric_store().get_lyric(song_mid))
+        if lyrics_data and request.args.get('parsed', '0').lower() in ('1', 'true'):
+            lyrics_data = dict(lyrics_data)
+            lyrics_data['parsed'] = {
+                'lyric': parse_lrc(lyrics_data.get('lyric', '')),
+                'trans': parse_lrc(lyrics_data.get('trans', ''))
+            }
         return jsonify(lyrics_data)
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"获取歌词失败: {e}")
-        return jsonify({'error': f'获取歌词失败: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'获取歌词失败: {str(e)}'}), 500
+
+
+@bp.route('/cover/<album_mid>')
+def api_cover(album_mid):
+    """专辑封面API（本地缓存，支持ETag条件请求）"""
+    from ..config import CONFIG
+
+    if not album_mid.isalnum():
+        return jsonify({'error': '无效的专辑MID'}), 400
+
+    cover_manager = get_cover_manager()
+    size = request.args.get('size', CONFIG["COVER_SIZE"], type=int)
+    if size not in cover_manager.SIZES:
+        return jsonify({'error': f'不支持的封面尺寸，可选: {list(cover_manager.SIZES)}'}), 400
+
+    try:
+        cover_data = run_async(cover_manager.get_album_cover(album_mid, size))
+    except UpstreamUnavailableError as e:
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"获取封面失败: {e}")
+        return jsonify({'error': f'获取封面失败: {str(e)}'}), 500
+
+    if not cover_data:
+        return jsonify({'error': '封面不存在'}), 404
+
+    response = make_response(cover_data)
+    response.mimetype = 'image/png' if cover_data.startswith(b'\x89PNG') else 'image/jpeg'
+    response.set_etag(hashlib.md5(cover_data).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = CONFIG["COVER_HTTP_MAX_AGE"]
+    # 客户端带有匹配的 If-None-Match 时返回 304
+    return response.make_conditional(request)
@@ -1,5 +1,9 @@
-from flask import Blueprint, render_template, send_file, jsonify
+from flask import Blueprint, render_template, jsonify, request, current_app
+import mimetypes
 from pathlib import Path
+from urllib.parse import quote
+from werkzeug.utils import send_file
+from ..services.library_exporter import plan_archive
 
 bp = Blueprint('web', __name__)
 
@@ -10,6 +14,24 @@ def get_credential_manager():
     return current_app.config['credential_manager']
 
 
+def get_library_index():
+    """获取音乐库索引实例"""
+    from flask import current_app
+    return current_app.config['library_index']
+
+
+def get_library_exporter():
+    """获取音乐库导出实例"""
+    from flask import current_app
+    return current_app.config['library_exporter']
+
+
+def get_stream_proxy():
+    """获取代理播放实例"""
+    from flask import current_app
+    return current_app.config['stream_proxy']
+
+
 @bp.route('/')
 def index():
     """提供前端页面"""
@@ -20,17 +42,158 @@ def index():
     return render_template('index.html', has_credential=has_credential)
 
 
+def is_safe_filename(filename):
+    """文件名不能包含上级目录或绝对路径"""
+    return '..' not in filename and not filename.startswith('/')
+
+
+def get_library_file(filename):
+    """获取音乐目录中的文件路径，文件不存在时返回None"""
+    from ..config import CONFIG
+
+    filepath = Path(CONFIG["MUSIC_DIR"]) / filename
+    if filepath.exists() and filepath.is_file():
+        return filepath
+    return None
+
+
+def send_library_file(filepath, as_attachment=False):
+    """发送音乐库文件
+
+    默认由应用处理 Range（206）和 ETag/Last-Modified 条件请求，WSGI服务器支持
+    wsgi.file_wrapper 时以 sendfile 零拷贝发送；配置 LIBRARY_SENDFILE_MODE 后只返回
+    X-Accel-Redirect / X-Sendfile 头，由前置的 nginx 等服务器直接发送文件。
+    """
+    mode = current_app.config["LIBRARY_SENDFILE_MODE"]
+    response = send_file(
+        filepath,
+        request.environ,
+        as_attachment=as_attachment,
+        use_x_sendfile=bool(mode),
+        response_class=current_app.response_class,
+        # 由前置服务器发送时，Range 和条件请求也交由其处理
+        conditional=not mode
+    )
+    if mode == "x-accel":
+        del response.headers["X-Sendfile"]
+        prefix = current_app.config["LIBRARY_ACCEL_PREFIX"].rstrip("/")
+        response.headers["X-Accel-Redirect"] = f"{prefix}/{quote(filepath.name)}"
+    return response
+
+
 @bp.route('/api/file/<filename>')
 def api_file(filename):
     """提供文件下载"""
-    from ..config import CONFIG
+    # 安全检查
+    if not is_safe_filename(filename):
+        return jsonify({'error': '无效的文件名'}), 400
+
+    filepath = get_library_file(filename)
+    if filepath is None:
+        return jsonify({'error': '文件不存在'}), 404
+
+    # 更新最近访问时间，容量清理时优先保留常用文件
+    get_library_index().touch(filename, count_hit=False)
+    return send_library_file(filepath, as_attachment=True)
+
 
+@bp.route('/api/stream/<filename>')
+def api_stream(filename):
+    """播放音乐库中的文件（支持 Range 请求，拖动进度时只传输所需部分）"""
     # 安全检查
-    if '..' in filename or filename.startswith('/'):
+    if not is_safe_filename(filename):
         return jsonify({'error': '无效的文件名'}), 400
 
-    filepath = Path(CONFIG["MUSIC_DIR"]) / filename
-    if filepath.exists() and filepath.is_file():
-        return send_file(filepath, as_attachment=True)
+    filepath = get_library_file(filename)
+    if filepath is None:
+        return jsonify({'error': '文件不存在'}), 404
+
+    # 播放时浏览器会发出多个 Range 请求，只在从头开始播放时更新访问时间
+    range_header = request.headers.get('Range', '')
+    if not range_header or range_header.startswith('bytes=0-'):
+        get_library_index().touch(filename, count_hit=False)
+    return send_library_file(filepath)
+
+
+@bp.route('/api/proxy/<token>')
+def api_proxy(token):
+    """代理播放：从CDN下载到音乐目录的同时提供已下载的部分"""
+    stream_proxy = get_stream_proxy()
+    session = stream_proxy.get(token)
+    if session is None:
+        return jsonify({'error': '播放会话不存在或已过期'}), 404
+
+    # 已下载完成时按音乐库文件提供
+    if session.state == "completed":
+        if not session.filepath.is_file():
+            return jsonify({'error': '文件不存在'}), 404
+        return send_library_file(session.filepath)
+
+    if not stream_proxy.wait_started(session):
+        return jsonify({'error': '获取音频失败'}), 502
+
+    total = session.total
+    start, end = 0, total
+    status = 200
+    headers = {}
+    if total is not None:
+        headers['Accept-Ranges'] = 'bytes'
+        if request.range:
+            byte_range = request.range.range_for_length(total)
+            if byte_range is None:
+                return current_app.response_class(status=416, headers={'Content-Range': f'bytes */{total}'})
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{total}'
+        headers['Content-Length'] = str(end - start)
+
+    return current_app.response_class(
+        stream_proxy.read(session, start, end),
+        status=status,
+        headers=headers,
+        mimetype=mimetypes.guess_type(session.filepath.name)[0] or 'application/octet-stream',
+        direct_passthrough=True
+    )
+
+
+@bp.route('/api/export', methods=['GET', 'POST'])
+def api_export():
+    """将音乐库中的多个文件导出为ZIP（边读取边发送，响应带有准确的 Content-Length）"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        filenames = data.get('filenames') or []
+        mids = data.get('mids') or []
+        name = data.get('name') or 'music'
     else:
-        return jsonify({'error': '文件不存在'}), 404
\ No newline at end of file
+        filenames = request.args.getlist('filename')
+        mids = request.args.getlist('mid')
+        name = request.args.get('name') or 'music'
+
+    if not isinstance(filenames, list) or not isinstance(mids, list):
+        return jsonify({'error': '参数格式错误'}), 400
+    if len(filenames) + len(mids) > current_app.config["EXPORT_MAX_FILES"]:
+        return jsonify({'error': f'单次最多导出 {current_app.config["EXPORT_MAX_FILES"]} 个文件'}), 400
+    if not all(isinstance(item, str) and is_safe_filename(item) for item in filenames):
+        return jsonify({'error': '无效的文件名'}), 400
+
+    # 按歌曲MID导出时取音质最高的文件
+    file_types = [file_type for file_type, _ in current_app.config['music_downloader'].get_quality_order(True)]
+    exporter = get_library_exporter()
+    members = exporter.collect(filenames, [str(mid) for mid in mids], file_types)
+    if not members:
+        return jsonify({'error': '没有可导出的文件'}), 404
+
+    total = plan_archive(members)
+    archive_name = current_app.config['file_manager'].sanitize_filename(name) + '.zip'
+    response = current_app.response_class(
+        exporter.stream(members),
+        mimetype='application/zip',
+        headers={'Content-Length': str(total)},
+        direct_passthrough=True
+    )
+    try:
+        archive_name.encode('latin-1')
+        response.headers['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    except UnicodeEncodeError:
+        response.headers['Content-Disposition'] = f"attachment; filename=\"music.zip\"; filename*=UTF-8''{quote(archive_name)}"
+    return response
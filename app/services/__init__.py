@@ -1,7 +1,25 @@
+from .http_client import HttpClient
+from .upstream_governor import UpstreamGovernor
+from .cdn_fetcher import CdnFetcher
 from .credential_manager import CredentialManager
 from .cover_manager import CoverManager
+from .cover_cache import CoverCache
+from .lyric_store import LyricStore
 from .file_manager import FileManager
 from .metadata_manager import MetadataManager
 from .music_downloader import MusicDownloader
+from .search_cache import SearchCache
+from .request_coalescer import RequestCoalescer
+from .url_batcher import SongUrlBatcher
+from .url_cache import PlayUrlCache
+from .url_resolver import UrlResolver
+from .library_index import LibraryIndex
+from .library_evictor import LibraryEvictor
+from .stream_proxy import StreamProxy
+from .library_exporter import LibraryExporter
+from .download_queue import DownloadQueue
 
-__all__ = ['CredentialManager', 'CoverManager', 'FileManager', 'MetadataManager', 'MusicDownloader']
\ No newline at end of file
+__all__ = ['HttpClient', 'CredentialManager', 'CoverManager', 'FileManager', 'MetadataManager', 'MusicDownloader', 'SearchCache',
+           'RequestCoalescer', 'SongUrlBatcher', 'PlayUrlCache', 'UrlResolver', 'CoverCache', 'LyricStore',
+           'LibraryIndex', 'LibraryEvictor', 'StreamProxy', 'LibraryExporter', 'DownloadQueue',
+           'UpstreamGovernor', 'CdnFetcher']
\ No newline at end of file
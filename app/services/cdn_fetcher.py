@@ -0,0 +1,228 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextlib
+from collections import deque
+from typing import Optional, Dict, Any, List, AsyncIterator
+from urllib.parse import urlsplit
+import aiohttp
+from ..models import HostStats
+
+logger = logging.getLogger("qqmusic_web")
+
+# 可重试的响应状态码（限流或服务器错误）
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class SlowTransferError(IOError):
+    """传输速度低于该主机的历史水平，中断后重新请求剩余部分"""
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """取样本的 p 分位数（0 <= p <= 1）"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1) + 0.5))]
+
+
+class CdnFetcher:
+    """CDN请求：按主机统计首字节时间和传输速度，首字节过慢时发出对冲请求，
+    连接失败、超时或服务器错误时按指数退避重试；连接和读取分别设置超时"""
+
+    def __init__(self, config, http_client, upstream_governor):
+        self.config = config
+        self.http_client = http_client
+        self.upstream_governor = upstream_governor
+        self._hosts: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> aiohttp.ClientTimeout:
+        """不限制总时间（大文件下载耗时取决于文件大小），连接和每次读取分别超时"""
+        return aiohttp.ClientTimeout(
+            total=None,
+            connect=self.config["CDN_CONNECT_TIMEOUT"],
+            sock_read=self.config["CDN_READ_TIMEOUT"]
+        )
+
+    def _host(self, url: str) -> HostStats:
+        host = urlsplit(url).netloc
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                window = self.config["CDN_STATS_WINDOW"]
+                stats = HostStats(host=host, ttfb=deque(maxlen=window), throughput=deque(maxlen=window))
+                self._hosts[host] = stats
+            return stats
+
+    def hedge_delay(self, stats: HostStats) -> float:
+        """首字节超过该主机历史首字节时间的高分位数时发出对冲请求"""
+        with self._lock:
+            samples = list(stats.ttfb)
+        if len(samples) < self.config["CDN_STATS_MIN_SAMPLES"]:
+            return self.config["CDN_HEDGE_DEFAULT_DELAY"]
+        return max(self.config["CDN_HEDGE_MIN_DELAY"], percentile(samples, self.config["CDN_HEDGE_PERCENTILE"]))
+
+    def slow_threshold(self, url: str) -> Optional[float]:
+        """传输速度下限（字节/秒）：该主机历史单连接速度的低分位数，样本不足时不限制"""
+        stats = self._host(url)
+        with self._lock:
+            samples = list(stats.throughput)
+        if len(samples) < self.config["CDN_STATS_MIN_SAMPLES"]:
+            return None
+        return percentile(samples, self.config["CDN_SLOW_PERCENTILE"])
+
+    def check_rate(self, url: str, received: int, elapsed: float, threshold: Optional[float]):
+        """传输开始一段时间后速度仍低于下限时抛出 SlowTransferError"""
+        if threshold is None or elapsed < self.config["CDN_SLOW_GRACE"]:
+            return
+        rate = received / elapsed
+        if rate < threshold:
+            stats = self._host(url)
+            with self._lock:
+                stats.slow_restarts += 1
+            raise SlowTransferError(f"传输过慢: {rate / 1024:.1f} KB/s < {threshold / 1024:.1f} KB/s ({stats.host})")
+
+    def record_transfer(self, url: str, size: int, elapsed: float):
+        """记录一次完整传输的速度"""
+        if size <= 0 or elapsed <= 0:
+            return
+        stats = self._host(url)
+        with self._lock:
+            stats.throughput.append(size / elapsed)
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（指数退避，带随机抖动）"""
+        delay = min(self.config["CDN_RETRY_BACKOFF_MAX"], self.config["CDN_RETRY_BACKOFF"] * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def _attempt(self, session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]],
+                       timeout: aiohttp.ClientTimeout, stats: HostStats) -> aiohttp.ClientResponse:
+        """发出请求，首字节迟迟未到时再发一个相同请求，返回先得到的可用响应"""
+        async def _get():
+            return await session.get(url, headers=headers, timeout=timeout)
+
+        tasks = [asyncio.ensure_future(_get())]
+        winner: Optional[aiohttp.ClientResponse] = None
+        fallback: Optional[aiohttp.ClientResponse] = None
+        error: Optional[BaseException] = None
+        keep: Optional[aiohttp.ClientResponse] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(stats))
+            if not done and self.config["CDN_HEDGE_ENABLED"]:
+                with self._lock:
+                    stats.hedges += 1
+                logger.debug(f"首字节超时，发出对冲请求: {stats.host}")
+                tasks.append(asyncio.ensure_future(_get()))
+
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None and task.result().status not in RETRY_STATUSES:
+                        winner = task.result()
+                        if task is not tasks[0]:
+                            with self._lock:
+                                stats.hedge_wins += 1
+                    elif fallback is None:
+                        fallback = task.result()
+            keep = winner if winner is not None else fallback
+        finally:
+            # 取消或释放未被采用的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and task.result() is not keep:
+                    task.result().release()
+
+        if keep is None:
+            raise error
+        return keep
+
+    async def _send(self, url: str, headers: Optional[Dict[str, str]],
+                    timeout: aiohttp.ClientTimeout) -> aiohttp.ClientResponse:
+        """发出请求，连接失败、超时或服务器错误时按指数退避重试"""
+        session = await self.http_client.get_session()
+        stats = self._host(url)
+        attempts = max(1, self.config["CDN_RETRY_ATTEMPTS"])
+        for attempt in range(attempts):
+            if attempt:
+                with self._lock:
+                    stats.retries += 1
+                await asyncio.sleep(self.backoff(attempt))
+
+            with self._lock:
+                stats.requests += 1
+            started = time.monotonic()
+            try:
+                resp = await self._attempt(session, url, headers, timeout, stats)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                with self._lock:
+                    stats.failures += 1
+                if attempt == attempts - 1:
+                    raise
+                logger.debug(f"CDN请求失败，准备重试 ({attempt + 1}/{attempts}): {e!r}")
+                continue
+
+            if resp.status in RETRY_STATUSES:
+                with self._lock:
+                    stats.failures += 1
+                if attempt < attempts - 1:
+                    logger.debug(f"CDN返回 {resp.status}，准备重试 ({attempt + 1}/{attempts})")
+                    resp.release()
+                    continue
+            else:
+                with self._lock:
+                    stats.ttfb.append(time.monotonic() - started)
+            return resp
+
+    @contextlib.asynccontextmanager
+    async def get(self, kind: str, url: str, headers: Optional[Dict[str, str]] = None,
+                  timeout: Optional[aiohttp.ClientTimeout] = None) -> AsyncIterator[aiohttp.ClientResponse]:
+        """在上游调度器许可下发出GET请求（async with），退出时释放连接
+
+        kind 为上游请求类别（cdn / cover），按 (kind, 主机) 分别限流和熔断；
+        timeout 默认为分别设置的连接和读取超时。
+        许可只覆盖到收到响应头为止：之后的传输和调用方的处理出错不计入熔断统计，也不占用并发名额。
+        """
+        resp = None
+        try:
+            async with self.upstream_governor.permit(kind, urlsplit(url).netloc) as permit:
+                resp = await self._send(url, headers, timeout or self.timeout)
+                permit.first_byte()
+                permit.check_status(resp.status)
+        except BaseException:
+            if resp is not None:
+                resp.release()
+            raise
+        async with resp:
+            yield resp
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """各主机的首字节时间、传输速度和对冲、重试统计"""
+        with self._lock:
+            hosts = list(self._hosts.values())
+            snapshot = [(stats, list(stats.ttfb), list(stats.throughput)) for stats in hosts]
+        result = {}
+        for stats, ttfb, throughput in snapshot:
+            result[stats.host] = {
+                "requests": stats.requests,
+                "hedges": stats.hedges,
+                "hedge_wins": stats.hedge_wins,
+                "retries": stats.retries,
+                "failures": stats.failures,
+                "slow_restarts": stats.slow_restarts,
+                "ttfb_p50_ms": round(percentile(ttfb, 0.5) * 1000, 2) if ttfb else None,
+                "ttfb_p95_ms": round(percentile(ttfb, 0.95) * 1000, 2) if ttfb else None,
+                "throughput_p50_kbps": round(percentile(throughput, 0.5) / 1024, 1) if throughput else None,
+                "hedge_delay_ms": round(self.hedge_delay(stats) * 1000, 2),
+                "slow_threshold_kbps": (
+                    round(percentile(throughput, self.config["CDN_SLOW_PERCENTILE"]) / 1024, 1)
+                    if len(throughput) >= self.config["CDN_STATS_MIN_SAMPLES"] else None
+                )
+            }
+        return result
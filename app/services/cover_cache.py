@@ -0,0 +1,216 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from ..utils.thread_utils import thread_pool
+
+logger = logging.getLogger("qqmusic_web")
+
+class CoverCache:
+    """封面图片缓存：内存LRU + 磁盘持久化，按 (来源, 专辑MID/VS值, 尺寸) 缓存图片数据；
+    同时在内存中记录已确认无效的候选封面（带有效期）"""
+
+    def __init__(self, config):
+        self.config = config
+        self.max_memory_items = config["COVER_MEMORY_CACHE_SIZE"]
+        self.cache_dir = Path(config["CACHE_DIR"]) / "covers"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.negative_ttl = config["COVER_NEGATIVE_TTL"]
+        self.max_disk_bytes = config["COVER_DISK_CACHE_MAX_BYTES"]
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._invalid: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 磁盘缓存总大小（首次写入时统计），写入和清理在线程池中进行，单独加锁
+        self._disk_lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, value: str, size: int) -> str:
+        """生成缓存键，kind 为 album（专辑MID）或 vs（VS值）"""
+        return re.sub(r"[^0-9A-Za-z_]", "_", f"{kind}_{value}_{size}")
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            # 更新修改时间，容量超限时按修改时间从旧到新清理
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"读取封面缓存失败: {e}")
+            return None
+
+    def _disk_entries(self) -> List[Tuple[Path, os.stat_result]]:
+        """磁盘缓存文件的 (路径, stat)，不含写入中的临时文件"""
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith("."):
+                continue
+            try:
+                entries.append((path, path.stat()))
+            except OSError:
+                continue
+        return entries
+
+    def _write_disk(self, key: str, data: bytes):
+        """先写临时文件再原子替换，超出容量上限时清理最久未使用的文件"""
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(stat.st_size for _, stat in self._disk_entries())
+            try:
+                replaced = path.stat().st_size
+            except OSError:
+                replaced = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"写入封面缓存失败: {e}")
+                tmp_path.unlink(missing_ok=True)
+                return
+            self._disk_bytes += len(data) - replaced
+            if self.max_disk_bytes and self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk(keep=path)
+
+    def _evict_disk(self, keep: Path):
+        """按修改时间从旧到新删除磁盘缓存，直到降到容量上限的90%（调用方持有 _disk_lock）"""
+        target = self.max_disk_bytes * 0.9
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1].st_mtime)
+        self._disk_bytes = sum(stat.st_size for _, stat in entries)
+        removed = 0
+        for path, stat in entries:
+            if self._disk_bytes <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError as e:
+                logger.warning(f"删除封面缓存失败: {path.name}, {e}")
+                continue
+            self._disk_bytes -= stat.st_size
+            removed += 1
+        logger.info(f"封面磁盘缓存超出上限，已清理 {removed} 个文件，剩余 {self._disk_bytes} bytes")
+
+    async def get(self, key: str, count_miss: bool = True) -> Optional[bytes]:
+        """查询缓存：先查内存，再在线程池中查磁盘（磁盘命中时放回内存）"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(thread_pool, self._read_disk, key)
+        if not data:
+            if count_miss:
+                with self._lock:
+                    self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, data)
+        return data
+
+    async def contains(self, key: str) -> bool:
+        """是否已缓存（不读取数据，不计入统计）"""
+        with self._lock:
+            if key in self._memory:
+                return True
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(thread_pool, self._disk_path(key).exists)
+
+    def mark_invalid(self, key: str):
+        """记录无效的候选封面，有效期内不再探测"""
+        with self._lock:
+            self._invalid[key] = time.monotonic() + self.negative_ttl
+            self._invalid.move_to_end(key)
+            # 按写入顺序清理已过期的记录
+            now = time.monotonic()
+            while self._invalid and next(iter(self._invalid.values())) <= now:
+                self._invalid.popitem(last=False)
+
+    def is_invalid(self, key: str) -> bool:
+        """候选封面是否已知无效"""
+        with self._lock:
+            expires_at = self._invalid.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._invalid[key]
+                return False
+            return True
+
+    async def set(self, key: str, data: bytes):
+        """写入缓存（内存立即可用，磁盘文件在线程池中写入）"""
+        self._remember(key, data)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(thread_pool, self._write_disk, key, data)
+
+    def clear(self) -> int:
+        """清空内存和磁盘缓存，返回删除的磁盘文件数"""
+        with self._lock:
+            self._memory.clear()
+            self._invalid.clear()
+        count = 0
+        with self._disk_lock:
+            for path in self.cache_dir.iterdir():
+                try:
+                    path.unlink()
+                    count += 1
+                except OSError as e:
+                    logger.warning(f"删除封面缓存失败: {path.name}, {e}")
+            self._disk_bytes = None
+        return count
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        disk_files = 0
+        disk_bytes = 0
+        for path in self.cache_dir.iterdir():
+            try:
+                disk_bytes += path.stat().st_size
+                disk_files += 1
+            except OSError:
+                pass
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "memory_max_items": self.max_memory_items,
+                "memory_bytes": sum(len(data) for data in self._memory.values()),
+                "disk_files": disk_files,
+                "disk_bytes": disk_bytes,
+                "disk_max_bytes": self.max_disk_bytes,
+                "invalid_candidates": len(self._invalid),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0
+            }
@@ -1,15 +1,28 @@
-import aiohttp
+import asyncio
 import logging
-from typing import Optional, Dict, Any, Literal
+import aiohttp
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, Literal, Tuple
 from pathlib import Path
+from .upstream_governor import UpstreamUnavailableError
 
 logger = logging.getLogger("qqmusic_web")
 
 class CoverManager:
     """封面管理器"""
 
-    def __init__(self, config):
+    # 探测封面时读取的字节数（足以识别图片格式）
+    PROBE_BYTES = 16
+    # 支持的封面尺寸（从小到大）
+    SIZES = (150, 300, 500, 800)
+
+    def __init__(self, config, cdn_fetcher, cover_cache):
         self.config = config
+        self.cdn_fetcher = cdn_fetcher
+        self.cover_cache = cover_cache
+        # 同一封面的并发请求只下载一次
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._key_lock_users: Dict[str, int] = defaultdict(int)
 
     def get_cover_url_by_album_mid(self, mid: str, size: Literal[150, 300, 500, 800] = None) -> Optional[str]:
         """通过专辑MID获取封面URL"""
@@ -31,22 +44,52 @@ class CoverManager:
             raise ValueError("不支持的封面尺寸")
         return f"https://y.qq.com/music/photo_new/T062R{size}x{size}M000{vs}.jpg"
 
-    async def get_valid_cover_url(self, song_data: Dict[str, Any], size: Literal[150, 300, 500, 800] = None) -> Optional[str]:
-        """获取并验证有效的封面URL（按优先级尝试所有可能的VS值）"""
+    async def get_album_cover(self, album_mid: str, size: int = None) -> Optional[bytes]:
+        """获取指定尺寸的专辑封面数据（优先使用缓存）"""
         if size is None:
             size = self.config["COVER_SIZE"]
+        if size not in self.SIZES:
+            raise ValueError("不支持的封面尺寸")
+
+        return await self.fetch_cover("album", album_mid, size, self.get_cover_url_by_album_mid(album_mid, size))
 
-        # 1. 优先尝试专辑MID
+    async def fetch_cover(self, kind: str, value: str, size: int, url: str) -> Optional[bytes]:
+        """获取封面图片数据（优先使用缓存，未缓存时下载并写入缓存）"""
+        key = self.cover_cache.make_key(kind, value, size)
+        cover_data = await self.cover_cache.get(key)
+        if cover_data:
+            return cover_data
+
+        lock = self._key_locks.setdefault(key, asyncio.Lock())
+        self._key_lock_users[key] += 1
+        try:
+            async with lock:
+                # 等待期间可能已由其他请求下载完成
+                cover_data = await self.cover_cache.get(key, count_miss=False)
+                if cover_data:
+                    return cover_data
+                cover_data = await self.download_cover(url)
+                if cover_data:
+                    await self.cover_cache.set(key, cover_data)
+                return cover_data
+        finally:
+            # 没有其他协程等待时移除该锁（包括被取消的情况）
+            self._key_lock_users[key] -= 1
+            if not self._key_lock_users[key]:
+                del self._key_lock_users[key]
+                self._key_locks.pop(key, None)
+
+    @staticmethod
+    def _collect_candidates(song_data: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+        """按优先级收集候选封面，返回 [(类型, 专辑MID/VS值, 来源)]"""
+        candidates = []
+
+        # 1. 优先使用专辑MID
         album_mid = song_data.get('album', {}).get('mid', '')
         if album_mid:
-            url = self.get_cover_url_by_album_mid(album_mid, size)
-            logger.debug(f"尝试专辑MID封面: {url}")
-            cover_data = await self.download_cover(url)
-            if cover_data:
-                logger.info(f"使用专辑MID封面: {url}")
-                return url
-
-        # 2. 尝试所有可用的VS值（按顺序）
+            candidates.append(("album", album_mid, "album_mid"))
+
+        # 2. 所有可用的VS值（按顺序）
         vs_values = song_data.get('vs', [])
         logger.debug(f"分析VS值: {vs_values}")
 
@@ -78,15 +121,95 @@ class CoverManager:
         candidate_vs.sort(key=lambda x: x['priority'])
 
         logger.debug(f"候选VS值: {[c['value'] for c in candidate_vs]}")
+        candidates.extend(("vs", c['value'], c['source']) for c in candidate_vs)
+        return candidates
+
+    def _candidate_url(self, kind: str, value: str, size: int) -> Optional[str]:
+        if kind == "album":
+            return self.get_cover_url_by_album_mid(value, size)
+        return self.get_cover_url_by_vs(value, size)
+
+    async def probe_cover(self, url: str) -> Optional[bool]:
+        """只请求图片开头的少量字节来验证封面是否有效
 
-        # 按顺序尝试每个候选VS值
-        for candidate in candidate_vs:
-            url = self.get_cover_url_by_vs(candidate['value'], size)
-            logger.debug(f"尝试VS值封面 [{candidate['source']}]: {url}")
-            cover_data = await self.download_cover(url)
-            if cover_data:
-                logger.info(f"使用VS值封面 [{candidate['source']}]: {url}")
-                return url
+        返回 True（有效）、False（确认无效）或 None（网络错误等无法确定）。
+        """
+        try:
+            async with self.cdn_fetcher.get(
+                "cover", url,
+                headers={"Range": f"bytes=0-{self.PROBE_BYTES - 1}"},
+                timeout=aiohttp.ClientTimeout(
+                    connect=self.config["CDN_CONNECT_TIMEOUT"], sock_read=self.config["COVER_PROBE_TIMEOUT"]
+                )
+            ) as resp:
+                if resp.status == 206:
+                    content_range = resp.headers.get("Content-Range", "")
+                    total = content_range.rsplit("/", 1)[-1]
+                    size = int(total) if total.isdigit() else None
+                elif resp.status == 200:
+                    # 服务器不支持Range时只读取开头部分，随后直接断开连接
+                    size = resp.content_length
+                else:
+                    logger.debug(f"封面探测失败: HTTP {resp.status}, URL: {url}")
+                    return False
+
+                head = await resp.content.read(self.PROBE_BYTES)
+                if resp.status == 200:
+                    resp.close()
+        except Exception as e:
+            logger.debug(f"封面探测异常: {e}, URL: {url}")
+            return None
+
+        if size is not None and size <= 1024:
+            logger.debug(f"封面图片过小: {size} bytes, URL: {url}")
+            return False
+        return head.startswith(b'\xff\xd8') or head.startswith(b'\x89PNG')
+
+    async def _probe_candidate(self, kind: str, value: str, size: int) -> Optional[bool]:
+        if await self.cover_cache.contains(self.cover_cache.make_key(kind, value, size)):
+            return True
+        result = await self.probe_cover(self._candidate_url(kind, value, size))
+        if result is False:
+            self.cover_cache.mark_invalid(self.cover_cache.make_key(kind, value, size))
+        return result
+
+    async def get_valid_cover_url(self, song_data: Dict[str, Any],
+                                  size: Literal[150, 300, 500, 800] = None) -> Optional[Tuple[str, bytes]]:
+        """获取并验证有效的封面，返回 (URL, 图片数据)
+
+        所有候选封面同时探测，按优先级等待结果：优先级最高的有效封面确定后取消其余探测。
+        已知无效的候选在有效期内直接跳过。
+        """
+        if size is None:
+            size = self.config["COVER_SIZE"]
+
+        candidates = [
+            (kind, value, source) for kind, value, source in self._collect_candidates(song_data)
+            if not self.cover_cache.is_invalid(self.cover_cache.make_key(kind, value, size))
+        ]
+        probes = [
+            asyncio.ensure_future(self._probe_candidate(kind, value, size))
+            for kind, value, _ in candidates
+        ]
+
+        try:
+            for (kind, value, source), probe in zip(candidates, probes):
+                if await probe is False:
+                    continue
+
+                # 探测通过（或无法确定）时下载完整图片
+                url = self._candidate_url(kind, value, size)
+                try:
+                    cover_data = await self.fetch_cover(kind, value, size, url)
+                except UpstreamUnavailableError as e:
+                    logger.warning(f"{e}，尝试下一个候选封面")
+                    continue
+                if cover_data:
+                    logger.info(f"使用封面 [{source}]: {url}")
+                    return url, cover_data
+        finally:
+            for probe in probes:
+                probe.cancel()
 
         logger.warning("未找到任何有效的封面URL")
         return None
@@ -97,25 +220,25 @@ class CoverManager:
             return None
 
         try:
-            async with aiohttp.ClientSession(
-                    timeout=aiohttp.ClientTimeout(total=self.config["DOWNLOAD_TIMEOUT"])
-            ) as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        # 检查文件大小和内容有效性
-                        if len(content) > 1024:
-                            # 简单验证图片格式
-                            if content.startswith(b'\xff\xd8') or content.startswith(b'\x89PNG'):
-                                logger.debug(f"封面下载成功: {len(content)} bytes")
-                                return content
-                            else:
-                                logger.warning(f"封面图片格式无效: {url}")
+            async with self.cdn_fetcher.get("cover", url) as resp:
+                if resp.status == 200:
+                    content = await resp.read()
+                    # 检查文件大小和内容有效性
+                    if len(content) > 1024:
+                        # 简单验证图片格式
+                        if content.startswith(b'\xff\xd8') or content.startswith(b'\x89PNG'):
+                            logger.debug(f"封面下载成功: {len(content)} bytes")
+                            return content
                         else:
-                            logger.warning(f"封面图片过小: {len(content)} bytes, URL: {url}")
+                            logger.warning(f"封面图片格式无效: {url}")
                     else:
-                        logger.warning(f"封面下载失败: HTTP {resp.status}, URL: {url}")
-                    return None
+                        logger.warning(f"封面图片过小: {len(content)} bytes, URL: {url}")
+                else:
+                    logger.warning(f"封面下载失败: HTTP {resp.status}, URL: {url}")
+                return None
+        except UpstreamUnavailableError:
+            # 上游熔断或限流排队超时，由调用方决定快速失败还是换用其他来源
+            raise
         except Exception as e:
             logger.error(f"封面下载异常: {e}, URL: {url}")
             return None
\ No newline at end of file
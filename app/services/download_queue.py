@@ -0,0 +1,220 @@
+import time
+import heapq
+import uuid
+import asyncio
+import logging
+import threading
+import itertools
+import dataclasses
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from ..models import SongInfo, DownloadJob
+from ..utils.thread_utils import background_loop, run_async
+
+logger = logging.getLogger("qqmusic_web")
+
+class DownloadQueue:
+    """下载任务队列：在后台事件循环上由固定数量的工作协程按优先级执行下载"""
+
+    # 数值越小越先执行
+    PRIORITIES = {"interactive": 0, "bulk": 10}
+
+    def __init__(self, config, music_downloader):
+        self.config = config
+        self.music_downloader = music_downloader
+        self._jobs: "OrderedDict[str, DownloadJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        # 待执行任务堆：(优先级, 提交序号, 任务ID)，只在后台事件循环中访问
+        self._pending: List[Tuple[int, int, str]] = []
+        self._ready: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def _start_workers(self):
+        self._ready = asyncio.Condition()
+        workers = self.config["DOWNLOAD_JOB_WORKERS"]
+        # 保留的工作协程只执行交互式任务，避免批量任务占满所有工作协程
+        reserved = max(0, min(self.config["DOWNLOAD_JOB_RESERVED_WORKERS"], workers - 1))
+        self._workers = [
+            asyncio.ensure_future(self._worker(i, interactive_only=i < reserved))
+            for i in range(workers)
+        ]
+        logger.info(f"下载任务队列已启动，工作协程数: {len(self._workers)}（其中 {reserved} 个只执行交互式任务）")
+
+    def start(self):
+        """启动工作协程（首次提交任务时自动调用）"""
+        with self._lock:
+            if self._ready is not None:
+                return
+            run_async(self._start_workers())
+
+    def _enqueue(self, job: DownloadJob) -> DownloadJob:
+        if job.priority not in self.PRIORITIES:
+            raise ValueError(f"无效的优先级: {job.priority}")
+        self.start()
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim_history()
+            item = (self.PRIORITIES[job.priority], next(self._sequence), job.job_id)
+
+        background_loop.submit(self._push(item))
+        return job
+
+    def submit(self, song_info: SongInfo, prefer_flac: bool = False,
+               add_metadata: bool = True, priority: str = "interactive") -> DownloadJob:
+        """提交下载任务，立即返回任务对象"""
+        job = self._enqueue(DownloadJob(
+            job_id=uuid.uuid4().hex,
+            song_info=song_info,
+            prefer_flac=prefer_flac,
+            add_metadata=add_metadata,
+            priority=priority,
+            created_at=time.time()
+        ))
+        logger.info(f"已提交下载任务 {job.job_id} ({priority}): {song_info.name}")
+        return job
+
+    def submit_batch(self, songs: List[SongInfo], prefer_flac: bool = False,
+                     add_metadata: bool = True, concurrency: int = None,
+                     priority: str = "bulk") -> DownloadJob:
+        """提交批量下载任务，立即返回任务对象"""
+        concurrency = concurrency or self.config["BATCH_DOWNLOAD_CONCURRENCY"]
+        concurrency = max(1, min(concurrency, self.config["BATCH_DOWNLOAD_MAX_CONCURRENCY"]))
+        job = self._enqueue(DownloadJob(
+            job_id=uuid.uuid4().hex,
+            kind="batch",
+            songs=songs,
+            concurrency=concurrency,
+            prefer_flac=prefer_flac,
+            add_metadata=add_metadata,
+            priority=priority,
+            created_at=time.time()
+        ))
+        logger.info(f"已提交批量下载任务 {job.job_id} ({priority}): {len(songs)} 首")
+        return job
+
+    def _trim_history(self):
+        """只保留最近的已结束任务"""
+        limit = self.config["DOWNLOAD_JOB_HISTORY"]
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.state in ("completed", "failed")]
+        for job_id in finished[:max(0, len(finished) - limit)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        """获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[DownloadJob]:
+        """获取所有任务（按提交顺序）"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def snapshot(self, jobs: List[DownloadJob]) -> List[DownloadJob]:
+        """复制任务的当前状态供请求线程读取
+
+        任务进度和各阶段耗时都在后台事件循环中修改，在事件循环中复制可避免读到修改到一半的数据。
+        """
+        def _copy() -> List[DownloadJob]:
+            return [dataclasses.replace(job, stage_timings=dict(job.stage_timings)) for job in jobs]
+
+        if background_loop.is_loop_thread():
+            return _copy()
+
+        async def _snapshot():
+            return _copy()
+
+        return run_async(_snapshot())
+
+    async def _push(self, item: Tuple[int, int, str]):
+        async with self._ready:
+            heapq.heappush(self._pending, item)
+            self._ready.notify_all()
+
+    async def _take(self, interactive_only: bool) -> Tuple[int, int, str]:
+        """取优先级最高的待执行任务；interactive_only 时只取交互式任务"""
+        def _available() -> bool:
+            if not self._pending:
+                return False
+            return not interactive_only or self._pending[0][0] <= self.PRIORITIES["interactive"]
+
+        async with self._ready:
+            await self._ready.wait_for(_available)
+            return heapq.heappop(self._pending)
+
+    async def _worker(self, index: int, interactive_only: bool = False):
+        while True:
+            _, _, job_id = await self._take(interactive_only)
+            try:
+                job = self.get(job_id)
+                if job is not None and job.state == "queued":
+                    await self._run_job(job)
+            except Exception as e:
+                logger.error(f"下载任务工作协程 {index} 出错: {e}", exc_info=True)
+
+    async def _run_job(self, job: DownloadJob):
+        job.state = "running"
+        job.started_at = time.time()
+        if job.kind == "batch":
+            await self._run_batch_job(job)
+            return
+
+        def _on_progress(done: int, total: Optional[int]):
+            job.bytes_done = done
+            job.bytes_total = total
+
+        try:
+            result = await self.music_downloader.download_song(
+                job.song_info, job.prefer_flac, job.add_metadata,
+                progress=_on_progress, stage_timings=job.stage_timings
+            )
+            if result:
+                job.result = result
+                if result.transfer:
+                    job.bytes_done = job.bytes_total = result.transfer.size
+                job.state = "completed"
+            else:
+                job.error = "所有音质下载失败"
+                job.state = "failed"
+        except Exception as e:
+            logger.error(f"下载任务 {job.job_id} 失败: {e}")
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    async def _run_batch_job(self, job: DownloadJob):
+        def _on_progress(done: int, total: Optional[int], items_done: int):
+            job.bytes_done = done
+            job.bytes_total = total
+            job.items_done = items_done
+
+        try:
+            job.result = await self.music_downloader.download_batch(
+                job.songs, job.prefer_flac, job.add_metadata, job.concurrency,
+                progress=_on_progress, stage_timings=job.stage_timings
+            )
+            job.items_done = len(job.result.items)
+            job.state = "completed"
+        except Exception as e:
+            logger.error(f"批量下载任务 {job.job_id} 失败: {e}")
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """队列统计信息"""
+        with self._lock:
+            states: Dict[str, int] = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "workers": self.config["DOWNLOAD_JOB_WORKERS"],
+            "reserved_workers": self.config["DOWNLOAD_JOB_RESERVED_WORKERS"],
+            "pending": len(self._pending),
+            "jobs": states
+        }
@@ -1,16 +1,40 @@
 import os
-import aiohttp
+import json
+import time
+import asyncio
 import logging
+import contextlib
+import aiohttp
+from collections import defaultdict
 from pathlib import Path
-from typing import Optional
+from typing import Optional, List, Tuple, Dict, Any, Callable, Awaitable
+from ..models import TransferResult, SegmentStats
+from ..utils.thread_utils import thread_pool
+from .upstream_governor import UpstreamUnavailableError
+from .cdn_fetcher import SlowTransferError
+from .metadata_manager import strip_reserve
 
 logger = logging.getLogger("qqmusic_web")
 
+ProgressCallback = Optional[Callable[[int, Optional[int]], None]]
+# 下载完成、提交文件前调用，参数为 (.part 文件路径, 文件开头预留的字节数)，返回是否已写入标签
+FinalizeCallback = Optional[Callable[[Path, int], Awaitable[bool]]]
+# 开始写入数据时调用，参数为 (.part 文件路径, 总字节数, 各分段)；分段的已接收字节数随下载实时更新
+StartCallback = Optional[Callable[[Path, Optional[int], List[SegmentStats]], None]]
+
 class FileManager:
     """文件管理器"""
 
-    def __init__(self, config):
+    PART_SUFFIX = ".part"
+    META_SUFFIX = ".part.json"
+
+    def __init__(self, config, cdn_fetcher, library_index):
         self.config = config
+        self.cdn_fetcher = cdn_fetcher
+        self.library_index = library_index
+        # 同一文件的下载串行执行；记录每个锁的使用者数，无人使用时移除
+        self._path_locks: Dict[Path, asyncio.Lock] = {}
+        self._path_lock_users: Dict[Path, int] = defaultdict(int)
 
     def sanitize_filename(self, filename: str) -> str:
         """清理文件名中的非法字符并限制长度"""
@@ -28,20 +52,460 @@ class FileManager:
     async def download_file_content(self, url: str) -> Optional[bytes]:
         """异步下载文件内容"""
         try:
-            async with aiohttp.ClientSession(
-                    timeout=aiohttp.ClientTimeout(total=self.config["DOWNLOAD_TIMEOUT"])
-            ) as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        # 检查内容是否有效（大于1KB）
-                        if len(content) > 1024:
-                            return content
-                        else:
-                            logger.warning(f"下载内容过小: {len(content)} bytes")
+            async with self.cdn_fetcher.get("cdn", url) as resp:
+                if resp.status == 200:
+                    content = await resp.read()
+                    # 检查内容是否有效（大于1KB）
+                    if len(content) > 1024:
+                        return content
                     else:
-                        logger.warning(f"下载失败，状态码: {resp.status}")
-                    return None
+                        logger.warning(f"下载内容过小: {len(content)} bytes")
+                else:
+                    logger.warning(f"下载失败，状态码: {resp.status}")
+                return None
         except Exception as e:
             logger.error(f"下载文件时出错: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    @contextlib.asynccontextmanager
+    async def _lock_path(self, filepath: Path):
+        """获取文件路径的下载锁（async with），没有其他协程等待时退出后移除该锁"""
+        lock = self._path_locks.setdefault(filepath, asyncio.Lock())
+        self._path_lock_users[filepath] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._path_lock_users[filepath] -= 1
+            if not self._path_lock_users[filepath]:
+                del self._path_lock_users[filepath]
+                self._path_locks.pop(filepath, None)
+
+    def _completed_while_waiting(self, filepath: Path, waiting_since: float) -> Optional[TransferResult]:
+        """目标文件已存在且已登记到音乐库（或在开始等待后才生成，对方尚未登记）时返回复用结果"""
+        try:
+            stat = filepath.stat()
+        except OSError:
+            return None
+        entry = self.library_index.get(filepath.name)
+        # 重命名会更新 ctime
+        if entry is None and max(stat.st_mtime, stat.st_ctime) < waiting_since:
+            return None
+        return TransferResult(
+            size=stat.st_size, elapsed=0.0,
+            tags_embedded=entry.metadata_added if entry is not None else False, reused=True
+        )
+
+    def _part_path_for(self, filepath: Path) -> Path:
+        """未完成下载的数据文件路径（隐藏文件，不会被缓存检查命中）"""
+        return filepath.with_name(f".{filepath.name}{self.PART_SUFFIX}")
+
+    def _meta_path_for(self, filepath: Path) -> Path:
+        """未完成下载的进度记录文件路径"""
+        return filepath.with_name(f".{filepath.name}{self.META_SUFFIX}")
+
+    @staticmethod
+    def _fsync_and_close(f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    @staticmethod
+    def _commit_file(temp_path: Path, filepath: Path):
+        """将临时文件原子替换到目标位置"""
+        os.replace(temp_path, filepath)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(filepath.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    @staticmethod
+    def _discard_partial(part_path: Path, meta_path: Path):
+        part_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _save_partial_meta(meta_path: Path, source: Dict[str, Any], total: int,
+                           segments: List[SegmentStats], reserve: int = 0):
+        """记录未完成下载的来源、文件开头预留的字节数和各分段已接收的字节数"""
+        meta = {
+            "source": source,
+            "expected_length": total,
+            "reserve": reserve,
+            "bytes_received": sum(s.resumed + s.bytes for s in segments),
+            "segments": [[s.start, s.end, s.resumed + s.bytes] for s in segments],
+            "updated_at": time.time()
+        }
+        temp_meta = meta_path.with_name(meta_path.name + ".tmp")
+        temp_meta.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(temp_meta, meta_path)
+
+    @staticmethod
+    def _load_partial_meta(part_path: Path, meta_path: Path, source: Dict[str, Any],
+                           total: int) -> Optional[Tuple[List[SegmentStats], int]]:
+        """读取可续传的分段进度和预留字节数，来源或长度不匹配时返回None"""
+        if not part_path.exists() or not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("source") != source or meta.get("expected_length") != total:
+            return None
+        reserve = meta.get("reserve", 0)
+        if part_path.stat().st_size != total + reserve:
+            return None
+
+        segments = []
+        for index, (start, end, received) in enumerate(meta.get("segments", [])):
+            received = max(0, min(received, end - start + 1))
+            segments.append(SegmentStats(index=index, start=start, end=end, resumed=received))
+        return (segments, reserve) if segments else None
+
+    async def _write_body(self, resp, f, on_write: Callable[[int], None] = None) -> int:
+        """将响应体分块写入已打开的文件，返回写入的字节数"""
+        loop = asyncio.get_running_loop()
+        chunk_size = self.config["DOWNLOAD_CHUNK_SIZE"]
+        written = 0
+        buffer = bytearray()
+
+        def _write(data: bytes):
+            # 写入后立即交给系统，下载过程中其他读取者可以读到已计数的数据
+            f.write(data)
+            f.flush()
+
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            buffer.extend(chunk)
+            if len(buffer) >= chunk_size:
+                await loop.run_in_executor(thread_pool, _write, bytes(buffer))
+                written += len(buffer)
+                if on_write:
+                    on_write(len(buffer))
+                buffer.clear()
+        if buffer:
+            await loop.run_in_executor(thread_pool, _write, bytes(buffer))
+            written += len(buffer)
+            if on_write:
+                on_write(len(buffer))
+        return written
+
+    async def _probe(self, url: str) -> Tuple[Optional[int], bool]:
+        """探测文件大小以及服务器是否支持 Range 请求"""
+        async with self.cdn_fetcher.get("cdn", url, headers={"Range": "bytes=0-0"}) as resp:
+            if resp.status == 206:
+                # Content-Range: bytes 0-0/12345
+                content_range = resp.headers.get("Content-Range", "")
+                total = content_range.rpartition("/")[2]
+                return (int(total), True) if total.isdigit() else (None, False)
+            if resp.status == 200:
+                accept_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                return resp.content_length, accept_ranges and resp.content_length is not None
+            return None, False
+
+    def _plan_segments(self, total: int) -> List[SegmentStats]:
+        """将文件按字节范围均分为若干段（小文件或未启用分段时为单段）"""
+        count = 1
+        if (self.config["SEGMENTED_DOWNLOAD_ENABLED"]
+                and total >= self.config["SEGMENT_THRESHOLD"]):
+            count = max(1, min(self.config["DOWNLOAD_SEGMENTS"], total // (1024 * 1024) or 1))
+        segment_size = -(-total // count)
+        return [
+            SegmentStats(index=i, start=start, end=min(start + segment_size, total) - 1)
+            for i, start in enumerate(range(0, total, segment_size))
+        ]
+
+    async def _download_segment(self, url: str, part_path: Path, segment: SegmentStats,
+                                on_progress: Callable[[], None] = None, reserve: int = 0):
+        """下载单个分段的剩余字节范围并写入预分配文件的对应位置（整体后移 reserve 字节）
+
+        传输中断或速度低于该主机的历史水平时，按指数退避重新请求尚未收到的部分。
+        """
+        started = time.monotonic()
+        attempts = max(1, self.config["CDN_RETRY_ATTEMPTS"])
+        for attempt in range(attempts):
+            received = segment.bytes
+            try:
+                await self._fetch_segment_range(url, part_path, segment, on_progress, reserve)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, SlowTransferError) as e:
+                # 连接阶段的失败已由 CdnFetcher 重试，这里只处理已收到部分数据后中断或过慢的传输
+                if attempt == attempts - 1 or (segment.bytes == received and not isinstance(e, SlowTransferError)):
+                    raise
+                logger.info(f"分段 {segment.index} 传输中断，重新请求剩余部分: {e}")
+                await asyncio.sleep(self.cdn_fetcher.backoff(attempt + 1))
+
+        expected = segment.end - segment.start - segment.resumed + 1
+        if segment.bytes != expected:
+            raise IOError(f"分段 {segment.index} 数据不完整: {segment.bytes}/{expected} bytes")
+        segment.elapsed = time.monotonic() - started
+        segment.throughput = segment.bytes / segment.elapsed if segment.elapsed > 0 else 0.0
+        logger.debug(f"分段 {segment.index} 完成: {segment.bytes} bytes, "
+                     f"{segment.throughput / 1024:.1f} KB/s")
+
+    async def _fetch_segment_range(self, url: str, part_path: Path, segment: SegmentStats,
+                                   on_progress: Callable[[], None] = None, reserve: int = 0):
+        """请求分段中尚未收到的字节范围并写入文件，记录本次连接的传输速度"""
+        loop = asyncio.get_running_loop()
+        offset = segment.start + segment.resumed + segment.bytes
+        if offset > segment.end:
+            return
+
+        headers = {"Range": f"bytes={offset}-{segment.end}"}
+        async with self.cdn_fetcher.get("cdn", url, headers=headers) as resp:
+            if resp.status != 206:
+                raise IOError(f"分段 {segment.index} 请求失败，状态码: {resp.status}")
+            threshold = self.cdn_fetcher.slow_threshold(url)
+            started = time.monotonic()
+            received = 0
+            f = await loop.run_in_executor(thread_pool, open, part_path, "r+b")
+            try:
+                await loop.run_in_executor(thread_pool, f.seek, reserve + offset)
+
+                def _on_write(n: int):
+                    nonlocal received
+                    segment.bytes += n
+                    received += n
+                    if on_progress:
+                        on_progress()
+                    self.cdn_fetcher.check_rate(url, received, time.monotonic() - started, threshold)
+
+                await self._write_body(resp, f, _on_write)
+            finally:
+                await loop.run_in_executor(thread_pool, f.close)
+            self.cdn_fetcher.record_transfer(url, received, time.monotonic() - started)
+
+    async def _download_ranges(self, url: str, part_path: Path, meta_path: Path,
+                               source: Dict[str, Any], total: int, segments: List[SegmentStats],
+                               progress: ProgressCallback = None, reserve: int = 0) -> bool:
+        """并发下载各分段的剩余部分，期间定期记录进度；失败时保留进度供下次续传"""
+        loop = asyncio.get_running_loop()
+
+        def _on_progress():
+            if progress:
+                progress(sum(s.resumed + s.bytes for s in segments), total)
+
+        async def _persist_periodically():
+            while True:
+                await asyncio.sleep(self.config["PARTIAL_META_INTERVAL"])
+                await loop.run_in_executor(
+                    thread_pool, self._save_partial_meta, meta_path, source, total, segments, reserve
+                )
+
+        await loop.run_in_executor(
+            thread_pool, self._save_partial_meta, meta_path, source, total, segments, reserve
+        )
+        persist_task = asyncio.ensure_future(_persist_periodically())
+        tasks = [
+            asyncio.ensure_future(self._download_segment(url, part_path, segment, _on_progress, reserve))
+            for segment in segments
+        ]
+        _on_progress()
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            # 取消其余分段，避免其继续写入文件
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(e, Exception):
+                raise
+            # 包括下载中途上游被熔断或限流（UpstreamUnavailableError）：已有数据保留在 .part 文件中
+            logger.warning(f"下载中断，已保留进度以便续传: {e}")
+            return False
+        finally:
+            persist_task.cancel()
+            await asyncio.gather(persist_task, return_exceptions=True)
+            await loop.run_in_executor(
+                thread_pool, self._save_partial_meta, meta_path, source, total, segments, reserve
+            )
+
+        def _fsync():
+            with open(part_path, "r+b") as f:
+                os.fsync(f.fileno())
+
+        await loop.run_in_executor(thread_pool, _fsync)
+        return True
+
+    async def _download_single(self, url: str, part_path: Path, progress: ProgressCallback = None,
+                               reserve: int = 0, on_start: StartCallback = None) -> Optional[List[SegmentStats]]:
+        """单连接流式下载（服务器不支持 Range 时使用，无法续传），失败返回None"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        async with self.cdn_fetcher.get("cdn", url) as resp:
+            if resp.status != 200:
+                logger.warning(f"下载失败，状态码: {resp.status}")
+                return None
+
+            total = resp.content_length
+            segment = SegmentStats(index=0, start=0, end=total - 1 if total else -1)
+
+            def _on_write(n: int):
+                segment.bytes += n
+                if progress:
+                    progress(segment.bytes, total)
+
+            f = await loop.run_in_executor(thread_pool, open, part_path, "wb")
+            try:
+                if reserve:
+                    f.truncate(reserve)
+                    f.seek(reserve)
+                if on_start:
+                    on_start(part_path, total, [segment])
+                size = await self._write_body(resp, f, _on_write)
+                await loop.run_in_executor(thread_pool, self._fsync_and_close, f)
+            finally:
+                if not f.closed:
+                    f.close()
+
+        segment.end = size - 1
+        segment.elapsed = time.monotonic() - started
+        segment.throughput = size / segment.elapsed if segment.elapsed > 0 else 0.0
+        self.cdn_fetcher.record_transfer(url, size, segment.elapsed)
+        return [segment]
+
+    async def download_to_file(self, url: str, filepath: Path, source: Dict[str, Any] = None,
+                               progress: ProgressCallback = None, reserve: int = 0,
+                               finalize: FinalizeCallback = None,
+                               on_start: StartCallback = None) -> Optional[TransferResult]:
+        """流式下载文件到磁盘，完成后原子重命名
+
+        服务器支持 Range 时，数据写入 .part 文件并在旁边记录进度；中断后再次下载
+        同一来源（source，如歌曲mid和音质）时只请求剩余部分。大文件按分段并发下载。
+        progress 回调参数为 (已完成字节数, 总字节数)，总字节数未知时为None。
+        reserve 为在文件开头为标签预留的字节数，下载内容写在其后；提供 finalize 时，
+        下载完成后由其填充预留区域（续传时沿用上次记录的预留字节数）。
+        on_start 在开始写入数据时调用，可据此在下载过程中读取 .part 文件中已完成的部分。
+        上游不可用时只在探测阶段抛出 UpstreamUnavailableError，下载中途则与其他失败一样返回None。
+        """
+        loop = asyncio.get_running_loop()
+        source = source or {}
+        part_path = self._part_path_for(filepath)
+        meta_path = self._meta_path_for(filepath)
+        started = time.monotonic()
+        waiting_since = time.time()
+
+        async with self._lock_path(filepath):
+            # 等待期间同一文件可能已由其他下载（如代理播放）完成，不再重复下载覆盖
+            reused = await loop.run_in_executor(thread_pool, self._completed_while_waiting, filepath, waiting_since)
+            if reused is not None:
+                logger.info(f"文件已由其他下载完成: {filepath.name}")
+                return reused
+
+            probed = False
+            try:
+                total, accepts_ranges = await self._probe(url)
+                probed = True
+
+                if accepts_ranges and total:
+                    partial = await loop.run_in_executor(
+                        thread_pool, self._load_partial_meta, part_path, meta_path, source, total
+                    )
+                    if partial and partial[1] and finalize is None:
+                        # 预留了标签空间但本次不写入标签，无法续传
+                        partial = None
+                    if partial:
+                        segments, reserve = partial
+                        resumed = sum(s.resumed for s in segments)
+                        logger.info(f"续传未完成的下载: {filepath.name}, 已有 {resumed}/{total} bytes")
+                    else:
+                        segments = self._plan_segments(total)
+
+                        def _preallocate():
+                            with open(part_path, "wb") as f:
+                                f.truncate(reserve + total)
+
+                        await loop.run_in_executor(thread_pool, _preallocate)
+
+                    if on_start:
+                        on_start(part_path, total, segments)
+                    if not await self._download_ranges(
+                            url, part_path, meta_path, source, total, segments, progress, reserve):
+                        return None
+                else:
+                    segments = await self._download_single(url, part_path, progress, reserve, on_start)
+                    if segments is None:
+                        await loop.run_in_executor(
+                            thread_pool, self._discard_partial, part_path, meta_path
+                        )
+                        return None
+
+                bytes_resumed = sum(s.resumed for s in segments)
+                bytes_fetched = sum(s.bytes for s in segments)
+                size = bytes_resumed + bytes_fetched
+                # 检查内容是否有效（大于1KB）
+                if size <= 1024:
+                    logger.warning(f"下载内容过小: {size} bytes")
+                    await loop.run_in_executor(thread_pool, self._discard_partial, part_path, meta_path)
+                    return None
+
+                tags_embedded = False
+                if finalize is not None:
+                    try:
+                        tags_embedded = await finalize(part_path, reserve)
+                    except Exception as e:
+                        # 标签写入失败不影响已下载完成的文件：移除预留区域还原为下载内容，由调用方在下载后再写入
+                        logger.warning(f"下载过程中写入标签失败，将在下载后重试: {e}")
+                        tags_embedded = False
+                        if reserve:
+                            await loop.run_in_executor(thread_pool, self._strip_part_reserve, part_path, reserve)
+
+                await loop.run_in_executor(thread_pool, self._commit_file, part_path, filepath)
+                meta_path.unlink(missing_ok=True)
+
+                elapsed = time.monotonic() - started
+                segmented = len(segments) > 1
+                if segmented:
+                    logger.info(f"分段下载完成: {filepath.name}, {len(segments)} 段, {size} bytes, "
+                                f"{bytes_fetched / elapsed / 1024:.1f} KB/s; 各段速度: "
+                                + ", ".join(f"{s.throughput / 1024:.1f} KB/s" for s in segments))
+                return TransferResult(
+                    size=size, elapsed=elapsed, segmented=segmented, segments=segments,
+                    bytes_fetched=bytes_fetched, bytes_resumed=bytes_resumed, tags_embedded=tags_embedded
+                )
+
+            except UpstreamUnavailableError as e:
+                # 尚未请求任何数据时直接失败，由调用方快速返回；下载中途则按普通失败处理
+                if not probed:
+                    raise
+                logger.warning(f"下载中断: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"下载文件时出错: {e}")
+                return None
+
+    @staticmethod
+    def _strip_part_reserve(part_path: Path, reserve: int):
+        with open(part_path, "r+b") as f:
+            strip_reserve(f, reserve)
+
+    def cleanup_partial_files(self) -> int:
+        """清理过期的未完成下载文件及无对应数据文件的进度记录"""
+        music_dir = Path(self.config["MUSIC_DIR"])
+        if not music_dir.exists():
+            return 0
+
+        removed = 0
+        expire_before = time.time() - self.config["PARTIAL_DOWNLOAD_MAX_AGE"]
+        for partial_file in music_dir.glob(".*"):
+            name = partial_file.name
+            try:
+                if name.endswith(self.PART_SUFFIX):
+                    if partial_file.stat().st_mtime < expire_before:
+                        partial_file.unlink()
+                        partial_file.with_name(name[:-len(self.PART_SUFFIX)] + self.META_SUFFIX).unlink(missing_ok=True)
+                        removed += 1
+                elif name.endswith(self.META_SUFFIX):
+                    if not partial_file.with_name(name[:-len(self.META_SUFFIX)] + self.PART_SUFFIX).exists():
+                        partial_file.unlink()
+                elif name.endswith(".tmp"):
+                    partial_file.unlink()
+                    removed += 1
+            except OSError as e:
+                logger.error(f"删除未完成下载文件失败 {partial_file}: {e}")
+
+        if removed:
+            logger.info(f"已清理 {removed} 个过期的未完成下载文件")
+        return removed
@@ -0,0 +1,52 @@
+import aiohttp
+import logging
+from typing import Optional
+from qqmusic_api.utils.session import Session, set_session
+from ..utils.thread_utils import background_loop
+
+logger = logging.getLogger("qqmusic_web")
+
+class HttpClient:
+    """共享HTTP连接池（运行在后台事件循环上，供所有服务复用）"""
+
+    def __init__(self, config):
+        self.config = config
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._api_session: Optional[Session] = None
+        background_loop.add_shutdown_hook(self.close)
+
+    def _create_connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            limit=self.config["HTTP_POOL_LIMIT"],
+            limit_per_host=self.config["HTTP_POOL_LIMIT_PER_HOST"],
+            ttl_dns_cache=self.config["HTTP_DNS_CACHE_TTL"],
+            keepalive_timeout=self.config["HTTP_KEEPALIVE_TIMEOUT"]
+        )
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 aiohttp 会话（需在后台事件循环中调用）"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._create_connector(),
+                timeout=aiohttp.ClientTimeout(total=self.config["DOWNLOAD_TIMEOUT"])
+            )
+            logger.info("已创建共享HTTP连接池")
+        return self._session
+
+    def init_api_session(self):
+        """创建 qqmusic_api 共享会话并绑定到后台事件循环的任务上下文"""
+        if self._api_session is None:
+            self._api_session = Session()
+            background_loop.run_in_context(set_session, self._api_session)
+        return self._api_session
+
+    async def close(self):
+        """关闭所有连接"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("共享HTTP连接池已关闭")
+        self._session = None
+
+        if self._api_session is not None:
+            await self._api_session.aclose()
+            self._api_session = None
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any
+from ..utils.thread_utils import background_loop, thread_pool
+
+logger = logging.getLogger("qqmusic_web")
+
+class LibraryEvictor:
+    """音乐目录容量控制：超出容量上限时按最近访问时间（LRU）在后台分批清理文件"""
+
+    def __init__(self, config, library_index):
+        self.config = config
+        self.library_index = library_index
+        self.max_bytes = config["MUSIC_DIR_MAX_BYTES"]
+        self.target_bytes = int(self.max_bytes * config["MUSIC_EVICTION_TARGET_RATIO"])
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.last_run: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def start(self):
+        """启动后台清理任务（未设置容量上限时不启动）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._task is not None:
+                return
+            self._task = background_loop.submit(self._run())
+        logger.info(f"音乐目录容量上限: {self.max_bytes / 1024 / 1024:.0f} MB")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # 总大小由索引维护，未超出上限时检查无需访问数据库
+                while self.library_index.total_bytes > self.max_bytes:
+                    if not await loop.run_in_executor(thread_pool, self.evict_batch):
+                        break
+            except Exception as e:
+                logger.error(f"清理音乐目录失败: {e}")
+            await asyncio.sleep(self.config["MUSIC_EVICTION_INTERVAL"])
+
+    def evict_batch(self, force: bool = False) -> int:
+        """清理一批最久未访问的文件直到低于目标大小，返回清理的文件数
+
+        force 为 False 时只在超出容量上限后清理；最近访问过的文件不会被清理。
+        """
+        self.last_run = time.time()
+        if not self.enabled or (not force and self.library_index.total_bytes <= self.max_bytes):
+            return 0
+
+        accessed_before = time.time() - self.config["MUSIC_EVICTION_MIN_IDLE"]
+        candidates = self.library_index.eviction_candidates(
+            self.config["MUSIC_EVICTION_BATCH"], accessed_before
+        )
+        evicted = 0
+        for entry in candidates:
+            if self.library_index.total_bytes <= self.target_bytes:
+                break
+            try:
+                (self.library_index.music_dir / entry.filename).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"删除文件失败 {entry.filename}: {e}")
+                continue
+            self.library_index.remove(entry.filename)
+            evicted += 1
+            with self._lock:
+                self.evictions += 1
+                self.evicted_bytes += entry.size
+            logger.info(f"音乐目录超出容量上限，已清理: {entry.filename}")
+        return evicted
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """容量使用和清理统计"""
+        stats = self.library_index.stats
+        with self._lock:
+            stats.update({
+                "max_bytes": self.max_bytes,
+                "target_bytes": self.target_bytes,
+                "usage": round(stats["total_bytes"] / self.max_bytes, 4) if self.enabled else None,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "last_run": self.last_run
+            })
+        return stats
@@ -0,0 +1,166 @@
+import os
+import time
+import zlib
+import struct
+import logging
+from typing import List, Iterator
+from qqmusic_api.song import SongFileType
+from ..models import ZipMember
+
+logger = logging.getLogger("qqmusic_web")
+
+# ZIP 格式常量（仅存储，不压缩）
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x0008 | 0x0800  # 数据描述符 + UTF-8文件名
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR64 = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+END_LOCATOR64 = struct.Struct("<IIQI")
+
+
+def needs_zip64(member: ZipMember) -> bool:
+    """文件大小或偏移超出ZIP32限制时需要zip64扩展字段"""
+    return member.size >= ZIP32_LIMIT or member.offset >= ZIP32_LIMIT
+
+
+def dos_datetime(timestamp: float):
+    """转换为ZIP使用的DOS日期和时间"""
+    t = time.localtime(timestamp)
+    year = min(max(t.tm_year, 1980), 2107)
+    return ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday, (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+
+
+def local_header(member: ZipMember) -> bytes:
+    """本地文件头（CRC和大小写在文件数据后的数据描述符中）"""
+    date, dostime = dos_datetime(member.mtime)
+    if needs_zip64(member):
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+        sizes = ZIP32_LIMIT
+    else:
+        extra = b""
+        sizes = 0
+    return LOCAL_HEADER.pack(
+        0x04034B50, 45 if needs_zip64(member) else 20, ZIP_FLAGS, 0, dostime, date,
+        0, sizes, sizes, len(member.name), len(extra)
+    ) + member.name + extra
+
+
+def data_descriptor(member: ZipMember) -> bytes:
+    """数据描述符（本地文件头带有zip64扩展字段时大小为8字节）"""
+    if needs_zip64(member):
+        return DATA_DESCRIPTOR64.pack(0x08074B50, member.crc, member.size, member.size)
+    return DATA_DESCRIPTOR.pack(0x08074B50, member.crc, member.size, member.size)
+
+
+def central_header(member: ZipMember) -> bytes:
+    """中央目录中的文件记录"""
+    date, dostime = dos_datetime(member.mtime)
+    fields = []
+    size = member.size
+    offset = member.offset
+    if member.size >= ZIP32_LIMIT:
+        fields += [member.size, member.size]
+        size = ZIP32_LIMIT
+    if member.offset >= ZIP32_LIMIT:
+        fields.append(member.offset)
+        offset = ZIP32_LIMIT
+    extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields) if fields else b""
+    version = 45 if needs_zip64(member) else 20
+    return CENTRAL_HEADER.pack(
+        0x02014B50, version, version, ZIP_FLAGS, 0, dostime, date,
+        member.crc, size, size, len(member.name), len(extra), 0, 0, 0, 0, offset
+    ) + member.name + extra
+
+
+def end_records(count: int, directory_offset: int, directory_size: int) -> bytes:
+    """中央目录结束记录（超出ZIP32限制时在前面加上zip64结束记录和定位符）"""
+    if count < 0xFFFF and directory_offset < ZIP32_LIMIT and directory_size < ZIP32_LIMIT:
+        return END_RECORD.pack(0x06054B50, 0, 0, count, count, directory_size, directory_offset, 0)
+    end64_offset = directory_offset + directory_size
+    return (
+        END_RECORD64.pack(0x06064B50, END_RECORD64.size - 12, 45, 45, 0, 0,
+                          count, count, directory_size, directory_offset)
+        + END_LOCATOR64.pack(0x07064B50, 0, end64_offset, 1)
+        + END_RECORD.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, ZIP32_LIMIT, ZIP32_LIMIT, 0)
+    )
+
+
+def plan_archive(members: List[ZipMember]) -> int:
+    """计算各文件在归档中的偏移，返回归档的总大小"""
+    offset = 0
+    for member in members:
+        member.offset = offset
+        offset += len(local_header(member)) + member.size + len(data_descriptor(member))
+    directory_size = sum(len(central_header(member)) for member in members)
+    return offset + directory_size + len(end_records(len(members), offset, directory_size))
+
+
+class LibraryExporter:
+    """音乐库导出：将多个文件边读取边生成为ZIP（仅存储不压缩），不在内存或磁盘中生成完整归档"""
+
+    def __init__(self, config, library_index):
+        self.config = config
+        self.library_index = library_index
+
+    def collect(self, filenames: List[str], mids: List[str],
+                file_types: List[SongFileType]) -> List[ZipMember]:
+        """按文件名和歌曲MID（取 file_types 中最先存在的音质）查找要导出的文件，忽略不存在的"""
+        names = list(filenames)
+        for mid in mids:
+            entry = self.library_index.find(mid, file_types)
+            if entry is not None:
+                names.append(entry.filename)
+
+        members = []
+        seen = set()
+        for name in names:
+            if name in seen or '/' in name or '..' in name:
+                continue
+            seen.add(name)
+            path = self.library_index.music_dir / name
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if not path.is_file():
+                continue
+            # 更新访问时间，导出期间不会被容量清理删除
+            self.library_index.touch(name, count_hit=False)
+            members.append(ZipMember(name=name.encode("utf-8"), path=path, size=stat.st_size, mtime=stat.st_mtime))
+        return members
+
+    def stream(self, members: List[ZipMember]) -> Iterator[bytes]:
+        """依次输出归档内容（需先调用 plan_archive）
+
+        文件在导出过程中被修改（大小与预先计算的不一致）时，已声明的 Content-Length
+        无法再满足，只能抛出异常中断连接。
+        """
+        chunk_size = self.config["EXPORT_CHUNK_SIZE"]
+        logger.info(f"开始导出 {len(members)} 个文件")
+        offset = 0
+        for member in members:
+            header = local_header(member)
+            yield header
+            crc = 0
+            remaining = member.size
+            with open(member.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size != member.size:
+                    raise IOError(f"导出过程中文件被修改: {member.path.name}")
+                while remaining > 0:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        raise IOError(f"导出过程中文件被修改: {member.path.name}")
+                    crc = zlib.crc32(data, crc)
+                    remaining -= len(data)
+                    yield data
+            member.crc = crc
+            descriptor = data_descriptor(member)
+            yield descriptor
+            offset += len(header) + member.size + len(descriptor)
+
+        directory = b"".join(central_header(member) for member in members)
+        yield directory
+        yield end_records(len(members), offset, len(directory))
@@ -0,0 +1,294 @@
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+from qqmusic_api.song import SongFileType
+from ..models import LibraryEntry
+from ..utils.thread_utils import background_loop
+
+logger = logging.getLogger("qqmusic_web")
+
+# 音乐目录中视为音频文件的扩展名
+AUDIO_EXTENSIONS = {file_type.e for file_type in SongFileType}
+
+COLUMNS = "filename, size, mid, file_type, quality, checksum, metadata_added, created_at, last_access, pinned"
+
+
+def file_checksum(path: Path) -> str:
+    """计算文件的SHA-1"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LibraryIndex:
+    """音乐库索引（SQLite）：记录每首歌曲各音质对应的文件，替代按文件名检查文件是否存在"""
+
+    def __init__(self, config):
+        self.config = config
+        self.music_dir = Path(config["MUSIC_DIR"])
+        self.db_path = Path(config["CACHE_DIR"]) / "library.db"
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # 文件数和总大小在每次写入后更新，查询时无需扫描
+        self._count = 0
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        background_loop.add_shutdown_hook(self.close)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS tracks ("
+                    "filename TEXT PRIMARY KEY, size INTEGER NOT NULL, mid TEXT, file_type TEXT, "
+                    "quality TEXT, checksum TEXT, metadata_added INTEGER NOT NULL DEFAULT 0, "
+                    "created_at REAL NOT NULL, last_access REAL NOT NULL DEFAULT 0, "
+                    "pinned INTEGER NOT NULL DEFAULT 0, UNIQUE (mid, file_type))"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_tracks_last_access ON tracks(last_access)")
+            self._refresh_totals(self._db)
+        return self._db
+
+    def _refresh_totals(self, db: sqlite3.Connection):
+        self._count, self._total_bytes = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks"
+        ).fetchone()
+
+    @staticmethod
+    def _to_entry(row) -> LibraryEntry:
+        (filename, size, mid, file_type, quality, checksum,
+         metadata_added, created_at, last_access, pinned) = row
+        return LibraryEntry(
+            filename=filename, size=size, mid=mid, file_type=file_type, quality=quality,
+            checksum=checksum, metadata_added=bool(metadata_added), created_at=created_at,
+            last_access=last_access, pinned=bool(pinned)
+        )
+
+    def _delete(self, db: sqlite3.Connection, filenames: List[str]):
+        with db:
+            db.executemany("DELETE FROM tracks WHERE filename = ?", [(name,) for name in filenames])
+        self._refresh_totals(db)
+
+    def _existing(self, db: sqlite3.Connection, rows) -> List[LibraryEntry]:
+        """过滤掉文件已被删除的记录（同时从索引中移除）"""
+        entries, missing = [], []
+        for row in rows:
+            entry = self._to_entry(row)
+            if (self.music_dir / entry.filename).is_file():
+                entries.append(entry)
+            else:
+                missing.append(entry.filename)
+        if missing:
+            logger.info(f"音乐库文件已不存在，移除索引: {missing}")
+            self._delete(db, missing)
+        return entries
+
+    def find(self, mid: str, file_types: List[SongFileType]) -> Optional[LibraryEntry]:
+        """按给定的音质顺序查找已下载的文件"""
+        if not mid:
+            return None
+        names = [file_type.name for file_type in file_types]
+        with self._lock:
+            db = self._connection()
+            rows = db.execute(
+                f"SELECT {COLUMNS} FROM tracks WHERE mid = ? AND file_type IN ({','.join('?' * len(names))})",
+                [mid, *names]
+            ).fetchall()
+            entries = {entry.file_type: entry for entry in self._existing(db, rows)}
+        for name in names:
+            if name in entries:
+                return entries[name]
+        return None
+
+    def get(self, filename: str) -> Optional[LibraryEntry]:
+        """按文件名查询"""
+        with self._lock:
+            db = self._connection()
+            row = db.execute(f"SELECT {COLUMNS} FROM tracks WHERE filename = ?", (filename,)).fetchone()
+            entries = self._existing(db, [row]) if row else []
+        return entries[0] if entries else None
+
+    def claim_path(self, mid: str, file_type: SongFileType, quality: str,
+                   base_name: str) -> Tuple[Path, Optional[LibraryEntry]]:
+        """确定歌曲文件的保存路径，返回 (路径, 已有的记录)
+
+        该歌曲该音质已在库中时直接返回已有文件；同名文件是未登记的旧文件时认领该文件；
+        同名文件属于其他歌曲时在文件名后加上mid，避免覆盖。
+        """
+        existing = self.find(mid, [file_type])
+        if existing is not None:
+            self.touch(existing.filename)
+            return self.music_dir / existing.filename, existing
+
+        filename = f"{base_name}{file_type.e}"
+        owner = self.get(filename)
+        if owner is None:
+            if not (self.music_dir / filename).exists():
+                return self.music_dir / filename, None
+        elif owner.mid is None:
+            with self._lock:
+                db = self._connection()
+                with db:
+                    db.execute(
+                        "UPDATE tracks SET mid = ?, file_type = ?, quality = ? WHERE filename = ?",
+                        (mid, file_type.name, quality, filename)
+                    )
+            owner.mid, owner.file_type, owner.quality = mid, file_type.name, quality
+            self.touch(filename)
+            logger.info(f"认领音乐库中未登记的文件: {filename}")
+            return self.music_dir / filename, owner
+
+        # 同名文件属于其他歌曲（或是索引尚未登记的文件）
+        return self.music_dir / f"{base_name} [{mid}]{file_type.e}", None
+
+    def record(self, mid: str, file_type: SongFileType, quality: str, path: Path,
+               metadata_added: bool = False, checksum: str = None, count_miss: bool = True) -> LibraryEntry:
+        """登记下载完成的文件（阻塞操作，未提供checksum时会读取整个文件计算）"""
+        now = time.time()
+        entry = LibraryEntry(
+            filename=path.name,
+            size=path.stat().st_size,
+            mid=mid,
+            file_type=file_type.name,
+            quality=quality,
+            checksum=checksum or file_checksum(path),
+            metadata_added=metadata_added,
+            created_at=now,
+            last_access=now
+        )
+        with self._lock:
+            db = self._connection()
+            with db:
+                row = db.execute("SELECT pinned FROM tracks WHERE filename = ?", (entry.filename,)).fetchone()
+                entry.pinned = bool(row and row[0])
+                # 同一歌曲同一音质只保留一个文件，同名文件只属于一首歌曲
+                db.execute(
+                    f"INSERT OR REPLACE INTO tracks ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry.filename, entry.size, entry.mid, entry.file_type, entry.quality, entry.checksum,
+                     int(entry.metadata_added), entry.created_at, entry.last_access, int(entry.pinned))
+                )
+            self._refresh_totals(db)
+            # 需要下载才能提供的请求计为未命中
+            if count_miss:
+                self.misses += 1
+        return entry
+
+    def touch(self, filename: str, count_hit: bool = True):
+        """更新文件的最近访问时间（缓存命中或提供下载时调用）"""
+        with self._lock:
+            db = self._connection()
+            with db:
+                updated = db.execute(
+                    "UPDATE tracks SET last_access = ? WHERE filename = ?", (time.time(), filename)
+                ).rowcount
+            if updated and count_hit:
+                self.hits += 1
+
+    def set_pinned(self, filename: str, pinned: bool) -> bool:
+        """固定或取消固定文件，文件未登记时返回False"""
+        with self._lock:
+            db = self._connection()
+            with db:
+                return db.execute(
+                    "UPDATE tracks SET pinned = ? WHERE filename = ?", (int(pinned), filename)
+                ).rowcount > 0
+
+    def eviction_candidates(self, limit: int, accessed_before: float) -> List[LibraryEntry]:
+        """按最近访问时间从旧到新返回可清理的文件（不含固定的文件）"""
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {COLUMNS} FROM tracks WHERE pinned = 0 AND last_access < ? "
+                "ORDER BY last_access LIMIT ?",
+                (accessed_before, limit)
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def remove(self, filename: str):
+        """移除文件的索引记录"""
+        with self._lock:
+            self._delete(self._connection(), [filename])
+
+    def reconcile(self) -> Dict[str, int]:
+        """与音乐目录对账：移除文件已不存在的记录，更新大小变化的记录，登记未记录的文件"""
+        files = {}
+        if self.music_dir.exists():
+            for path in self.music_dir.iterdir():
+                if path.name.startswith(".") or path.suffix.lower() not in AUDIO_EXTENSIONS:
+                    continue
+                try:
+                    if path.is_file():
+                        files[path.name] = path.stat()
+                except OSError:
+                    continue
+
+        with self._lock:
+            db = self._connection()
+            indexed = dict(db.execute("SELECT filename, size FROM tracks").fetchall())
+            removed = [name for name in indexed if name not in files]
+            changed = [name for name in indexed if name in files and files[name].st_size != indexed[name]]
+            added = [name for name in files if name not in indexed]
+            with db:
+                db.executemany("DELETE FROM tracks WHERE filename = ?", [(name,) for name in removed])
+                # 大小变化说明文件被替换过，原有的校验和与元数据状态不再可信
+                db.executemany(
+                    "UPDATE tracks SET size = ?, checksum = NULL, metadata_added = 0 WHERE filename = ?",
+                    [(files[name].st_size, name) for name in changed]
+                )
+                db.executemany(
+                    "INSERT INTO tracks (filename, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    [(name, files[name].st_size, files[name].st_mtime, files[name].st_mtime) for name in added]
+                )
+            self._refresh_totals(db)
+
+        result = {"removed": len(removed), "changed": len(changed), "added": len(added), "total": self._count}
+        if removed or changed or added:
+            logger.info(f"音乐库索引对账完成: {result}")
+        return result
+
+    @property
+    def count(self) -> int:
+        """音乐库中的文件数"""
+        with self._lock:
+            self._connection()
+            return self._count
+
+    @property
+    def total_bytes(self) -> int:
+        """音乐库文件总大小"""
+        with self._lock:
+            self._connection()
+            return self._total_bytes
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """音乐库统计信息"""
+        with self._lock:
+            pinned_files, pinned_bytes = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks WHERE pinned = 1"
+            ).fetchone()
+            total = self.hits + self.misses
+            return {
+                "files": self._count,
+                "total_bytes": self._total_bytes,
+                "pinned_files": pinned_files,
+                "pinned_bytes": pinned_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    async def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
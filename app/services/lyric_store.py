@@ -0,0 +1,195 @@
+import re
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from ..utils.thread_utils import background_loop, thread_pool
+
+logger = logging.getLogger("qqmusic_web")
+
+LRC_TIME_PATTERN = re.compile(r"\[(\d+):(\d+)(?:[.:](\d+))?\]")
+LRC_OFFSET_PATTERN = re.compile(r"\[offset:\s*([+-]?\d+)\]", re.IGNORECASE)
+
+
+def parse_lrc(lrc_text: str) -> List[Dict[str, Any]]:
+    """将LRC歌词解析为按时间排序的 [{"time": 秒, "text": 歌词}]"""
+    if not lrc_text:
+        return []
+
+    offset = 0.0
+    match = LRC_OFFSET_PATTERN.search(lrc_text)
+    if match:
+        # offset 为正表示歌词提前显示（毫秒）
+        offset = int(match.group(1)) / 1000
+
+    lines = []
+    for line in lrc_text.splitlines():
+        matches = list(LRC_TIME_PATTERN.finditer(line))
+        if not matches:
+            continue
+        text = LRC_TIME_PATTERN.sub("", line).strip()
+        if not text:
+            continue
+        for m in matches:
+            fraction = m.group(3) or "0"
+            seconds = int(m.group(1)) * 60 + int(m.group(2)) + int(fraction) / 10 ** len(fraction)
+            lines.append({"time": round(max(0.0, seconds - offset), 3), "text": text})
+
+    lines.sort(key=lambda item: item["time"])
+    return lines
+
+
+class LyricStore:
+    """歌词缓存：内存LRU + SQLite持久化，按歌曲MID缓存上游返回的歌词"""
+
+    def __init__(self, config, request_coalescer):
+        self.config = config
+        self.request_coalescer = request_coalescer
+        self.ttl = config["LYRIC_CACHE_TTL"]
+        self.max_memory_items = config["LYRIC_MEMORY_CACHE_SIZE"]
+        self.max_entries = config["LYRIC_CACHE_MAX_ENTRIES"]
+        self.db_path = Path(config["CACHE_DIR"]) / "lyrics.db"
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        background_loop.add_shutdown_hook(self.close)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lyrics ("
+                "mid TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_lyrics_fetched_at ON lyrics(fetched_at)")
+            self._db.commit()
+        return self._db
+
+    def _remember(self, mid: str, fetched_at: float, data: Dict[str, Any]):
+        with self._lock:
+            self._memory[mid] = (fetched_at, data)
+            self._memory.move_to_end(mid)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def _load_from_disk(self, mid: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT data, fetched_at FROM lyrics WHERE mid = ?", (mid,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return row[1], json.loads(row[0])
+        except ValueError:
+            return None
+
+    def _save_to_disk(self, mid: str, fetched_at: float, data: Dict[str, Any]):
+        with self._db_lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO lyrics (mid, data, fetched_at) VALUES (?, ?, ?)",
+                (mid, json.dumps(data, ensure_ascii=False), fetched_at)
+            )
+            self._writes_since_prune += 1
+            # 定期清理过期和超出数量上限的记录
+            if self._writes_since_prune >= 100:
+                self._writes_since_prune = 0
+                self._prune(db)
+            db.commit()
+
+    def _prune(self, db: sqlite3.Connection):
+        db.execute("DELETE FROM lyrics WHERE fetched_at < ?", (time.time() - self.ttl,))
+        db.execute(
+            "DELETE FROM lyrics WHERE mid NOT IN "
+            "(SELECT mid FROM lyrics ORDER BY fetched_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def get_cached(self, mid: str) -> Optional[Dict[str, Any]]:
+        """查询缓存（先内存后磁盘），未缓存或已过期时返回None"""
+        expire_before = time.time() - self.ttl
+        with self._lock:
+            entry = self._memory.get(mid)
+            if entry is not None:
+                if entry[0] >= expire_before:
+                    self._memory.move_to_end(mid)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[mid]
+
+        entry = self._load_from_disk(mid)
+        if entry is None or entry[0] < expire_before:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(mid, *entry)
+        return entry[1]
+
+    def set(self, mid: str, data: Dict[str, Any]):
+        """写入缓存"""
+        fetched_at = time.time()
+        self._remember(mid, fetched_at, data)
+        self._save_to_disk(mid, fetched_at, data)
+
+    async def get_lyric(self, mid: str) -> Optional[Dict[str, Any]]:
+        """获取歌词（优先使用缓存，需在后台事件循环中调用）"""
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(thread_pool, self.get_cached, mid)
+        if data is not None:
+            return data
+
+        data = await self.request_coalescer.get_lyric(mid)
+        if isinstance(data, dict):
+            await loop.run_in_executor(thread_pool, self.set, mid, data)
+        return data
+
+    def clear(self) -> int:
+        """清空内存和磁盘缓存，返回删除的记录数"""
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            db = self._connection()
+            count = db.execute("DELETE FROM lyrics").rowcount
+            db.commit()
+        return count
+
+    async def close(self):
+        """关闭数据库连接"""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._db_lock:
+            disk_entries = self._connection().execute("SELECT COUNT(*) FROM lyrics").fetchone()[0]
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "memory_max_items": self.max_memory_items,
+                "disk_entries": disk_entries,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0
+            }
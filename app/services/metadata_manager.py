@@ -1,140 +1,422 @@
+import io
+import os
+import time
+import asyncio
 import logging
 from pathlib import Path
-from typing import Optional, Dict, Any
-from mutagen.flac import FLAC, Picture
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+from mutagen.flac import FLAC, Picture, VCFLACDict
 from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC, USLT
 from mutagen.mp3 import MP3
+from ..models import TagData
+from ..utils.thread_utils import background_loop
 
 logger = logging.getLogger("qqmusic_web")
 
+
+def _cover_mime(cover_data: bytes) -> str:
+    return 'image/png' if cover_data.startswith(b'\x89PNG') else 'image/jpeg'
+
+
+def write_flac_tags(file_path: str, title: str, artist: str, album: str,
+                    cover_data: Optional[bytes] = None, lyric_text: str = '', trans_text: str = ''):
+    """写入FLAC标签（阻塞操作，在工作线程/进程中执行）"""
+    file_path = Path(file_path)
+    audio = FLAC(file_path)
+
+    # 添加基本元数据
+    audio['title'] = title
+    audio['artist'] = artist
+    audio['album'] = album
+
+    # 添加封面
+    if cover_data:
+        image = Picture()
+        image.type = 3  # 封面图片
+        image.mime = _cover_mime(cover_data)
+        image.desc = 'Cover'
+        image.data = cover_data
+
+        audio.clear_pictures()
+        audio.add_picture(image)
+        logger.info(f"已添加封面到 {file_path.name}")
+
+    # 添加歌词
+    if lyric_text:
+        audio['lyrics'] = lyric_text
+        logger.info(f"已添加歌词到 {file_path.name}")
+    if trans_text:
+        audio['translyrics'] = trans_text
+
+    audio.save()
+
+
+def write_mp3_tags(file_path: str, title: str, artist: str, album: str,
+                   cover_data: Optional[bytes] = None, lyric_text: str = '', trans_text: str = ''):
+    """写入MP3的ID3标签（阻塞操作，在工作线程/进程中执行）"""
+    file_path = Path(file_path)
+    # 尝试读取现有ID3标签，如果没有则创建新的
+    try:
+        audio = ID3(file_path)
+    except:
+        audio = ID3()
+
+    # 添加基本元数据
+    audio.add(TIT2(encoding=3, text=title))  # 标题
+    audio.add(TPE1(encoding=3, text=artist))  # 艺术家
+    audio.add(TALB(encoding=3, text=album))  # 专辑
+
+    # 添加封面
+    if cover_data:
+        # 删除现有的封面
+        audio.delall('APIC')
+
+        # 添加新封面
+        audio.add(APIC(
+            encoding=3,
+            mime=_cover_mime(cover_data),
+            type=3,
+            desc='Cover',
+            data=cover_data
+        ))
+        logger.info(f"已添加封面到 {file_path.name}")
+
+    # 添加歌词
+    if lyric_text:
+        audio.delall('USLT')
+        audio.add(USLT(
+            encoding=3,
+            lang='eng',
+            desc='Lyrics',
+            text=lyric_text
+        ))
+        logger.info(f"已添加歌词到 {file_path.name}")
+
+    if trans_text:
+        audio.add(USLT(
+            encoding=3,
+            lang='eng',
+            desc='Translation',
+            text=trans_text
+        ))
+
+    audio.save(file_path, v2_version=3)
+
+
+# FLAC 元数据块类型
+FLAC_STREAMINFO = 0
+FLAC_PADDING = 1
+FLAC_SEEKTABLE = 3
+FLAC_VORBIS_COMMENT = 4
+FLAC_PICTURE = 6
+
+
+def _flac_block(block_type: int, data: bytes, last: bool = False) -> bytes:
+    return bytes([(0x80 if last else 0) | block_type]) + len(data).to_bytes(3, "big") + data
+
+
+def _syncsafe(size: int) -> bytes:
+    return bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f])
+
+
+def build_id3_header(tag_data: Optional[TagData], size: int) -> Optional[bytes]:
+    """生成长度恰好为 size 的ID3v2.3标签（不足部分为填充），tag_data 为None时只包含填充
+
+    标签内容超出 size 时返回None。
+    """
+    if tag_data is None:
+        if size < 10:
+            return None
+        return b"ID3\x03\x00\x00" + _syncsafe(size - 10) + bytes(size - 10)
+
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=tag_data.title))
+    tags.add(TPE1(encoding=3, text=tag_data.artist))
+    tags.add(TALB(encoding=3, text=tag_data.album))
+    if tag_data.cover_data:
+        tags.add(APIC(encoding=3, mime=_cover_mime(tag_data.cover_data), type=3,
+                      desc='Cover', data=tag_data.cover_data))
+    if tag_data.lyric:
+        tags.add(USLT(encoding=3, lang='eng', desc='Lyrics', text=tag_data.lyric))
+    if tag_data.trans:
+        tags.add(USLT(encoding=3, lang='eng', desc='Translation', text=tag_data.trans))
+
+    def _render(padding: int) -> bytes:
+        output = io.BytesIO()
+        tags.save(output, v2_version=3, padding=lambda info: padding)
+        return output.getvalue()
+
+    header = _render(0)
+    if len(header) > size:
+        return None
+    return _render(size - len(header)) if len(header) < size else header
+
+
+def build_flac_header(kept_blocks: List[Tuple[int, bytes]], tag_data: Optional[TagData],
+                      size: int) -> Optional[bytes]:
+    """生成长度恰好为 size 的FLAC文件头（fLaC + 原有的STREAMINFO等块 + 标签块 + 填充块）
+
+    kept_blocks 为从下载内容中保留的 (块类型, 数据)；空间不足时返回None。
+    """
+    body = b"fLaC" + b"".join(_flac_block(t, data) for t, data in kept_blocks)
+    if tag_data is not None:
+        comments = VCFLACDict()
+        comments['title'] = tag_data.title
+        comments['artist'] = tag_data.artist
+        comments['album'] = tag_data.album
+        if tag_data.lyric:
+            comments['lyrics'] = tag_data.lyric
+        if tag_data.trans:
+            comments['translyrics'] = tag_data.trans
+        body += _flac_block(FLAC_VORBIS_COMMENT, comments.write(framing=False))
+
+        if tag_data.cover_data:
+            image = Picture()
+            image.type = 3  # 封面图片
+            image.mime = _cover_mime(tag_data.cover_data)
+            image.desc = 'Cover'
+            image.data = tag_data.cover_data
+            body += _flac_block(FLAC_PICTURE, image.write())
+
+    padding = size - len(body) - 4
+    if padding < 0 or padding >= 1 << 24:
+        return None
+    return body + _flac_block(FLAC_PADDING, bytes(padding), last=True)
+
+
+def _read_source_head(f, reserve: int, extension: str) -> Optional[Tuple[int, List[Tuple[int, bytes]]]]:
+    """解析下载内容开头的原有标签，返回 (原有标签长度, 需保留的FLAC块)；无法识别时返回None"""
+    f.seek(reserve)
+    if extension == '.flac':
+        if f.read(4) != b"fLaC":
+            return None
+        length = 4
+        kept = []
+        while True:
+            block_header = f.read(4)
+            if len(block_header) != 4:
+                return None
+            block_type = block_header[0] & 0x7f
+            block_length = int.from_bytes(block_header[1:4], "big")
+            if block_type in (FLAC_STREAMINFO, FLAC_SEEKTABLE):
+                kept.append((block_type, f.read(block_length)))
+            else:
+                # 原有的标签、封面和填充块丢弃，由新生成的块替代
+                f.seek(block_length, os.SEEK_CUR)
+            length += 4 + block_length
+            if block_header[0] & 0x80:
+                break
+        if not kept or kept[0][0] != FLAC_STREAMINFO:
+            return None
+        return length, kept
+
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = 10 + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+        if header[5] & 0x10:  # 带有页脚
+            size += 10
+        return size, []
+    return 0, []
+
+
+def embed_tags_in_reserved(part_path: str, reserve: int, extension: str,
+                           tag_data: Optional[TagData]) -> bool:
+    """用标签填充下载文件开头预留的区域（同时替换下载内容自带的标签），只改写文件头部
+
+    标签放不下时写入只含填充的文件头并返回False（由调用方改用常规方式写入标签）；
+    无法识别文件格式时将内容前移覆盖预留区域。
+    """
+    with open(part_path, "r+b") as f:
+        head = _read_source_head(f, reserve, extension)
+        if head is None:
+            logger.warning(f"无法识别文件头，移除预留区域: {Path(part_path).name}")
+            strip_reserve(f, reserve)
+            return False
+
+        source_length, kept_blocks = head
+        size = reserve + source_length
+
+        def _build(data: Optional[TagData]) -> Optional[bytes]:
+            if extension == '.flac':
+                return build_flac_header(kept_blocks, data, size)
+            return build_id3_header(data, size) if size else None
+
+        try:
+            header = _build(tag_data)
+        except Exception as e:
+            # 标签数据异常（如无法解析的封面）时仍写入只含填充的文件头，保证文件可用
+            logger.warning(f"生成标签失败，只写入填充: {Path(part_path).name}: {e}")
+            header = None
+        embedded = header is not None
+        if header is None:
+            header = _build(None)
+
+        if header is None:
+            if reserve:
+                strip_reserve(f, reserve)
+            return False
+
+        f.seek(0)
+        f.write(header)
+        f.flush()
+        os.fsync(f.fileno())
+    return embedded
+
+
+def strip_reserve(f, reserve: int, chunk_size: int = 1024 * 1024):
+    """将预留区域之后的内容整体前移"""
+    read_pos, write_pos = reserve, 0
+    while True:
+        f.seek(read_pos)
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        f.seek(write_pos)
+        f.write(chunk)
+        read_pos += len(chunk)
+        write_pos += len(chunk)
+    f.truncate(write_pos)
+    f.flush()
+    os.fsync(f.fileno())
+
+
 class MetadataManager:
     """元数据管理器"""
 
     def __init__(self, config, cover_manager):
         self.config = config
         self.cover_manager = cover_manager
+        self._executor: Optional[Executor] = None
+        background_loop.add_shutdown_hook(self.close)
 
-    async def add_metadata_to_flac(self, file_path: Path, song_info, 
-                                   lyrics_data: dict = None, song_data: Dict[str, Any] = None) -> bool:
-        """为FLAC文件添加封面和歌词"""
+    @property
+    def executor(self) -> Executor:
+        """标签写入使用的线程池或进程池（首次使用时创建）"""
+        if self._executor is None:
+            workers = self.config["TAG_WRITE_WORKERS"]
+            if self.config["TAG_WRITE_EXECUTOR"] == "process":
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tag-writer")
+            logger.info(f"标签写入池已创建: {self.config['TAG_WRITE_EXECUTOR']} x {workers}")
+        return self._executor
+
+    async def close(self):
+        """关闭标签写入池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def build_tag_data(self, song_info, lyrics_data: dict = None,
+                             song_data: Dict[str, Any] = None) -> TagData:
+        """收集写入标签所需的数据（封面从缓存或上游获取）"""
+        cover_data = None
+        if song_data:
+            cover = await self.cover_manager.get_valid_cover_url(song_data)
+            if cover:
+                _, cover_data = cover
+
+        lyrics_data = lyrics_data or {}
+        return TagData(
+            title=song_info.name,
+            artist=song_info.singers,
+            album=song_info.album,
+            cover_data=cover_data,
+            lyric=lyrics_data.get('lyric', '') or '',
+            trans=lyrics_data.get('trans', '') or ''
+        )
+
+    def estimate_reserve(self, tag_data: Optional[TagData] = None) -> int:
+        """估算边下载边写入标签时需在文件开头预留的字节数（标签数据未就绪时使用默认值）"""
+        if tag_data is None:
+            return self.config["STREAM_TAG_RESERVE"]
+        size = 1024 + len(tag_data.cover_data or b'')
+        for text in (tag_data.title, tag_data.artist, tag_data.album, tag_data.lyric, tag_data.trans):
+            size += len(text.encode('utf-8'))
+        return size + self.config["STREAM_TAG_PADDING"]
+
+    async def embed_reserved(self, part_path: Path, reserve: int, extension: str,
+                             tag_data: Optional[TagData],
+                             stage_timings: Optional[Dict[str, float]] = None) -> bool:
+        """将标签写入下载文件开头的预留区域，返回是否成功写入标签"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
         try:
-            audio = FLAC(file_path)
-
-            # 添加基本元数据
-            audio['title'] = song_info.name
-            audio['artist'] = song_info.singers
-            audio['album'] = song_info.album
-
-            # 添加封面
-            if song_data:
-                cover_url = await self.cover_manager.get_valid_cover_url(song_data)
-                if cover_url:
-                    cover_data = await self.cover_manager.download_cover(cover_url)
-                    if cover_data:
-                        image = Picture()
-                        image.type = 3  # 封面图片
-                        image.mime = 'image/png' if cover_url.lower().endswith('.png') else 'image/jpeg'
-                        image.desc = 'Cover'
-                        image.data = cover_data
-
-                        audio.clear_pictures()
-                        audio.add_picture(image)
-                        logger.info(f"已添加封面到 {file_path.name}")
-
-            # 添加歌词
-            if lyrics_data:
-                lyric_text = lyrics_data.get('lyric', '')
-                if lyric_text:
-                    audio['lyrics'] = lyric_text
-                    logger.info(f"已添加歌词到 {file_path.name}")
-
-                trans_text = lyrics_data.get('trans', '')
-                if trans_text:
-                    audio['translyrics'] = trans_text
-
-            audio.save()
-            logger.info(f"已为 {file_path.name} 添加元数据")
-            return True
+            embedded = await loop.run_in_executor(
+                self.executor, embed_tags_in_reserved, str(part_path), reserve, extension, tag_data
+            )
+        finally:
+            if stage_timings is not None:
+                elapsed = time.monotonic() - started
+                stage_timings["tag_embed"] = round(stage_timings.get("tag_embed", 0.0) + elapsed, 4)
+        if embedded:
+            logger.info(f"已在下载过程中写入标签: {part_path.name}")
+        return embedded
 
+    async def _write_tags(self, writer, file_path: Path, song_info, lyrics_data: dict = None,
+                          song_data: Dict[str, Any] = None,
+                          stage_timings: Optional[Dict[str, float]] = None,
+                          tag_data: Optional[TagData] = None) -> bool:
+        """获取封面后在工作池中写入标签，事件循环只等待结果"""
+        if tag_data is None:
+            tag_data = await self.build_tag_data(song_info, lyrics_data, song_data)
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            await loop.run_in_executor(
+                self.executor, writer, str(file_path), tag_data.title, tag_data.artist,
+                tag_data.album, tag_data.cover_data, tag_data.lyric, tag_data.trans
+            )
+        finally:
+            if stage_timings is not None:
+                elapsed = time.monotonic() - started
+                stage_timings["tag_write"] = round(stage_timings.get("tag_write", 0.0) + elapsed, 4)
+        logger.info(f"已为 {file_path.name} 添加元数据")
+        return True
+
+    async def add_metadata_to_flac(self, file_path: Path, song_info,
+                                   lyrics_data: dict = None, song_data: Dict[str, Any] = None,
+                                   stage_timings: Optional[Dict[str, float]] = None,
+                                   tag_data: Optional[TagData] = None) -> bool:
+        """为FLAC文件添加封面和歌词"""
+        try:
+            return await self._write_tags(write_flac_tags, file_path, song_info,
+                                          lyrics_data, song_data, stage_timings, tag_data)
         except Exception as e:
             logger.error(f"添加FLAC元数据失败: {e}")
             return False
 
     async def add_metadata_to_mp3(self, file_path: Path, song_info,
-                                  lyrics_data: dict = None, song_data: Dict[str, Any] = None) -> bool:
+                                  lyrics_data: dict = None, song_data: Dict[str, Any] = None,
+                                  stage_timings: Optional[Dict[str, float]] = None,
+                                  tag_data: Optional[TagData] = None) -> bool:
         """为MP3文件添加封面和歌词"""
         try:
-            # 尝试读取现有ID3标签，如果没有则创建新的
-            try:
-                audio = ID3(file_path)
-            except:
-                audio = ID3()
-
-            # 添加基本元数据
-            audio.add(TIT2(encoding=3, text=song_info.name))  # 标题
-            audio.add(TPE1(encoding=3, text=song_info.singers))  # 艺术家
-            audio.add(TALB(encoding=3, text=song_info.album))  # 专辑
-
-            # 添加封面
-            if song_data:
-                cover_url = await self.cover_manager.get_valid_cover_url(song_data)
-                if cover_url:
-                    cover_data = await self.cover_manager.download_cover(cover_url)
-                    if cover_data:
-                        mime_type = 'image/png' if cover_url.lower().endswith('.png') else 'image/jpeg'
-
-                        # 删除现有的封面
-                        audio.delall('APIC')
-
-                        # 添加新封面
-                        audio.add(APIC(
-                            encoding=3,
-                            mime=mime_type,
-                            type=3,
-                            desc='Cover',
-                            data=cover_data
-                        ))
-                        logger.info(f"已添加封面到 {file_path.name}")
-
-            # 添加歌词
-            if lyrics_data:
-                lyric_text = lyrics_data.get('lyric', '')
-                if lyric_text:
-                    audio.delall('USLT')
-                    audio.add(USLT(
-                        encoding=3,
-                        lang='eng',
-                        desc='Lyrics',
-                        text=lyric_text
-                    ))
-                    logger.info(f"已添加歌词到 {file_path.name}")
-
-                trans_text = lyrics_data.get('trans', '')
-                if trans_text:
-                    audio.add(USLT(
-                        encoding=3,
-                        lang='eng',
-                        desc='Translation',
-                        text=trans_text
-                    ))
-
-            audio.save(file_path, v2_version=3)
-            logger.info(f"已为 {file_path.name} 添加元数据")
-            return True
-
+            return await self._write_tags(write_mp3_tags, file_path, song_info,
+                                          lyrics_data, song_data, stage_timings, tag_data)
         except Exception as e:
             logger.error(f"为MP3添加元数据失败: {e}")
             return False
 
     async def add_metadata_to_file(self, file_path: Path, song_info,
-                                   lyrics_data: dict = None, song_data: Dict[str, Any] = None) -> bool:
-        """根据文件类型为音频文件添加元数据"""
+                                   lyrics_data: dict = None, song_data: Dict[str, Any] = None,
+                                   stage_timings: Optional[Dict[str, float]] = None,
+                                   tag_data: Optional[TagData] = None) -> bool:
+        """根据文件类型为音频文件添加元数据
+
+        stage_timings 中的 tag_write 记录在工作池中写入标签的耗时（不含获取封面的网络时间）；
+        提供 tag_data 时直接使用，不再获取封面。
+        """
         file_extension = file_path.suffix.lower()
 
         if file_extension == '.flac':
-            return await self.add_metadata_to_flac(file_path, song_info, lyrics_data, song_data)
+            return await self.add_metadata_to_flac(file_path, song_info, lyrics_data, song_data,
+                                                   stage_timings, tag_data)
         elif file_extension in ['.mp3', '.mpga']:
-            return await self.add_metadata_to_mp3(file_path, song_info, lyrics_data, song_data)
+            return await self.add_metadata_to_mp3(file_path, song_info, lyrics_data, song_data,
+                                                  stage_timings, tag_data)
         else:
             logger.warning(f"不支持为 {file_extension} 格式添加元数据")
-            return False
\ No newline at end of file
+            return False
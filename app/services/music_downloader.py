@@ -1,115 +1,411 @@
+import time
+import asyncio
 import logging
+import functools
+import contextlib
+from collections import defaultdict
 from pathlib import Path
-from typing import Optional
-from qqmusic_api.song import get_song_urls, SongFileType
-from qqmusic_api.lyric import get_lyric
-from ..models import SongInfo, DownloadResult
+from typing import Optional, Dict, Callable, List, Tuple, Any
+from qqmusic_api.song import SongFileType
+from ..models import SongInfo, DownloadResult, BatchItemResult, BatchDownloadResult, TagData
 from .file_manager import FileManager
 from .metadata_manager import MetadataManager
+from ..utils.thread_utils import thread_pool
 
 logger = logging.getLogger("qqmusic_web")
 
 class MusicDownloader:
     """音乐下载器"""
 
-    def __init__(self, config, credential_manager, file_manager, metadata_manager):
+    # 支持写入标签的音质
+    TAGGABLE_TYPES = (SongFileType.FLAC, SongFileType.MP3_320, SongFileType.MP3_128)
+
+    def __init__(self, config, credential_manager, file_manager, metadata_manager,
+                 request_coalescer, play_url_cache, url_resolver, lyric_store, library_index, stream_proxy):
         self.config = config
         self.credential_manager = credential_manager
         self.file_manager = file_manager
         self.metadata_manager = metadata_manager
+        self.request_coalescer = request_coalescer
+        self.play_url_cache = play_url_cache
+        self.url_resolver = url_resolver
+        self.lyric_store = lyric_store
+        self.library_index = library_index
+        self.stream_proxy = stream_proxy
+        self._song_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._song_lock_users: Dict[Tuple[str, str], int] = defaultdict(int)
 
-    async def download_song(self, song_info: SongInfo, prefer_flac: bool = False,
-                            add_metadata: bool = True) -> Optional[DownloadResult]:
-        """下载歌曲"""
-        # 设置下载策略
+    @contextlib.asynccontextmanager
+    async def _lock_song(self, mid: str, file_type: SongFileType):
+        """获取歌曲某音质的下载锁（async with），没有其他协程等待时退出后移除该锁"""
+        key = (mid, file_type.name)
+        lock = self._song_locks.setdefault(key, asyncio.Lock())
+        self._song_lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._song_lock_users[key] -= 1
+            if not self._song_lock_users[key]:
+                del self._song_lock_users[key]
+                self._song_locks.pop(key, None)
+
+    @staticmethod
+    def _record_stage(stage_timings: Dict[str, float], stage: str, started: float):
+        """累计记录某个阶段的耗时（秒）"""
+        elapsed = time.monotonic() - started
+        stage_timings[stage] = round(stage_timings.get(stage, 0.0) + elapsed, 4)
+
+    @staticmethod
+    def get_quality_order(prefer_flac: bool) -> List[Tuple[SongFileType, str]]:
+        """获取音质尝试顺序"""
         if prefer_flac:
-            quality_order = [
+            return [
                 (SongFileType.FLAC, "FLAC"),
                 (SongFileType.MP3_320, "320kbps"),
                 (SongFileType.MP3_128, "128kbps")
             ]
-        else:
-            quality_order = [
-                (SongFileType.MP3_320, "320kbps"),
-                (SongFileType.MP3_128, "128kbps")
-            ]
+        return [
+            (SongFileType.MP3_320, "320kbps"),
+            (SongFileType.MP3_128, "128kbps")
+        ]
+
+    @staticmethod
+    def song_info_from_raw(song: Dict[str, Any]) -> SongInfo:
+        """根据上游返回的原始歌曲数据创建SongInfo对象"""
+        return SongInfo(
+            mid=song.get('mid', ''),
+            name=song.get('title', '') or song.get('name', ''),
+            singers=", ".join([s.get("name", "") for s in song.get("singer", [])]),
+            vip=song.get("pay", {}).get("pay_play", 0) != 0,
+            album=song.get("album", {}).get("name", ""),
+            album_mid=song.get("album", {}).get("mid", ""),
+            interval=song.get('interval', 0),
+            raw_data=song
+        )
+
+    async def download_song(self, song_info: SongInfo, prefer_flac: bool = False,
+                            add_metadata: bool = True,
+                            progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                            stage_timings: Optional[Dict[str, float]] = None,
+                            resolved_urls: Optional[Dict[SongFileType, str]] = None) -> Optional[DownloadResult]:
+        """下载歌曲
+
+        progress 回调参数为 (已完成字节数, 总字节数)；stage_timings 字典会在各阶段
+        （resolve / download / metadata）完成时实时写入耗时，便于外部查询进度；其中
+        tag_embed 为下载过程中写入标签的耗时，tag_write 为下载后写入标签（回退方式）的耗时。
+        歌词和封面与下载同时获取：tag_fetch 为获取耗时，tag_wait 为下载完成后仍需等待的时间，
+        overlap_saved 为因并行而节省的时间。
+        resolved_urls 为预先批量获取的各音质URL，提供时不再逐首请求上游；
+        否则在首次需要URL时同时探测所有剩余音质，较高音质不可用时无需再等待一轮请求。
+        """
+        if stage_timings is None:
+            stage_timings = {}
+
+        # 设置下载策略
+        quality_order = self.get_quality_order(prefer_flac)
 
         safe_filename = self.file_manager.sanitize_filename(
             f"{song_info.name} - {song_info.singers}"
         )
 
-        # 尝试不同音质
-        for file_type, quality_name in quality_order:
-            filepath = Path(self.config["MUSIC_DIR"]) / f"{safe_filename}{file_type.e}"
-
-            # 检查缓存
-            if filepath.exists():
-                return DownloadResult(
-                    filename=f"{safe_filename}{file_type.e}",
-                    quality=quality_name,
-                    filepath=str(filepath),
-                    cached=True
-                )
+        # 各音质的URL探测任务（首次需要时并发启动）
+        probes = None
+        # 标签数据（歌词、封面）在确定需要下载时开始获取，与URL获取和音频下载同时进行
+        tag_task: Optional[asyncio.Future] = None
 
-            logger.info(f"尝试下载 {quality_name}: {safe_filename}{file_type.e}")
+        loop = asyncio.get_running_loop()
 
-            # 获取歌曲URL并下载
-            urls = await get_song_urls(
-                [song_info.mid],
-                file_type=file_type,
-                credential=self.credential_manager.credential
-            )
-            url = urls.get(song_info.mid)
+        try:
+            # 尝试不同音质
+            for index, (file_type, quality_name) in enumerate(quality_order):
+                # 正在代理播放的歌曲等待其下载完成，不再重复下载
+                await self.stream_proxy.wait_for(song_info.mid, file_type)
+
+                # 从确定保存路径到登记音乐库期间持有该歌曲该音质的锁：文件提交后、登记前的
+                # 同一歌曲请求等待登记完成后直接命中，不会因文件名已被占用而另存一份
+                async with self._lock_song(song_info.mid, file_type):
+                    # 通过音乐库索引检查缓存并确定保存路径（同名文件属于其他歌曲时使用带mid的文件名）
+                    filepath, entry = await loop.run_in_executor(
+                        thread_pool, self.library_index.claim_path,
+                        song_info.mid, file_type, quality_name, safe_filename
+                    )
+                    if entry is not None:
+                        result = DownloadResult(
+                            filename=filepath.name,
+                            quality=quality_name,
+                            filepath=str(filepath),
+                            cached=True,
+                            metadata_added=entry.metadata_added,
+                            stage_timings=stage_timings
+                        )
+                        # 代理播放时保存的文件没有标签，下载时补写（正在播放时不修改文件）
+                        if (add_metadata and not entry.metadata_added and file_type in self.TAGGABLE_TYPES
+                                and not self.stream_proxy.is_reading(filepath)):
+                            stage_started = time.monotonic()
+                            await self._add_metadata(result, song_info, file_type)
+                            self._record_stage(stage_timings, "metadata", stage_started)
+                            if result.metadata_added:
+                                await self._record_library(song_info, file_type, quality_name, filepath,
+                                                           result, count_miss=False)
+                        return result
+
+                    logger.info(f"尝试下载 {quality_name}: {filepath.name}")
+                    if add_metadata and tag_task is None:
+                        tag_task = asyncio.ensure_future(self._collect_tag_data(song_info, stage_timings))
+
+                    # 获取歌曲URL并下载
+                    if resolved_urls is not None:
+                        url = resolved_urls.get(file_type)
+                    else:
+                        stage_started = time.monotonic()
+                        if probes is None:
+                            probes = self.url_resolver.start(
+                                song_info.mid, quality_order[index:], self.credential_manager.credential
+                            )
+                        url = await probes[file_type]
+                        self._record_stage(stage_timings, "resolve", stage_started)
 
-            if not url:
-                continue
+                    if not url:
+                        continue
 
-            if isinstance(url, list):
-                url = url[0]
+                    # 边下载边写入标签：在文件开头预留标签空间，下载完成后只改写文件头部
+                    reserve, finalize = 0, None
+                    if (tag_task is not None and self.config["STREAM_TAGGING_ENABLED"]
+                            and file_type in self.TAGGABLE_TYPES):
+                        tag_data = tag_task.result() if tag_task.done() else None
+                        reserve = self.metadata_manager.estimate_reserve(tag_data)
+                        finalize = functools.partial(self._embed_tags, tag_task, file_type, stage_timings)
 
-            content = await self.file_manager.download_file_content(url)
-            if content:
-                with open(filepath, "wb") as f:
-                    f.write(content)
+                    # 流式写入 .part 文件，完成后原子重命名；中断的下载下次会从断点续传
+                    stage_started = time.monotonic()
+                    transfer = await self.file_manager.download_to_file(
+                        url, filepath, source={"mid": song_info.mid, "quality": quality_name},
+                        progress=progress, reserve=reserve, finalize=finalize
+                    )
+                    self._record_stage(stage_timings, "download", stage_started)
+                    if not transfer:
+                        # URL可能已失效，下次重新获取
+                        self.play_url_cache.invalidate(song_info.mid, file_type, self.credential_manager.credential)
+                        continue
 
-                logger.info(f"下载成功 ({quality_name}): {filepath.name}")
-                result = DownloadResult(
-                    filename=f"{safe_filename}{file_type.e}",
-                    quality=quality_name,
-                    filepath=str(filepath),
-                    cached=False
+                    logger.info(f"下载成功 ({quality_name}): {filepath.name}")
+                    result = DownloadResult(
+                        filename=filepath.name,
+                        quality=quality_name,
+                        filepath=str(filepath),
+                        cached=transfer.reused,
+                        transfer=transfer,
+                        stage_timings=stage_timings
+                    )
+
+                    # 添加元数据（下载过程中未能写入标签时，下载完成后再写入）
+                    if add_metadata:
+                        if transfer.tags_embedded:
+                            result.metadata_added = True
+                        elif not (transfer.reused and self.stream_proxy.is_reading(filepath)):
+                            # 复用代理播放保存的文件时，正在播放则不修改文件
+                            stage_started = time.monotonic()
+                            await self._add_metadata(result, song_info, file_type, tag_task)
+                            self._record_stage(stage_timings, "metadata", stage_started)
+
+                    # 登记到音乐库索引（标签写入后文件内容不再变化，此时计算校验和）
+                    await self._record_library(song_info, file_type, quality_name, filepath, result,
+                                               count_miss=not transfer.reused)
+                    return result
+
+            return None
+        finally:
+            if tag_task is not None and not tag_task.done():
+                tag_task.cancel()
+
+    async def _record_library(self, song_info: SongInfo, file_type: SongFileType, quality_name: str,
+                              filepath: Path, result: DownloadResult, count_miss: bool = True):
+        """将文件登记到音乐库索引"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                thread_pool, functools.partial(
+                    self.library_index.record, song_info.mid, file_type, quality_name, filepath,
+                    metadata_added=result.metadata_added, count_miss=count_miss
                 )
+            )
+        except Exception as e:
+            logger.error(f"登记音乐库索引失败: {e}")
 
-                # 添加元数据
-                if add_metadata and not result.cached:
-                    await self._add_metadata(result, song_info, file_type)
+    async def resolve_urls_batch(self, mids: List[str],
+                                 quality_order: List[Tuple[SongFileType, str]]) -> Dict[str, Dict[SongFileType, str]]:
+        """批量获取多首歌曲各音质的URL（每个音质按批次请求上游）"""
+        resolved: Dict[str, Dict[SongFileType, str]] = {mid: {} for mid in mids}
+        batch_size = self.config["URL_RESOLVE_BATCH_SIZE"]
 
-                return result
+        async def _resolve_tier(file_type: SongFileType):
+            for i in range(0, len(mids), batch_size):
+                chunk = mids[i:i + batch_size]
+                try:
+                    urls = await self.play_url_cache.resolve_many(
+                        chunk, file_type, self.credential_manager.credential
+                    )
+                except Exception as e:
+                    logger.warning(f"批量获取URL失败 ({file_type.name}): {e}")
+                    continue
+                for mid, url in urls.items():
+                    if url:
+                        resolved[mid][file_type] = url
 
-        return None
+        await asyncio.gather(*(_resolve_tier(file_type) for file_type, _ in quality_order))
+        return resolved
 
-    async def _add_metadata(self, result: DownloadResult, song_info: SongInfo,
-                            file_type: SongFileType):
-        """为下载的文件添加元数据"""
-        if file_type not in [SongFileType.FLAC, SongFileType.MP3_320, SongFileType.MP3_128]:
-            return
+    async def download_batch(self, song_infos: List[SongInfo], prefer_flac: bool = False,
+                             add_metadata: bool = True, concurrency: int = None,
+                             progress: Optional[Callable[[int, Optional[int], int], None]] = None,
+                             stage_timings: Optional[Dict[str, float]] = None) -> BatchDownloadResult:
+        """批量下载歌曲：批量获取URL后以有限并发下载并添加元数据
+
+        progress 回调参数为 (已完成字节数, 已知的总字节数, 已完成歌曲数)。
+        """
+        if stage_timings is None:
+            stage_timings = {}
+        concurrency = max(1, concurrency or self.config["BATCH_DOWNLOAD_CONCURRENCY"])
+        started = time.monotonic()
+        quality_order = self.get_quality_order(prefer_flac)
+
+        # 去重并保持顺序
+        unique_songs = list({song.mid: song for song in song_infos if song.mid}.values())
+
+        stage_started = time.monotonic()
+        resolved = await self.resolve_urls_batch([song.mid for song in unique_songs], quality_order)
+        self._record_stage(stage_timings, "resolve", stage_started)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        song_progress: Dict[str, Tuple[int, Optional[int]]] = {}
+        items_done = 0
+
+        def _report():
+            if progress:
+                done = sum(d for d, _ in song_progress.values())
+                total = sum(t for _, t in song_progress.values() if t)
+                progress(done, total or None, items_done)
+
+        async def _download_one(song: SongInfo) -> BatchItemResult:
+            nonlocal items_done
+
+            def _on_progress(done: int, total: Optional[int]):
+                song_progress[song.mid] = (done, total)
+                _report()
+
+            async with semaphore:
+                try:
+                    result = await self.download_song(
+                        song, prefer_flac, add_metadata,
+                        progress=_on_progress, resolved_urls=resolved.get(song.mid, {})
+                    )
+                    if result:
+                        item = BatchItemResult(mid=song.mid, name=song.name, singers=song.singers,
+                                               status="completed", result=result)
+                    else:
+                        item = BatchItemResult(mid=song.mid, name=song.name, singers=song.singers,
+                                               status="failed", error="所有音质下载失败")
+                except Exception as e:
+                    logger.error(f"批量下载歌曲失败 {song.name}: {e}")
+                    item = BatchItemResult(mid=song.mid, name=song.name, singers=song.singers,
+                                           status="failed", error=str(e))
+            items_done += 1
+            _report()
+            return item
+
+        stage_started = time.monotonic()
+        items = await asyncio.gather(*(_download_one(song) for song in unique_songs))
+        self._record_stage(stage_timings, "download", stage_started)
+
+        elapsed = time.monotonic() - started
+        bytes_fetched = sum(
+            item.result.transfer.bytes_fetched
+            for item in items if item.result and item.result.transfer
+        )
+        batch_result = BatchDownloadResult(
+            items=list(items),
+            succeeded=sum(1 for item in items if item.status == "completed"),
+            failed=sum(1 for item in items if item.status == "failed"),
+            cached=sum(1 for item in items if item.result and item.result.cached),
+            bytes_fetched=bytes_fetched,
+            elapsed=round(elapsed, 4),
+            throughput=bytes_fetched / elapsed if elapsed > 0 else 0.0
+        )
+        logger.info(f"批量下载完成: 成功 {batch_result.succeeded}, 失败 {batch_result.failed}, "
+                    f"{bytes_fetched} bytes, {batch_result.throughput / 1024:.1f} KB/s")
+        return batch_result
 
+    async def _collect_tag_data(self, song_info: SongInfo,
+                                stage_timings: Optional[Dict[str, float]] = None) -> TagData:
+        """获取歌词和封面，生成标签数据（获取失败的部分留空）"""
+        stage_started = time.monotonic()
         try:
-            lyrics_data = None
+            return await self._fetch_tag_data(song_info)
+        finally:
+            if stage_timings is not None:
+                self._record_stage(stage_timings, "tag_fetch", stage_started)
+
+    async def _fetch_tag_data(self, song_info: SongInfo) -> TagData:
+        """同时获取歌词和封面"""
+        async def _get_lyric():
             try:
-                lyrics_data = await get_lyric(song_info.mid)
+                return await self.lyric_store.get_lyric(song_info.mid)
             except Exception as e:
                 logger.warning(f"获取歌词失败: {e}")
+                return None
+
+        async def _get_cover():
+            try:
+                # 使用智能封面获取方法，传递完整的原始歌曲数据
+                return await self.metadata_manager.cover_manager.get_valid_cover_url(song_info.raw_data)
+            except Exception as e:
+                logger.warning(f"获取封面失败: {e}")
+                return None
+
+        lyrics_data, cover = await asyncio.gather(_get_lyric(), _get_cover())
+        tag_data = await self.metadata_manager.build_tag_data(song_info, lyrics_data)
+        if cover:
+            _, tag_data.cover_data = cover
+        return tag_data
+
+    async def _embed_tags(self, tag_task: asyncio.Future, file_type: SongFileType,
+                          stage_timings: Dict[str, float], part_path: Path, reserve: int) -> bool:
+        """下载完成后将标签写入文件开头的预留区域"""
+        tag_data = await self._join_tag_data(tag_task, stage_timings)
+        return await self.metadata_manager.embed_reserved(
+            part_path, reserve, file_type.e, tag_data, stage_timings
+        )
+
+    async def _join_tag_data(self, tag_task: asyncio.Future, stage_timings: Dict[str, float]) -> TagData:
+        """等待与下载并行获取的标签数据，并记录并行节省的时间"""
+        stage_started = time.monotonic()
+        tag_data = await tag_task
+        self._record_stage(stage_timings, "tag_wait", stage_started)
+        saved = stage_timings.get("tag_fetch", 0.0) - stage_timings["tag_wait"]
+        stage_timings["overlap_saved"] = round(max(0.0, saved), 4)
+        logger.debug(f"歌词和封面与下载并行获取，节省 {stage_timings['overlap_saved']:.3f} 秒")
+        return tag_data
 
-            # 使用智能封面获取方法，传递完整的原始歌曲数据
+    async def _add_metadata(self, result: DownloadResult, song_info: SongInfo,
+                            file_type: SongFileType, tag_task: Optional[asyncio.Future] = None):
+        """为下载的文件添加元数据"""
+        if file_type not in self.TAGGABLE_TYPES:
+            return
+
+        try:
+            if tag_task is not None:
+                tag_data = await self._join_tag_data(tag_task, result.stage_timings)
+            else:
+                tag_data = await self._collect_tag_data(song_info, result.stage_timings)
             metadata_success = await self.metadata_manager.add_metadata_to_file(
                 Path(result.filepath),
                 song_info,
-                lyrics_data,
-                song_info.raw_data  # 传递完整的原始歌曲数据用于封面获取
+                stage_timings=result.stage_timings,
+                tag_data=tag_data
             )
             result.metadata_added = metadata_success
 
         except Exception as e:
             logger.error(f"添加元数据失败: {e}")
-            result.metadata_added = False
\ No newline at end of file
+            result.metadata_added = False
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from qqmusic_api import search, album
+from qqmusic_api.song import get_song_urls, SongFileType
+from qqmusic_api.lyric import get_lyric
+
+logger = logging.getLogger("qqmusic_web")
+
+
+def credential_identity(credential) -> str:
+    """获取凭证的身份标识（用于区分不同账号的请求）"""
+    if credential is None:
+        return "anonymous"
+    musicid = getattr(credential, "musicid", None)
+    return str(musicid) if musicid else "anonymous"
+
+
+class RequestCoalescer:
+    """请求合并器：并发的相同上游请求共享同一个进行中的结果"""
+
+    KINDS = ("search", "song_urls", "lyric", "album_songs")
+
+    def __init__(self, config, url_batcher=None, upstream_governor=None):
+        self.config = config
+        self.url_batcher = url_batcher
+        self.upstream_governor = upstream_governor
+        self._inflight: Dict[Tuple[Hashable, ...], Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {kind: {"calls": 0, "merged": 0} for kind in self.KINDS}
+
+    async def _run(self, kind: str, key: Tuple[Hashable, ...],
+                   factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行请求；若已有相同请求在进行中则等待其结果
+
+        只共享正常结果和普通异常；发起请求的一方被取消时，等待方重新选出发起方后再次请求。
+        """
+        full_key = (kind,) + key
+        with self._lock:
+            self._stats[kind]["calls"] += 1
+
+        while True:
+            with self._lock:
+                future = self._inflight.get(full_key)
+                is_leader = future is None
+                if is_leader:
+                    future = Future()
+                    self._inflight[full_key] = future
+                else:
+                    self._stats[kind]["merged"] += 1
+
+            if not is_leader:
+                logger.debug(f"合并上游请求: {full_key}")
+                try:
+                    # shield 防止单个等待方取消时影响其他等待方
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        # 等待方自身被取消
+                        raise
+                    logger.debug(f"合并的上游请求已被取消，重新发起: {full_key}")
+                    continue
+
+            try:
+                result = await factory()
+            except Exception as e:
+                with self._lock:
+                    self._inflight.pop(full_key, None)
+                future.set_exception(e)
+                raise
+            except BaseException:
+                # 取消只影响发起方自身，不传给等待方
+                with self._lock:
+                    self._inflight.pop(full_key, None)
+                future.cancel()
+                raise
+            with self._lock:
+                self._inflight.pop(full_key, None)
+            future.set_result(result)
+            return result
+
+    def _governed(self, kind: str, factory: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        """直接发往上游的请求经过上游调度器限流"""
+        if self.upstream_governor is None:
+            return factory
+        return lambda: self.upstream_governor.call(kind, factory)
+
+    async def search_by_type(self, keyword: str, search_type=search.SearchType.SONG,
+                             num: int = 10, page: int = 1) -> List[Dict[str, Any]]:
+        """合并的搜索请求"""
+        return await self._run(
+            "search",
+            (keyword, search_type, num, page),
+            self._governed("search", lambda: search.search_by_type(
+                keyword, search_type=search_type, num=num, page=page
+            ))
+        )
+
+    async def get_song_urls(self, mids: List[str], file_type: SongFileType = SongFileType.MP3_128,
+                            credential=None) -> Dict[str, Any]:
+        """合并的歌曲URL获取请求（少量mid的请求交给微批处理器与其他请求合并）"""
+        if self.url_batcher is not None and len(mids) < self.url_batcher.max_size:
+            # 微批处理器发起的上游请求已经过调度器
+            fetch = lambda: self.url_batcher.get_song_urls(mids, file_type=file_type, credential=credential)
+        else:
+            fetch = self._governed("song_urls", lambda: get_song_urls(mids, file_type=file_type, credential=credential))
+        return await self._run(
+            "song_urls",
+            (tuple(mids), file_type, credential_identity(credential)),
+            fetch
+        )
+
+    async def get_lyric(self, song_mid: str, **kwargs) -> Optional[Dict[str, Any]]:
+        """合并的歌词获取请求"""
+        return await self._run(
+            "lyric",
+            (song_mid, tuple(sorted(kwargs.items()))),
+            self._governed("lyric", lambda: get_lyric(song_mid, **kwargs))
+        )
+
+    async def get_album_songs(self, album_mid: str, num: int = 50, page: int = 1) -> List[Dict[str, Any]]:
+        """合并的专辑歌曲列表请求"""
+        return await self._run(
+            "album_songs",
+            (album_mid, num, page),
+            self._governed("album_songs", lambda: album.get_song(album_mid, num=num, page=page))
+        )
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """合并统计信息"""
+        with self._lock:
+            stats = {kind: dict(counters) for kind, counters in self._stats.items()}
+            stats["inflight"] = len(self._inflight)
+        if self.url_batcher is not None:
+            stats["url_batcher"] = self.url_batcher.stats
+        return stats
@@ -0,0 +1,84 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+logger = logging.getLogger("qqmusic_web")
+
+class SearchCache:
+    """搜索结果缓存（TTL过期 + LRU容量上限）"""
+
+    def __init__(self, config):
+        self.config = config
+        self.ttl = config["SEARCH_CACHE_TTL"]
+        self.max_size = config["SEARCH_CACHE_SIZE"]
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_keyword(keyword: str) -> str:
+        """规范化关键词（去除首尾空白、合并连续空白、忽略大小写）"""
+        return " ".join(keyword.split()).casefold()
+
+    def _make_key(self, keyword: str, search_type) -> Tuple[str, str]:
+        type_name = getattr(search_type, "name", str(search_type))
+        return self.normalize_keyword(keyword), type_name
+
+    def get(self, keyword: str, search_type) -> Optional[List[Dict[str, Any]]]:
+        """获取缓存的搜索结果，未命中或已过期返回None"""
+        key = self._make_key(keyword, search_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, results = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def set(self, keyword: str, search_type, results: List[Dict[str, Any]]):
+        """写入搜索结果"""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+
+        key = self._make_key(keyword, search_type)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> int:
+        """清空缓存，返回清除的条目数"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        logger.info(f"搜索缓存已清空，共 {count} 条")
+        return count
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
@@ -0,0 +1,229 @@
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import functools
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterator, Tuple
+from qqmusic_api.song import SongFileType
+from ..models import SongInfo, StreamSession
+from ..utils.thread_utils import background_loop, thread_pool
+
+logger = logging.getLogger("qqmusic_web")
+
+class StreamProxy:
+    """代理播放：播放器从本服务读取音频，本服务从CDN下载到音乐目录（完成后登记到音乐库）；
+    同一歌曲同一音质的多个播放请求共享同一下载，Range 请求直接读取已下载的部分"""
+
+    def __init__(self, config, file_manager, library_index):
+        self.config = config
+        self.file_manager = file_manager
+        self.library_index = library_index
+        self._sessions: Dict[str, StreamSession] = {}
+        self._by_song: Dict[Tuple[str, str], StreamSession] = {}
+        self._tasks: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.sessions_started = 0
+        self.sessions_reused = 0
+        self.bytes_served = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config["PLAYBACK_PROXY_ENABLED"]
+
+    def _expire(self, now: float):
+        """移除已结束且长时间未访问的会话（需持有 self._lock）"""
+        expire_before = now - self.config["PLAYBACK_PROXY_SESSION_TTL"]
+        for token, session in list(self._sessions.items()):
+            if session.state in ("completed", "failed") and session.last_access < expire_before:
+                del self._sessions[token]
+                self._tasks.pop(token, None)
+                key = (session.mid, session.file_type)
+                if self._by_song.get(key) is session:
+                    del self._by_song[key]
+
+    def open(self, song_info: SongInfo, file_type: SongFileType, quality: str, url: str) -> StreamSession:
+        """获取或创建歌曲某音质的代理播放会话，新会话立即开始在后台下载"""
+        key = (song_info.mid, file_type.name)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._by_song.get(key)
+            if session is not None and session.state != "failed":
+                session.last_access = now
+                self.sessions_reused += 1
+                return session
+
+        base_name = self.file_manager.sanitize_filename(f"{song_info.name} - {song_info.singers}")
+        filepath, entry = self.library_index.claim_path(song_info.mid, file_type, quality, base_name)
+        session = StreamSession(
+            token=uuid.uuid4().hex,
+            mid=song_info.mid,
+            file_type=file_type.name,
+            quality=quality,
+            filepath=filepath,
+            created_at=now,
+            last_access=now
+        )
+        if entry is not None:
+            # 已在音乐库中，直接提供文件
+            session.state = "completed"
+            session.total = entry.size
+
+        with self._lock:
+            existing = self._by_song.get(key)
+            if existing is not None and existing.state != "failed":
+                self.sessions_reused += 1
+                return existing
+            self._sessions[session.token] = session
+            self._by_song[key] = session
+            if session.state == "pending":
+                self._tasks[session.token] = background_loop.submit(self._fetch(session, file_type, url))
+                self.sessions_started += 1
+        logger.info(f"代理播放 ({quality}): {filepath.name}")
+        return session
+
+    def get(self, token: str) -> Optional[StreamSession]:
+        """按令牌获取会话"""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None:
+                session.last_access = time.time()
+            return session
+
+    async def _fetch(self, session: StreamSession, file_type: SongFileType, url: str):
+        """从CDN下载到音乐目录，下载进度通知正在等待数据的播放请求"""
+        loop = asyncio.get_running_loop()
+
+        def _on_start(part_path: Path, total: Optional[int], segments):
+            with session.condition:
+                session.part_path = part_path
+                session.total = total
+                session.segments = segments
+                session.state = "streaming"
+                session.condition.notify_all()
+
+        def _on_progress(done: int, total: Optional[int]):
+            with session.condition:
+                session.condition.notify_all()
+
+        transfer = None
+        try:
+            # 与下载使用相同的来源标识，中断后两者都可以续传对方留下的 .part 文件
+            transfer = await self.file_manager.download_to_file(
+                url, session.filepath, source={"mid": session.mid, "quality": session.quality},
+                progress=_on_progress, on_start=_on_start
+            )
+            # 复用其他下载完成的文件时由对方登记到音乐库
+            if transfer and not transfer.reused:
+                await loop.run_in_executor(thread_pool, functools.partial(
+                    self.library_index.record, session.mid, file_type, session.quality, session.filepath
+                ))
+        except Exception as e:
+            logger.error(f"代理播放下载失败: {e}")
+        finally:
+            with session.condition:
+                if transfer:
+                    session.state = "completed"
+                    session.total = transfer.size
+                else:
+                    session.state = "failed"
+                session.condition.notify_all()
+
+    async def wait_for(self, mid: str, file_type: SongFileType):
+        """等待该歌曲该音质正在进行的代理下载结束（在后台事件循环中调用）"""
+        with self._lock:
+            session = self._by_song.get((mid, file_type.name))
+            task = self._tasks.get(session.token) if session is not None else None
+        if task is not None and not task.done():
+            await asyncio.wrap_future(task)
+
+    def is_reading(self, filepath: Path) -> bool:
+        """是否有播放请求正在读取该文件"""
+        with self._lock:
+            return any(s.readers and s.filepath == filepath for s in self._sessions.values())
+
+    def wait_started(self, session: StreamSession) -> bool:
+        """等待下载开始（得知文件大小），下载失败或超时返回False"""
+        with session.condition:
+            session.condition.wait_for(
+                lambda: session.state != "pending", self.config["PLAYBACK_PROXY_READ_TIMEOUT"]
+            )
+            return session.state in ("streaming", "completed")
+
+    @staticmethod
+    def _available_until(session: StreamSession, offset: int) -> int:
+        """从 offset 开始已下载的连续数据的结束位置（不含）"""
+        if session.state == "completed":
+            return session.total or 0
+        for segment in session.segments:
+            received = segment.start + segment.resumed + segment.bytes
+            if segment.start <= offset < received:
+                return received
+        return offset
+
+    def read(self, session: StreamSession, start: int, end: Optional[int]) -> Iterator[bytes]:
+        """读取 [start, end) 范围的数据（end 为None时读到文件结束），尚未下载的部分等待下载进度"""
+        chunk_size = self.config["DOWNLOAD_CHUNK_SIZE"]
+        timeout = self.config["PLAYBACK_PROXY_READ_TIMEOUT"]
+        with self._lock:
+            session.readers += 1
+        f = None
+        position = start
+        try:
+            while end is None or position < end:
+                with session.condition:
+                    ready = session.condition.wait_for(
+                        lambda: (self._available_until(session, position) > position
+                                 or session.state in ("completed", "failed")),
+                        timeout
+                    )
+                    available = self._available_until(session, position)
+                if available <= position:
+                    if not ready:
+                        logger.warning(f"代理播放等待数据超时: {session.filepath.name}")
+                    break
+
+                if f is None:
+                    # 下载完成后 .part 文件会被重命名为正式文件，已打开的文件不受影响；
+                    # 不使用缓冲，避免预读到分段尚未写入的区域（预分配的零字节）
+                    try:
+                        f = open(session.part_path or session.filepath, "rb", buffering=0)
+                    except FileNotFoundError:
+                        f = open(session.filepath, "rb", buffering=0)
+                    f.seek(position)
+
+                size = available - position
+                if end is not None:
+                    size = min(size, end - position)
+                data = f.read(min(size, chunk_size))
+                if not data:
+                    break
+                position += len(data)
+                with self._lock:
+                    self.bytes_served += len(data)
+                yield data
+        finally:
+            if f is not None:
+                f.close()
+            with self._lock:
+                session.readers -= 1
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """代理播放统计"""
+        with self._lock:
+            states: Dict[str, int] = {}
+            for session in self._sessions.values():
+                states[session.state] = states.get(session.state, 0) + 1
+            return {
+                "enabled": self.enabled,
+                "sessions": len(self._sessions),
+                "states": states,
+                "readers": sum(session.readers for session in self._sessions.values()),
+                "sessions_started": self.sessions_started,
+                "sessions_reused": self.sessions_reused,
+                "bytes_served": self.bytes_served
+            }
@@ -0,0 +1,258 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, Awaitable, Callable, TypeVar
+from qqmusic_api.exceptions.api_exception import CredentialExpiredError, CredentialInvalidError
+from .cdn_fetcher import SlowTransferError
+
+logger = logging.getLogger("qqmusic_web")
+
+T = TypeVar("T")
+
+# 与上游是否可用无关的错误（凭证问题只影响当前账号），不计入熔断统计
+IGNORED_ERRORS = (CredentialExpiredError, CredentialInvalidError)
+
+# 由本服务主动中断的请求（调用方取消、传输过慢后重新请求），不代表上游状态，不记录结果
+UNRECORDED_ERRORS = (asyncio.CancelledError, SlowTransferError)
+
+
+class UpstreamUnavailableError(Exception):
+    """上游暂不可用（熔断中或排队超时），请求未发出"""
+
+    def __init__(self, kind: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(f"上游服务暂不可用 ({kind}): {reason}")
+        self.kind = kind
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class UpstreamClass:
+    """单类上游请求的限流状态：令牌桶 + AIMD并发上限 + 熔断器"""
+
+    # 延迟超标或出错时并发上限乘以该系数
+    DECREASE_FACTOR = 0.7
+
+    def __init__(self, kind: str, rate: float, burst: int, concurrency: int, latency_target: float, config):
+        self.kind = kind
+        self.config = config
+        # 令牌桶
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        # AIMD 并发控制
+        self.max_concurrency = concurrency
+        self.limit = float(concurrency)
+        self.latency_target = latency_target
+        self.inflight = 0
+        self.decreased_at = 0.0
+        self._slots: Optional[asyncio.Condition] = None
+        # 熔断器
+        self.state = "closed"  # closed / open / half_open
+        self.opened_at = 0.0
+        self.outcomes = deque(maxlen=config["UPSTREAM_BREAKER_WINDOW"])
+        # 统计
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.latency_ewma: Optional[float] = None
+
+    @property
+    def slots(self) -> asyncio.Condition:
+        # 在后台事件循环中首次使用时创建
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        return self._slots
+
+    def take_token(self) -> float:
+        """取一个令牌，返回需要等待的秒数（0 表示立即可用）"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def check_breaker(self):
+        """熔断中直接失败；冷却结束后只放行一个探测请求"""
+        if self.state == "closed":
+            return
+        cooldown = self.config["UPSTREAM_BREAKER_COOLDOWN"]
+        # 探测请求被取消或排队失败时不会记录结果，超过冷却时间后重新放行一个
+        remaining = self.opened_at + cooldown - time.monotonic()
+        if remaining <= 0:
+            if self.state == "open":
+                logger.info(f"上游熔断冷却结束，放行探测请求: {self.kind}")
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return
+        self.rejected += 1
+        raise UpstreamUnavailableError(self.kind, "熔断中", max(1.0, remaining))
+
+    def record(self, ok: bool, latency: float):
+        """记录请求结果，调整并发上限和熔断状态"""
+        now = time.monotonic()
+        self.calls += 1
+        if ok:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.failures += 1
+
+        # AIMD：正常时每个完整窗口增加1，出错或延迟超标时按比例减小（每个延迟目标周期内最多一次）
+        if ok and latency <= self.latency_target:
+            self.limit = min(self.max_concurrency, self.limit + 1 / max(self.limit, 1))
+        elif now - self.decreased_at >= self.latency_target:
+            self.limit = max(1.0, self.limit * self.DECREASE_FACTOR)
+            self.decreased_at = now
+            logger.debug(f"上游并发上限下调: {self.kind} -> {self.limit:.1f}")
+
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+                logger.info(f"上游已恢复: {self.kind}")
+            else:
+                self._open(now)
+            return
+
+        self.outcomes.append(ok)
+        errors = self.outcomes.count(False)
+        if (self.state == "closed" and len(self.outcomes) >= self.config["UPSTREAM_BREAKER_MIN_CALLS"]
+                and errors / len(self.outcomes) >= self.config["UPSTREAM_BREAKER_ERROR_RATE"]):
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.outcomes.clear()
+        logger.warning(f"上游错误率过高，暂停请求 {self.config['UPSTREAM_BREAKER_COOLDOWN']} 秒: {self.kind}")
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(max(self.tokens, 0.0), 2),
+            "concurrency_limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "inflight": self.inflight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "recent_error_rate": round(self.outcomes.count(False) / len(self.outcomes), 4) if self.outcomes else 0.0,
+            "avg_latency_ms": round(self.latency_ewma * 1000, 2) if self.latency_ewma is not None else None,
+            "latency_target_ms": self.latency_target * 1000
+        }
+
+
+class UpstreamPermit:
+    """一次上游请求的许可；退出时记录结果并归还并发名额"""
+
+    def __init__(self, governor: "UpstreamGovernor", upstream: UpstreamClass):
+        self.governor = governor
+        self.upstream = upstream
+        self.started = 0.0
+        self.latency: Optional[float] = None
+        self.ok = True
+
+    def first_byte(self):
+        """收到响应头时调用，以首字节时间作为延迟（流式下载时不计入传输时间）"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def fail(self):
+        """标记请求失败"""
+        self.ok = False
+
+    def check_status(self, status: int):
+        """限流或服务器错误的HTTP状态码计为失败（URL失效等客户端错误不计入）"""
+        if status == 429 or status >= 500:
+            self.fail()
+
+    async def __aenter__(self) -> "UpstreamPermit":
+        await self.governor.acquire(self.upstream)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, UNRECORDED_ERRORS):
+            await self.governor.release(self.upstream)
+            return False
+        ok = self.ok and (exc_type is None or issubclass(exc_type, IGNORED_ERRORS))
+        latency = self.latency if self.latency is not None else time.monotonic() - self.started
+        self.upstream.record(ok, latency)
+        await self.governor.release(self.upstream)
+        return False
+
+
+class UpstreamGovernor:
+    """上游请求调度：按请求类别限速（令牌桶）、自适应调整并发（AIMD），错误率过高时熔断快速失败"""
+
+    def __init__(self, config):
+        self.config = config
+        self.classes: Dict[str, UpstreamClass] = {
+            kind: UpstreamClass(kind, limits["rate"], limits["burst"], limits["concurrency"],
+                                limits["latency_target"], config)
+            for kind, limits in config["UPSTREAM_LIMITS"].items()
+        }
+
+    def _class(self, kind: str, host: Optional[str] = None) -> UpstreamClass:
+        """取请求类别的限流状态；指定 host 时每个主机单独限流和熔断（按需创建）"""
+        if host is None:
+            return self.classes[kind]
+        name = f"{kind}:{host}"
+        upstream = self.classes.get(name)
+        if upstream is None:
+            limits = self.config["UPSTREAM_LIMITS"][kind]
+            upstream = UpstreamClass(name, limits["rate"], limits["burst"], limits["concurrency"],
+                                     limits["latency_target"], self.config)
+            self.classes[name] = upstream
+        return upstream
+
+    def permit(self, kind: str, host: Optional[str] = None) -> UpstreamPermit:
+        """获取请求许可（async with），熔断中或排队超时抛出 UpstreamUnavailableError
+
+        host 用于CDN等多主机的请求类别，避免单个主机异常时熔断所有主机的请求。
+        """
+        return UpstreamPermit(self, self._class(kind, host))
+
+    async def call(self, kind: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """在许可下执行上游请求"""
+        async with self.permit(kind):
+            return await factory()
+
+    async def acquire(self, upstream: UpstreamClass):
+        upstream.check_breaker()
+        timeout = self.config["UPSTREAM_QUEUE_TIMEOUT"]
+        deadline = time.monotonic() + timeout
+
+        wait = upstream.take_token()
+        if wait > timeout:
+            upstream.tokens += 1
+            upstream.rejected += 1
+            raise UpstreamUnavailableError(upstream.kind, "请求过于频繁", wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        async with upstream.slots:
+            try:
+                await asyncio.wait_for(
+                    upstream.slots.wait_for(lambda: upstream.inflight < int(upstream.limit)),
+                    max(0.0, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                upstream.rejected += 1
+                raise UpstreamUnavailableError(upstream.kind, "并发已满，排队超时", 1.0)
+            upstream.inflight += 1
+
+    async def release(self, upstream: UpstreamClass):
+        async with upstream.slots:
+            upstream.inflight -= 1
+            upstream.slots.notify_all()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """各类上游请求的限流、并发和熔断状态"""
+        # 主机级别的状态可能在事件循环中新增，先复制再遍历
+        return {kind: upstream.stats for kind, upstream in list(self.classes.items())}
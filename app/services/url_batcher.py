@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+from qqmusic_api.song import get_song_urls, SongFileType
+from .request_coalescer import credential_identity
+
+logger = logging.getLogger("qqmusic_web")
+
+class SongUrlBatcher:
+    """歌曲URL微批处理器：在短时间窗口内收集相同音质、相同凭证的请求，合并为一次上游调用"""
+
+    # 上游单次请求最多支持100个mid
+    UPSTREAM_LIMIT = 100
+
+    def __init__(self, config, upstream_governor=None):
+        self.config = config
+        self.upstream_governor = upstream_governor
+        self.window = config["URL_BATCH_WINDOW_MS"] / 1000
+        self.max_size = max(1, min(config["URL_BATCH_MAX_SIZE"], self.UPSTREAM_LIMIT))
+        self._pending: Dict[Tuple[SongFileType, str], Dict[str, Any]] = {}
+        self.requests = 0
+        self.upstream_calls = 0
+        self.batched_mids = 0
+
+    async def get_song_urls(self, mids: List[str], file_type: SongFileType = SongFileType.MP3_128,
+                            credential=None) -> Dict[str, Any]:
+        """获取歌曲URL（需在后台事件循环中调用），返回 {mid: url}"""
+        loop = asyncio.get_running_loop()
+        key = (file_type, credential_identity(credential))
+        futures: Dict[str, asyncio.Future] = {}
+        self.requests += 1
+
+        for mid in mids:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = {
+                    "credential": credential,
+                    "waiters": {},
+                    "timer": loop.call_later(self.window, self._flush, key)
+                }
+                self._pending[key] = batch
+
+            future = loop.create_future()
+            batch["waiters"].setdefault(mid, []).append(future)
+            futures[mid] = future
+            if len(batch["waiters"]) >= self.max_size:
+                self._flush(key)
+
+        results = await asyncio.gather(*futures.values())
+        return dict(zip(futures.keys(), results))
+
+    def _flush(self, key: Tuple[SongFileType, str]):
+        """结束收集窗口，发起上游请求"""
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch["timer"].cancel()
+        asyncio.ensure_future(self._execute(key[0], batch))
+
+    async def _execute(self, file_type: SongFileType, batch: Dict[str, Any]):
+        waiters: Dict[str, List[asyncio.Future]] = batch["waiters"]
+        mids = list(waiters)
+        self.upstream_calls += 1
+        self.batched_mids += len(mids)
+        logger.debug(f"批量获取 {file_type.name} URL: {len(mids)} 首")
+
+        try:
+            fetch = lambda: get_song_urls(mids, file_type=file_type, credential=batch["credential"])
+            if self.upstream_governor is not None:
+                urls = await self.upstream_governor.call("song_urls", fetch)
+            else:
+                urls = await fetch()
+        except Exception as e:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for mid, futures in waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(urls.get(mid))
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """微批处理统计信息"""
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "batched_mids": self.batched_mids,
+            "avg_batch_size": round(self.batched_mids / self.upstream_calls, 2) if self.upstream_calls else 0.0,
+            "pending_batches": len(self._pending),
+            "window_ms": self.config["URL_BATCH_WINDOW_MS"],
+            "max_size": self.max_size
+        }
@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlsplit, parse_qs
+from qqmusic_api.song import SongFileType
+from .request_coalescer import credential_identity
+
+logger = logging.getLogger("qqmusic_web")
+
+# 携带过期时间（十进制Unix时间戳，秒）的URL参数
+EXPIRY_PARAMS = ("expire", "expires", "expiry")
+# 只接受一天内的过期时间，超出范围时视为无法解析（使用默认有效期）
+EXPIRY_MAX_AHEAD = 24 * 3600
+
+
+def parse_url_expiry(url: str) -> Optional[float]:
+    """从签名URL的参数中解析过期时间（Unix时间戳），无法解析时返回None"""
+    try:
+        query = parse_qs(urlsplit(url).query)
+    except ValueError:
+        return None
+
+    now = time.time()
+    for name in EXPIRY_PARAMS:
+        for value in query.get(name, []):
+            if not value.isdigit():
+                continue
+            expires_at = int(value)
+            if now < expires_at <= now + EXPIRY_MAX_AHEAD:
+                return float(expires_at)
+    return None
+
+
+class PlayUrlCache:
+    """播放URL缓存：按 (mid, 音质, 账号) 缓存已获取的URL，并缓存"该音质无URL"的结果"""
+
+    def __init__(self, config, request_coalescer):
+        self.config = config
+        self.request_coalescer = request_coalescer
+        self.ttl = config["PLAY_URL_CACHE_TTL"]
+        self.negative_ttl = config["PLAY_URL_NEGATIVE_TTL"]
+        self.expiry_margin = config["PLAY_URL_EXPIRY_MARGIN"]
+        self.max_size = config["PLAY_URL_CACHE_SIZE"]
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _make_key(mid: str, file_type: SongFileType, credential) -> Tuple[str, str, str]:
+        return mid, file_type.name, credential_identity(credential)
+
+    def _ttl_for(self, url: Optional[str]) -> float:
+        """计算缓存有效期：优先使用URL中的过期时间，否则使用配置的TTL"""
+        if not url:
+            return self.negative_ttl
+        expires_at = parse_url_expiry(url)
+        if expires_at is None:
+            return self.ttl
+        return max(0.0, min(self.ttl, expires_at - time.time() - self.expiry_margin))
+
+    def get(self, mid: str, file_type: SongFileType, credential) -> Tuple[bool, Optional[str]]:
+        """查询缓存，返回 (是否命中, URL)；命中且URL为None表示已知该音质无URL"""
+        key = self._make_key(mid, file_type, credential)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def set(self, mid: str, file_type: SongFileType, credential, url: Optional[str]):
+        """写入缓存（url为None时作为否定结果缓存）"""
+        ttl = self._ttl_for(url)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        key = self._make_key(mid, file_type, credential)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, url or None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, mid: str, file_type: SongFileType, credential):
+        """使缓存条目失效（如URL下载失败时）"""
+        with self._lock:
+            self._entries.pop(self._make_key(mid, file_type, credential), None)
+
+    def clear(self) -> int:
+        """清空缓存，返回清除的条目数"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+    @staticmethod
+    def _normalize_url(url) -> Optional[str]:
+        # API可能返回列表，取第一个
+        if isinstance(url, (list, tuple)):
+            url = url[0] if url else None
+        return url or None
+
+    async def resolve_many(self, mids: List[str], file_type: SongFileType,
+                           credential=None) -> Dict[str, Optional[str]]:
+        """获取多首歌曲指定音质的URL，只向上游请求未缓存的部分"""
+        results: Dict[str, Optional[str]] = {}
+        missing = []
+        for mid in mids:
+            hit, url = self.get(mid, file_type, credential)
+            if hit:
+                results[mid] = url
+            else:
+                missing.append(mid)
+
+        if missing:
+            urls = await self.request_coalescer.get_song_urls(
+                missing, file_type=file_type, credential=credential
+            )
+            for mid in missing:
+                url = self._normalize_url(urls.get(mid))
+                self.set(mid, file_type, credential, url)
+                results[mid] = url
+        return results
+
+    async def resolve(self, mid: str, file_type: SongFileType, credential=None) -> Optional[str]:
+        """获取单首歌曲指定音质的URL（优先使用缓存）"""
+        return (await self.resolve_many([mid], file_type, credential)).get(mid)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / total, 4) if total else 0.0
+            }
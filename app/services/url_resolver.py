@@ -0,0 +1,82 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+from qqmusic_api.song import SongFileType
+from .upstream_governor import UpstreamUnavailableError
+
+logger = logging.getLogger("qqmusic_web")
+
+class UrlResolver:
+    """并发音质探测：同时请求所有音质的URL，按优先级返回最佳可用音质"""
+
+    def __init__(self, config, play_url_cache):
+        self.config = config
+        self.play_url_cache = play_url_cache
+        self._lock = threading.Lock()
+        self._tier_stats: Dict[str, Dict[str, float]] = {}
+
+    def _record(self, file_type: SongFileType, latency: float, available: bool, error: bool = False):
+        with self._lock:
+            stats = self._tier_stats.setdefault(file_type.name, {
+                "probes": 0, "available": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0
+            })
+            stats["probes"] += 1
+            stats["available"] += int(available)
+            stats["errors"] += int(error)
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    async def _probe(self, mid: str, file_type: SongFileType, credential) -> Optional[str]:
+        """获取单个音质的URL并记录耗时和可用性，出错时返回None（上游不可用时抛出异常）"""
+        started = time.monotonic()
+        try:
+            url = await self.play_url_cache.resolve(mid, file_type, credential)
+        except UpstreamUnavailableError:
+            raise
+        except Exception as e:
+            self._record(file_type, time.monotonic() - started, False, error=True)
+            logger.warning(f"获取 {file_type.name} URL失败: {e}")
+            return None
+        self._record(file_type, time.monotonic() - started, bool(url))
+        return url
+
+    def start(self, mid: str, quality_order: List[Tuple[SongFileType, str]],
+              credential=None) -> Dict[SongFileType, asyncio.Task]:
+        """同时开始获取所有音质的URL，返回各音质对应的任务"""
+        tasks = {
+            file_type: asyncio.ensure_future(self._probe(mid, file_type, credential))
+            for file_type, _ in quality_order
+        }
+        for task in tasks.values():
+            # 较低音质的任务可能不会被等待，避免其异常（上游不可用）被报告为未处理
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return tasks
+
+    async def resolve_best(self, mid: str, quality_order: List[Tuple[SongFileType, str]],
+                           credential=None) -> Optional[Tuple[SongFileType, str, str]]:
+        """返回 (音质类型, 音质名称, URL)；更高音质都确认不可用后才返回较低音质"""
+        tasks = self.start(mid, quality_order, credential)
+        for file_type, quality_name in quality_order:
+            url = await tasks[file_type]
+            if url:
+                # 较低音质的任务继续在后台完成，其结果会写入URL缓存
+                return file_type, quality_name, url
+        return None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """各音质的探测统计（耗时单位为毫秒）"""
+        with self._lock:
+            return {
+                name: {
+                    "probes": int(stats["probes"]),
+                    "available": int(stats["available"]),
+                    "errors": int(stats["errors"]),
+                    "availability": round(stats["available"] / stats["probes"], 4) if stats["probes"] else 0.0,
+                    "avg_latency_ms": round(stats["total_latency"] / stats["probes"] * 1000, 2) if stats["probes"] else 0.0,
+                    "max_latency_ms": round(stats["max_latency"] * 1000, 2)
+                }
+                for name, stats in self._tier_stats.items()
+            }
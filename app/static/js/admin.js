@@ -18,6 +18,8 @@ const infoBtn         = document.getElementById('infoBtn');
 const infoResult      = document.getElementById('infoResult');
 const clearMusicBtn   = document.getElementById('clearMusicBtn');
 const clearMusicResult = document.getElementById('clearMusicResult');
+const clearSearchCacheBtn = document.getElementById('clearSearchCacheBtn');
+const clearSearchCacheResult = document.getElementById('clearSearchCacheResult');
 
 // 事件绑定
 qqLoginBtn.addEventListener('click', () => generateQRCode('qq'));
@@ -26,6 +28,7 @@ checkStatusBtn.addEventListener('click', checkCredentialStatus);
 refreshBtn.addEventListener('click', refreshCredential);
 infoBtn.addEventListener('click', getCredentialInfo);
 clearMusicBtn.addEventListener('click', clearMusicFolder);
+clearSearchCacheBtn.addEventListener('click', clearSearchCache);
 
 // 当前活跃的会话ID
 let currentSessionId = null;
@@ -226,6 +229,26 @@ async function clearMusicFolder() {
     }
 }
 
+// 清空搜索缓存
+async function clearSearchCache() {
+    try {
+        showLoading(clearSearchCacheResult);
+        clearSearchCacheBtn.disabled = true;
+
+        const response = await fetch(`${BASE_URL}/admin/api/search_cache/clear`, { method: 'POST' });
+        if (!response.ok) {
+            const errData = await response.json().catch(() => ({}));
+            throw new Error(errData.error || `HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        showResult(clearSearchCacheResult, data.message, data.success ? 'success' : 'error');
+    } catch (error) {
+        showResult(clearSearchCacheResult, `清空搜索缓存失败: ${error.message}`, 'error');
+    } finally {
+        clearSearchCacheBtn.disabled = false;
+    }
+}
+
 // 工具函数
 function showLoading(el) { 
     el.innerHTML = '<div class="loading-spinner"></div>加载中...'; 
@@ -100,14 +100,14 @@ function toggleLyrics() {
     }
 }
 
-// 智能封面获取函数
+// 智能封面获取函数（专辑封面经由本地缓存接口获取，列表和播放器使用同一尺寸，共用一份缓存）
 function getSmartCoverUrl(songData) {
     if (!songData) {
         return 'https://y.gtimg.cn/music/photo_new/T002R800x800M000003y8dsH2wBHlo_1.jpg';
     }
     const albumMid = songData.album_mid || songData.album?.mid;
     if (albumMid) {
-        return `https://y.gtimg.cn/music/photo_new/T002R800x800M000${albumMid}.jpg`;
+        return `/api/cover/${encodeURIComponent(albumMid)}?size=500`;
     }
 
     const vsValues = songData.vs || songData.raw_data?.vs || [];
@@ -194,7 +194,8 @@ function initPlayer() {
 async function fetchLyrics(songMid) {
     try {
         console.log('获取歌词，歌曲MID:', songMid);
-        const response = await fetch(`/api/lyric/${songMid}`);
+        // parsed=1: 由服务端解析时间轴，无需在前端用正则解析
+        const response = await fetch(`/api/lyric/${songMid}?parsed=1`);
         if (!response.ok) throw new Error('获取歌词失败');
         const data = await response.json();
         console.log('歌词数据:', data);
@@ -256,7 +257,7 @@ function displayLyrics(lyricsData) {
 
     // 解析主歌词
     if (lyricsData.lyric) {
-        const mainLyrics = parseLrc(lyricsData.lyric);
+        const mainLyrics = lyricsData.parsed ? lyricsData.parsed.lyric : parseLrc(lyricsData.lyric);
         currentLyrics = mainLyrics;
 
         if (mainLyrics.length > 0) {
@@ -271,7 +272,7 @@ function displayLyrics(lyricsData) {
 
     // 解析翻译歌词（如果有）
     if (lyricsData.trans && currentLyrics.length > 0) {
-        const transLyrics = parseLrc(lyricsData.trans);
+        const transLyrics = lyricsData.parsed ? lyricsData.parsed.trans : parseLrc(lyricsData.trans);
         transLyrics.forEach(transLyric => {
             // 找到对应时间的主歌词，添加翻译
             const mainIndex = currentLyrics.findIndex(l => Math.abs(l.time - transLyric.time) < 0.1);
@@ -1,17 +1,110 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Awaitable, Callable, List
+
+logger = logging.getLogger("qqmusic_web")
 
 # 线程池用于执行阻塞操作
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
-def run_async(coro):
-    """运行异步函数"""
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(coro)
-    else:
-        future = asyncio.run_coroutine_threadsafe(coro, loop)
-        return future.result()
\ No newline at end of file
+
+class BackgroundLoop:
+    """常驻后台线程中的事件循环，所有异步任务都提交到这里执行"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._context = contextvars.copy_context()
+        self._shutdown_hooks: List[Callable[[], Awaitable[Any]]] = []
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """获取事件循环（首次访问时启动）"""
+        if self._loop is None:
+            self.start()
+        return self._loop
+
+    def start(self):
+        """启动后台事件循环线程"""
+        with self._lock:
+            if self._loop is not None:
+                return
+            started = threading.Event()
+            loop = asyncio.new_event_loop()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                started.set()
+                try:
+                    loop.run_forever()
+                finally:
+                    loop.close()
+
+            self._thread = threading.Thread(target=_run, name="async-loop", daemon=True)
+            self._thread.start()
+            started.wait()
+            self._loop = loop
+            logger.info("后台事件循环已启动")
+
+    def is_loop_thread(self) -> bool:
+        """当前是否运行在后台事件循环线程中"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def run_in_context(self, func: Callable, *args):
+        """在提交任务所用的上下文中执行函数（用于设置 contextvars）"""
+        return self._context.run(func, *args)
+
+    def submit(self, coro) -> Future:
+        """提交协程到后台事件循环"""
+        loop = self.loop
+        # 任务会继承这里的上下文副本，从而共享通过 run_in_context 设置的变量
+        return self._context.copy().run(asyncio.run_coroutine_threadsafe, coro, loop)
+
+    def add_shutdown_hook(self, hook: Callable[[], Awaitable[Any]]):
+        """注册停止事件循环前需要执行的异步清理函数（在取消其余任务之后执行）"""
+        self._shutdown_hooks.append(hook)
+
+    async def _shutdown(self):
+        # 先取消并等待进行中的任务（下载等在 finally 中保存进度），再关闭它们使用的连接池、数据库等
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"执行清理函数失败: {e}")
+
+    def stop(self, timeout: float = 10):
+        """执行清理函数并停止后台事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None:
+                return
+            self._loop = None
+
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception as e:
+            logger.error(f"停止后台事件循环时出错: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        logger.info("后台事件循环已停止")
+
+
+background_loop = BackgroundLoop()
+
+
+def run_async(coro, timeout: float = None):
+    """在后台事件循环中运行异步函数并等待结果"""
+    if background_loop.is_loop_thread():
+        coro.close()
+        raise RuntimeError("不能在后台事件循环线程中同步等待协程")
+    return background_loop.submit(coro).result(timeout)